@@ -15,3 +15,6 @@ class Config(object):
 
     # the log verbosity level
     LOG_LEVEL = "info"
+
+    # the directory of the parsed stage steps cache
+    CACHE_DIR = "/var/cache/deepsea-cli"
@@ -5,9 +5,12 @@ This module is responsible for the parsing of DeepSea stage files
 from __future__ import absolute_import
 from __future__ import print_function
 
+import hashlib
 import logging
 import os
+import pickle
 import pwd
+import re
 import time
 import sys
 
@@ -19,8 +22,10 @@ from multiprocessing import Process, Queue
 import salt.client
 import salt.minion
 import salt.exceptions
+import salt.runner
 
 from .common import redirect_output
+from .config import Config
 
 
 # pylint: disable=C0103
@@ -85,6 +90,7 @@ class SaltClient(object):
     _CALLER_ = None
     _LOCAL_ = None
     _MASTER_ = None
+    _RUNNER_ = None
 
     @classmethod
     def _opts(cls):
@@ -121,6 +127,16 @@ class SaltClient(object):
             cls._MASTER_ = salt.minion.MasterMinion(_opts)
         return cls._MASTER_
 
+    @classmethod
+    def runner(cls):
+        """
+        Initializes and retrieves the Salt runner client instance
+        """
+        if cls._RUNNER_ is None:
+            cls._RUNNER_ = salt.runner.RunnerClient(
+                salt.config.master_config('/etc/salt/master'))
+        return cls._RUNNER_
+
 
 class SLSRenderer(object):
     """
@@ -139,68 +155,138 @@ class SLSRenderer(object):
 
         return cls._render_in_master(state_name)
 
-    @classmethod
-    def _render_in_minion(cls, state_name, target, retry=True):
-        logger.info("Rendering states=%s on=%s", state_name, target)
+    @staticmethod
+    def _buffers():
+        """
+        Returns a pair of buffers to capture stdout and stderr
+        """
         if sys.version_info >= (3, 0):
-            err = StringIO()
-            out = StringIO()
-        else:
-            err = BytesIO()
-            out = BytesIO()
+            return StringIO(), StringIO()
+        return BytesIO(), BytesIO()
 
-        out2 = None
-        err2 = None
+    @classmethod
+    def _publish(cls, target, states, tgt_type):
+        """
+        Publishes a deepsea.show_low_sls job without waiting for the result.
+        Salt reports unmatched targets on stdout, hence the output is
+        captured per job.
+        """
+        out, err = cls._buffers()
         with redirect_output(out, err):
-            if isinstance(state_name, str):
-                state_name = [state_name]
+            pub_data = SaltClient.local().run_job(target, 'deepsea.show_low_sls',
+                                                  list(states), tgt_type=tgt_type,
+                                                  listen=True)
+        job = (pub_data, out.getvalue(), err.getvalue())
+        out.close()
+        err.close()
+        return job
+
+    @classmethod
+    def _collect(cls, job, target, tgt_type):
+        """
+        Waits for the returns of a published job
+        """
+        pub_data, out_str, err_str = job
+        res = {}
+        if not pub_data:
+            return res, out_str, err_str
+        out, err = cls._buffers()
+        with redirect_output(out, err):
+            for fn_ret in SaltClient.local().get_cli_event_returns(
+                    pub_data['jid'], pub_data['minions'], tgt=target,
+                    tgt_type=tgt_type):
+                if fn_ret:
+                    for minion, data in fn_ret.items():
+                        res[minion] = data.get('ret', {})
+        out_str += out.getvalue()
+        err_str += err.getvalue()
+        out.close()
+        err.close()
+        return res, out_str, err_str
 
-            res = SaltClient.local().cmd(target, 'deepsea.show_low_sls',
-                                         state_name, tgt_type="compound")
+    @staticmethod
+    def _module_missing(states):
+        return isinstance(states, str) and states.endswith("is not available.")
 
-            logger.debug("Rendering result: %s", res)
-            for minion, states in res.items():
-                if isinstance(states, str):
+    @classmethod
+    def render_targets(cls, states_by_target):
+        """
+        Renders the states of several targets with one job per target
+        expression. All jobs are published before any result is collected,
+        so the minions render concurrently. Minions without the deepsea
+        module are synced and rendered again, the others are not.
+        Args:
+            states_by_target (dict): compound target -> list of state names
+        Returns:
+            dict: target -> (result, stdout, stderr)
+        """
+        logger.info("Rendering states on %s targets", len(states_by_target))
+        jobs = {}
+        for target, states in states_by_target.items():
+            jobs[target] = cls._publish(target, states, "compound")
+
+        results = {}
+        missing = defaultdict(list)
+        for target, job in jobs.items():
+            results[target] = cls._collect(job, target, "compound")
+            logger.debug("Rendering result: %s", results[target][0])
+            for minion, states in results[target][0].items():
+                if cls._module_missing(states):
                     logger.info("call to deepsea module returned: %s", states)
-                    if states.endswith("is not available."):
-                        if not retry:
-                            res = StateRenderingException(
-                                minion, None,
-                                ['deepsea module not available'])
-                            break
-
-                        logger.info("deepsea module not available: syncing "
-                                    "modules")
-                        SaltClient.local().cmd(target, 'saltutil.sync_modules',
-                                               [], tgt_type="compound")
-                        res, out2, err2 = cls._render_in_minion(state_name,
-                                                                target, False)
-                else:
-                    for state, steps in states.items():
-                        if steps and isinstance(steps[0], str):
-                            res = StateRenderingException(minion, state, steps)
+                    missing[target].append(minion)
+
+        if missing:
+            minions = sorted({minion for mins in missing.values()
+                              for minion in mins})
+            logger.info("deepsea module not available on %s: syncing modules",
+                        minions)
+            out, err = cls._buffers()
+            with redirect_output(out, err):
+                SaltClient.local().cmd(minions, 'saltutil.sync_modules', [],
+                                       tgt_type="list")
+            out.close()
+            err.close()
+            jobs = {}
+            for target, mins in missing.items():
+                jobs[target] = cls._publish(mins, states_by_target[target], "list")
+            for target, job in jobs.items():
+                res, _, _ = cls._collect(job, missing[target], "list")
+                results[target][0].update(res)
 
-            if not res:
-                # this is the case where there was some problem but salt
-                # hides the problem internally and prints something to stdout
-                res = StateRenderingException(
-                    target, ", ".join(state_name),
-                    ["{}: {}".format(target, out.getvalue())])
+        for target, (res, out_str, _) in results.items():
+            cls._check_result(target, states_by_target[target], res, out_str)
+        return results
 
-        if isinstance(res, RenderingException):
-            # pylint: disable=E0702
-            raise res
-        if out2 is not None and err is not None:
-            out_str = out2
-            err_str = err2
-        else:
-            out_str = out.getvalue()
-            err_str = err.getvalue()
-            logger.debug("OUT:\n%s", out.getvalue())
-            logger.debug("ERR:\n%s", err.getvalue())
+    @classmethod
+    def _check_result(cls, target, state_name, res, out_str):
+        """
+        Raises a StateRenderingException for failed renderings
+        """
+        for minion, states in res.items():
+            if isinstance(states, str):
+                if cls._module_missing(states):
+                    raise StateRenderingException(
+                        minion, None, ['deepsea module not available'])
+                continue
+            for state, steps in states.items():
+                if steps and isinstance(steps[0], str):
+                    raise StateRenderingException(minion, state, steps)
+
+        if not res:
+            # this is the case where there was some problem but salt
+            # hides the problem internally and prints something to stdout
+            raise StateRenderingException(
+                target, ", ".join(state_name),
+                ["{}: {}".format(target, out_str)])
 
-        out.close()
-        err.close()
+    @classmethod
+    def _render_in_minion(cls, state_name, target):
+        logger.info("Rendering states=%s on=%s", state_name, target)
+        if isinstance(state_name, str):
+            state_name = [state_name]
+        res, out_str, err_str = cls.render_targets({target: state_name})[target]
+        logger.debug("OUT:\n%s", out_str)
+        logger.debug("ERR:\n%s", err_str)
         return res, out_str, err_str
 
     @classmethod
@@ -255,6 +341,254 @@ class SLSRenderer(object):
         return res, out, err
 
 
+class StepsCache(object):
+    """
+    Persistent cache of parsed stage steps. Each entry is stored with a hash
+    of the salt states, the pillar configuration and the accepted minions,
+    and is only used while the hash matches.
+
+    The rendering of most stages calls runners. The files rendered for a
+    stage are scanned for these calls and each entry also stores a hash of
+    the runner inputs the key does not cover. Stages calling a runner with
+    unknown inputs are not cached.
+    """
+    VERSION = 3
+    SALT_DIR = "/srv/salt"
+    PILLAR_DIRS = ["/srv/pillar/ceph/stack"]
+    PILLAR_FILES_DIRS = ["/srv/pillar", "/srv/pillar/ceph"]
+    MINIONS_DIR = "/etc/salt/pki/master/minions"
+    MINION_CACHE_DIR = "/var/cache/salt/master/minions"
+
+    # Runners, or runner modules, that only read the salt tree, the pillar
+    # and the minion list, which are part of the key. The checksums of
+    # changed live in the salt tree.
+    TREE_RUNNERS = ['advise', 'changed', 'orderednodes', 'select']
+    # Runners that also read grains or mine data from the minion cache
+    CACHE_RUNNERS = ['validate']
+    # Runners that query the minions. Their result for these arguments is
+    # hashed, e.g. ready.check only fails with fail_on_warning set, which
+    # comes from the pillar.
+    LIVE_RUNNERS = {'cephprocesses.mon': {'cluster': 'ceph'},
+                    'ready.check': {'cluster': 'ceph', 'fail_on_warning': True}}
+
+    @staticmethod
+    def _hash_file(digest, path):
+        digest.update(path.encode('utf-8'))
+        try:
+            with open(path, 'rb') as sls_file:
+                digest.update(sls_file.read())
+        except (IOError, OSError):
+            pass
+
+    @classmethod
+    def _hash_tree(cls, digest, path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                if not filename.endswith('.pyc'):
+                    cls._hash_file(digest, os.path.join(root, filename))
+
+    @classmethod
+    def key(cls, stage_name, hide_state_steps, only_visible_steps):
+        """
+        Returns the hash of everything the parsing of the stage depends on
+        """
+        digest = hashlib.sha256()
+        digest.update("{}:{}:{}:{}".format(cls.VERSION, stage_name,
+                                           hide_state_steps,
+                                           only_visible_steps).encode('utf-8'))
+        # the states of a stage live in the tree of its top level directory,
+        # e.g. /srv/salt/ceph for ceph.stage.3
+        cls._hash_tree(digest, os.path.join(cls.SALT_DIR, stage_name.split('.')[0]))
+        cls._hash_tree(digest, os.path.join(cls.SALT_DIR, "_modules"))
+        for path in cls.PILLAR_DIRS:
+            cls._hash_tree(digest, path)
+        for path in cls.PILLAR_FILES_DIRS:
+            if os.path.isdir(path):
+                for filename in sorted(os.listdir(path)):
+                    if filename.endswith('.sls'):
+                        cls._hash_file(digest, os.path.join(path, filename))
+        if os.path.isdir(cls.MINIONS_DIR):
+            for minion in sorted(os.listdir(cls.MINIONS_DIR)):
+                digest.update(minion.encode('utf-8'))
+        return digest.hexdigest()
+
+    @classmethod
+    def _sls_file(cls, name):
+        """
+        Returns the file of an sls name, the same way salt resolves it
+        """
+        path = os.path.join(cls.SALT_DIR, *name.split('.'))
+        for filename in ["{}.sls".format(path), os.path.join(path, "init.sls")]:
+            if os.path.isfile(filename):
+                return filename
+        return None
+
+    @classmethod
+    def _includes(cls, path, content):
+        """
+        Returns the sls names included by a file. Includes rendered by jinja,
+        e.g. the selection of default.sls by a pillar value, are skipped. The
+        selected file shows up in the rendered states instead.
+        """
+        package = os.path.relpath(os.path.dirname(path), cls.SALT_DIR).split(os.sep)
+        names = []
+        in_include = False
+        for line in content.splitlines():
+            if line.startswith('include:'):
+                in_include = True
+                continue
+            if not in_include or not line.strip():
+                continue
+            match = re.match(r"\s+-\s+(\S+)\s*$", line)
+            if not match:
+                in_include = False
+                continue
+            name = match.group(1)
+            if '{' in name:
+                continue
+            if name.startswith('.'):
+                dots = len(name) - len(name.lstrip('.'))
+                base = package[:len(package) - dots + 1]
+                name = '.'.join(base + [name.lstrip('.')])
+            names.append(name)
+        return names
+
+    @classmethod
+    def runners(cls, sls_names):
+        """
+        Returns the runners called by the files of the sls names and by the
+        files they include. A runner named by a jinja expression is None.
+        """
+        found = set()
+        seen = set()
+        pending = list(sls_names)
+        while pending:
+            name = pending.pop()
+            if not name or name in seen:
+                continue
+            seen.add(name)
+            path = cls._sls_file(name)
+            if path is None:
+                continue
+            try:
+                with open(path, 'r') as sls_file:
+                    content = sls_file.read()
+            except (IOError, OSError):
+                continue
+            for match in re.finditer(r"saltutil\.runner(?:'\])?\(\s*(\S+?)\s*[,)]", content):
+                runner = re.match(r"""^['"]([\w.]+)['"]$""", match.group(1))
+                found.add(runner.group(1) if runner else None)
+            pending.extend(cls._includes(path, content))
+        return found
+
+    @classmethod
+    def _call(cls, runner, kwargs):
+        """
+        Returns the result of a runner, its output is discarded
+        """
+        out, err = SLSRenderer._buffers()
+        with redirect_output(out, err):
+            try:
+                result = SaltClient.runner().cmd(runner, kwarg=kwargs, print_event=False)
+            # pylint: disable=W0703
+            except Exception as ex:
+                result = ex
+        out.close()
+        err.close()
+        if isinstance(result, Exception):
+            logger.info("calling runner %s failed: %s", runner, result)
+            return None
+        return result
+
+    @classmethod
+    def inputs(cls, runners):
+        """
+        Returns the hash of the runner inputs that are not part of the key,
+        or None if the inputs of a runner are unknown
+        """
+        digest = hashlib.sha256()
+        minion_cache = False
+        for runner in sorted(runners, key=str):
+            module = runner.split('.')[0] if runner else None
+            if runner in cls.LIVE_RUNNERS:
+                result = cls._call(runner, cls.LIVE_RUNNERS[runner])
+                if result is None:
+                    return None
+                digest.update("{}:{!r}".format(runner, result).encode('utf-8'))
+            elif runner in cls.CACHE_RUNNERS or module in cls.CACHE_RUNNERS:
+                minion_cache = True
+            elif runner not in cls.TREE_RUNNERS and module not in cls.TREE_RUNNERS:
+                logger.info("runner %s has unknown inputs", runner)
+                return None
+        if minion_cache:
+            cls._hash_tree(digest, cls.MINION_CACHE_DIR)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _path(stage_name, hide_state_steps, only_visible_steps):
+        return os.path.join(Config.CACHE_DIR, "{}-{:d}{:d}.pickle".format(
+            stage_name, hide_state_steps, only_visible_steps))
+
+    @classmethod
+    def load(cls, stage_name, hide_state_steps, only_visible_steps, key):
+        """
+        Returns the cached (steps, out, notifications) tuple or None. The
+        runner inputs are checked once the key matches.
+        """
+        path = cls._path(stage_name, hide_state_steps, only_visible_steps)
+        try:
+            with open(path, 'rb') as cache_file:
+                entry = pickle.load(cache_file)
+        # pylint: disable=W0703
+        except Exception as ex:
+            if os.path.exists(path):
+                logger.info("ignoring steps cache %s: %s", path, ex)
+            return None
+        if entry.get('key') != key:
+            logger.info("steps cache of %s is outdated", stage_name)
+            return None
+        if cls.inputs(entry['runners']) != entry['inputs']:
+            logger.info("runner results of %s changed", stage_name)
+            return None
+        logger.info("using steps cache of %s", stage_name)
+        return entry['steps'], entry['out'], entry['notifications']
+
+    @classmethod
+    def store(cls, stage_name, hide_state_steps, only_visible_steps, key,
+              steps, out, notifications, runners, inputs):
+        """
+        Writes the cache entry of a stage
+        """
+        path = cls._path(stage_name, hide_state_steps, only_visible_steps)
+        tmp_path = "{}.{}".format(path, os.getpid())
+        try:
+            if not os.path.isdir(Config.CACHE_DIR):
+                os.makedirs(Config.CACHE_DIR, 0o700)
+            with open(tmp_path, 'wb') as cache_file:
+                pickle.dump({'key': key, 'steps': steps, 'out': out,
+                             'notifications': notifications,
+                             'runners': runners, 'inputs': inputs},
+                            cache_file, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, path)
+        # pylint: disable=W0703
+        except Exception as ex:
+            logger.warning("failed to write steps cache %s: %s", path, ex)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @classmethod
+    def clean(cls, stage_name=None):
+        """
+        Removes the cache entries of a stage, or all entries
+        """
+        if not os.path.isdir(Config.CACHE_DIR):
+            return
+        for filename in os.listdir(Config.CACHE_DIR):
+            if stage_name is None or filename.startswith("{}-".format(stage_name)):
+                os.remove(os.path.join(Config.CACHE_DIR, filename))
+
+
 class SLSParser(object):
     """
     SLS files parser
@@ -286,19 +620,72 @@ class SLSParser(object):
         for l in listeners:
             l.stage_parsing_state(states, minion)
 
+    @staticmethod
+    def clean_cache(stage_name):
+        """
+        Removes the cached steps of stage_name, or of all stages if None
+        """
+        StepsCache.clean(stage_name)
+
     @classmethod
     def parse_stage(cls, stage_name, hide_state_steps, only_visible_steps,
-                    monitor_listeners=None):
+                    monitor_listeners=None, use_cache=True):
+        """
+        Parses the stage, or returns the cached steps if neither the states,
+        the pillar nor the minions changed since the last parsing. The
+        parsing notifications are sent in either case.
+        """
+        if not use_cache:
+            return cls._parse_stage(stage_name, hide_state_steps,
+                                    only_visible_steps, monitor_listeners)
+        t0 = time.time()
+        key = StepsCache.key(stage_name, hide_state_steps, only_visible_steps)
+        cached = StepsCache.load(stage_name, hide_state_steps,
+                                 only_visible_steps, key)
+        logger.info("checking steps cache took: %ss", time.time()-t0)
+        if cached:
+            steps, out, notifications = cached
+            for states, minion in notifications:
+                SLSParser.notify_listener(monitor_listeners or [], states, minion)
+            return steps, out
+        notifications = []
+        sls_names = set([stage_name])
+        steps, out = cls._parse_stage(stage_name, hide_state_steps,
+                                      only_visible_steps, monitor_listeners,
+                                      notifications, sls_names)
+        runners = StepsCache.runners(sls_names)
+        inputs = StepsCache.inputs(runners)
+        if inputs is None:
+            logger.info("not caching steps of %s, its rendering depends on "
+                        "unknown runner inputs", stage_name)
+        else:
+            StepsCache.store(stage_name, hide_state_steps, only_visible_steps,
+                             key, steps, out, notifications, runners, inputs)
+        return steps, out
+
+    @classmethod
+    def _parse_stage(cls, stage_name, hide_state_steps, only_visible_steps,
+                     monitor_listeners=None, notifications=None, sls_names=None):
         if monitor_listeners is None:
             monitor_listeners = []
+        if notifications is None:
+            notifications = []
+        if sls_names is None:
+            sls_names = set()
+
+        def notify(states, minion=None):
+            notifications.append((sorted(states), minion))
+            sls_names.update(states)
+            SLSParser.notify_listener(monitor_listeners, states, minion)
 
         steps = []
         t0 = time.time()
-        SLSParser.notify_listener(monitor_listeners, [stage_name])
+        notify([stage_name])
         stage, out, _ = SLSRenderer.render(stage_name)
         t1 = time.time()
         logger.info("parsing stage sls file took: %ss", t1-t0)
         for step_dict in stage:
+            sls_names.add(step_dict.get('__sls__'))
             step = cls.parse_step(step_dict)
             if step:
                 steps.append(step)
@@ -318,8 +705,11 @@ class SLSParser(object):
         states_rendering = defaultdict(lambda: defaultdict(
             lambda: defaultdict(dict)))
         for target, states in states_to_render.items():
-            SLSParser.notify_listener(monitor_listeners, states, target)
-            res, _, _ = SLSRenderer.render(list(states), target)
+            notify(states, target)
+        rendered = SLSRenderer.render_targets(
+            {target: sorted(states) for target, states in states_to_render.items()})
+        for target, states in states_to_render.items():
+            res, _, _ = rendered[target]
             for minion, state_res in res.items():
                 if isinstance(state_res, list):
                     assert len(states) == 1
@@ -337,6 +727,7 @@ class SLSParser(object):
                     if minion not in step.target_expanded:
                         step.target_expanded.append(minion)
                     for s_step_dict in state_steps:
+                        sls_names.add(s_step_dict.get('__sls__'))
                         s_step = cls.parse_step(s_step_dict, minion)
                         if s_step and (not only_visible_steps or s_step.visible):
                             step.steps[minion].append(s_step)
@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock, patch
+
 from .helper import SaltTestCase
-from ..stage_parser import SLSParser, SaltRunner, SaltExecutionFunction, \
-                           StageRenderingException, SaltState, \
-                           SaltStateFunction, StateRenderingException
+from ..config import Config
+from ..stage_parser import SLSParser, SLSRenderer, SaltRunner, \
+                           SaltExecutionFunction, StageRenderingException, \
+                           SaltState, SaltStateFunction, \
+                           StateRenderingException, StepsCache
 
 
 class TestStageParser(SaltTestCase):
@@ -480,3 +489,130 @@ error state:
         self.assertIsInstance(ctx.exception.pretty_error_desc_str(), str)
         self.assertIn("No minions matched the target",
                       ctx.exception.pretty_error_desc_str())
+
+    def test_render_targets(self):
+        self.write_state_file("test.test-state105", {
+            'nop state': {
+                'test.nop': []
+            }
+        })
+
+        minion = self.minions()[0]
+        res = SLSRenderer.render_targets({
+            '*': ['test.test-state105'],
+            minion: ['test.test-state105']
+        })
+
+        self.assertEqual(set(res.keys()), set(['*', minion]))
+        self.assertEqual(set(res['*'][0].keys()), set(self.minions()))
+        self.assertEqual(list(res[minion][0].keys()), [minion])
+        self.assertIn('test.test-state105', res[minion][0][minion])
+
+    def test_parse_stage_cache(self):
+        SLSParser.clean_cache("test.test-orch106")
+        self.write_state_file("test.test-orch106", [
+            ('test runner', {
+                'salt.runner': [{
+                    'name': 'jobs.active'
+                }]
+            })
+        ])
+
+        steps, _ = SLSParser.parse_stage("test.test-orch106", False, False)
+        cached, _ = SLSParser.parse_stage("test.test-orch106", False, False)
+        self.assertEqual([str(s) for s in cached], [str(s) for s in steps])
+
+        self.write_state_file("test.test-orch106", [
+            ('test runner', {
+                'salt.runner': [{
+                    'name': 'jobs.last_run'
+                }]
+            })
+        ], overwrite=True)
+
+        steps, _ = SLSParser.parse_stage("test.test-orch106", False, False)
+        self.assertEqual(steps[0].function, "jobs.last_run")
+
+
+class TestStepsCache(unittest.TestCase):
+    """
+    Parses stage 0 of this repository's salt tree with the salt calls mocked
+    """
+
+    SALT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', '..', 'srv', 'salt')
+
+    STAGE = [{'__id__': 'sync master', '__sls__': 'ceph.stage.prep.master.default',
+              'state': 'salt', 'fun': 'state', 'tgt': 'admin', 'sls': 'ceph.sync'},
+             {'__id__': 'sync', '__sls__': 'ceph.stage.prep.minion.default',
+              'state': 'salt', 'fun': 'state', 'tgt': 'data*', 'sls': 'ceph.sync'}]
+
+    SYNC = [{'__id__': 'load modules', '__sls__': 'ceph.sync.default',
+             'state': 'module', 'fun': 'run', 'name': 'saltutil.sync_all'}]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.minion_cache = os.path.join(self.tmpdir, 'minions')
+        os.makedirs(self.minion_cache)
+        self.runner_result = True
+        self.patches = [
+            patch.object(Config, 'CACHE_DIR', os.path.join(self.tmpdir, 'cache')),
+            patch.object(StepsCache, 'SALT_DIR', self.SALT_DIR),
+            patch.object(StepsCache, 'PILLAR_DIRS', []),
+            patch.object(StepsCache, 'PILLAR_FILES_DIRS', []),
+            patch.object(StepsCache, 'MINIONS_DIR', os.path.join(self.tmpdir, 'keys')),
+            patch.object(StepsCache, 'MINION_CACHE_DIR', self.minion_cache),
+            patch.object(StepsCache, '_call',
+                         side_effect=lambda runner, kwargs: self.runner_result),
+            patch.object(SLSRenderer, 'render', return_value=(self.STAGE, "", "")),
+            patch.object(SLSRenderer, 'render_targets', return_value={
+                'admin': ({'admin': {'ceph.sync': self.SYNC}}, "", ""),
+                'data*': ({'data1': {'ceph.sync': self.SYNC}}, "", "")})]
+        self.mocks = [item.start() for item in self.patches]
+
+    def tearDown(self):
+        for item in self.patches:
+            item.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def parse(self, listeners=None):
+        return SLSParser.parse_stage("ceph.stage.0", False, False, listeners)
+
+    def test_runners(self):
+        runners = StepsCache.runners(['ceph.stage.0', 'ceph.stage.prep.master.default',
+                                      'ceph.stage.prep.minion.default'])
+        self.assertEqual(runners, set(['validate.setup', 'advise.salt_run',
+                                       'cephprocesses.mon', 'orderednodes.unique']))
+
+    def test_parse_stage_cache_hit(self):
+        steps, _ = self.parse()
+        listener = MagicMock()
+        cached, _ = self.parse([listener])
+
+        self.assertEqual(self.mocks[7].call_count, 1)
+        self.assertEqual(self.mocks[8].call_count, 1)
+        self.assertEqual([str(s) for s in cached], [str(s) for s in steps])
+        self.assertEqual(listener.stage_parsing_state.call_count, 3)
+
+    def test_parse_stage_live_runner_changed(self):
+        self.parse()
+        self.runner_result = False
+        self.parse()
+
+        self.assertEqual(self.mocks[7].call_count, 2)
+        self.mocks[6].assert_called_with('cephprocesses.mon', {'cluster': 'ceph'})
+
+    def test_parse_stage_minion_cache_changed(self):
+        self.parse()
+        with open(os.path.join(self.minion_cache, 'mine.p'), 'w') as mine_file:
+            mine_file.write('changed')
+        self.parse()
+
+        self.assertEqual(self.mocks[7].call_count, 2)
+
+    def test_parse_stage_unknown_runner(self):
+        with patch.object(StepsCache, 'TREE_RUNNERS', ['select']):
+            self.parse()
+            self.parse()
+
+        self.assertEqual(self.mocks[7].call_count, 2)
@@ -364,20 +364,35 @@ You can also select a custom merging strategy using a ``__`` object in a list:
 
 from __future__ import absolute_import
 import os
+import copy
+import time
 import logging
 from functools import partial
 
 import yaml
-from jinja2 import FileSystemLoader, Environment, TemplateNotFound
+from jinja2 import FileSystemLoader, Environment, TemplateNotFound, meta
 import six
 
 
 log = logging.getLogger(__name__)
 strategies = ('overwrite', 'merge-first', 'merge-last', 'remove')
 
+# Variables which are identical for all minions
+STATIC_GLOBALS = frozenset(['__opts__'])
+
+# Jinja environments per basedir, which keep the compiled templates and
+# recompile them when the file changes
+_environments = {}
+
+# Rendered and parsed templates, which do not depend on the minion, keyed
+# by filename
+_rendered = {}
+
 
 def ext_pillar(minion_id, pillar, *args, **kwargs):
     import salt.utils
+    start = time.time()
+    stats = {'templates': 0, 'hits': 0}
     stack = {}
     stack_config_files = list(args)
     traverse = {
@@ -399,27 +414,82 @@ def ext_pillar(minion_id, pillar, *args, **kwargs):
             log.warning('Ignoring pillar stack cfg "{0}": '
                      'file does not exist'.format(cfg))
             continue
-        stack = _process_stack_cfg(cfg, stack, minion_id, pillar)
+        stack = _process_stack_cfg(cfg, stack, minion_id, pillar, stats)
+    log.info('Rendered pillar stack for {0} in {1:.3f}s, {2} of {3} '
+             'templates from cache'.format(minion_id, time.time() - start,
+                                           stats['hits'], stats['templates']))
     return stack
 
 
-def _process_stack_cfg(cfg, stack, minion_id, pillar):
-    log.debug('Config: {0}'.format(cfg))
-    basedir, filename = os.path.split(cfg)
-    jenv = Environment(loader=FileSystemLoader(basedir))
+def _environment(basedir):
+    '''
+    Return the shared Jinja environment of basedir
+    '''
+    jenv = _environments.get(basedir)
+    if jenv is None:
+        jenv = Environment(loader=FileSystemLoader(basedir), auto_reload=True)
+        _environments[basedir] = jenv
     jenv.globals.update({
         "__opts__": __opts__,
         "__salt__": __salt__,
+        })
+    return jenv
+
+
+def _is_static(jenv, path):
+    '''
+    A template is static when it uses no minion specific variables and
+    includes no other templates
+    '''
+    source = jenv.loader.get_source(jenv, path)[0]
+    ast = jenv.parse(source)
+    if list(meta.find_referenced_templates(ast)):
+        return False
+    return not meta.find_undeclared_variables(ast) - STATIC_GLOBALS
+
+
+def _render(jenv, path, parse, stats, **context):
+    '''
+    Render and parse a template.  The result of a static template is kept
+    until the file changes and a copy is returned for other minions.
+    '''
+    template = jenv.get_template(path)
+    stats['templates'] += 1
+    filename = template.filename
+    mtime = os.path.getmtime(filename)
+    entry = _rendered.get(filename)
+    if entry is None or entry['mtime'] != mtime:
+        entry = {'mtime': mtime, 'static': _is_static(jenv, path)}
+        _rendered[filename] = entry
+    if 'obj' in entry:
+        stats['hits'] += 1
+        return copy.deepcopy(entry['obj'])
+    obj = parse(template.render(**context))
+    if entry['static']:
+        entry['obj'] = copy.deepcopy(obj)
+    return obj
+
+
+def _process_stack_cfg(cfg, stack, minion_id, pillar, stats=None):
+    log.debug('Config: {0}'.format(cfg))
+    if stats is None:
+        stats = {'templates': 0, 'hits': 0}
+    basedir, filename = os.path.split(cfg)
+    jenv = _environment(basedir)
+    context = {
         "__grains__": __grains__,
         "minion_id": minion_id,
         "pillar": pillar,
-        })
-    for path in _parse_stack_cfg(jenv.get_template(filename).render(stack=stack)):
+        }
+    paths = _render(jenv, filename, _parse_stack_cfg, stats,
+                    stack=stack, **context)
+    for path in paths:
         try:
             log.debug('YAML: basedir={0}, path={1}'.format(basedir, path))
-            obj = yaml.safe_load(jenv.get_template(path).render(stack=stack))
+            obj = _render(jenv, path, yaml.safe_load, stats,
+                          stack=stack, **context)
             log.debug('obj: {0}'.format(obj))
-            
+
             if not isinstance(obj, dict):
                 log.info('Ignoring pillar stack template "{0}": Can\'t parse '
                          'as a valid yaml dictionary'.format(path))
@@ -451,38 +521,73 @@ def _cleanup(obj):
     return obj
 
 
-def _merge_dict(stack, obj):
+def _merge_dict(stack, obj, cleaned=False):
+    '''
+    Merge obj into stack.  The values in stack are always cleaned up, so
+    cleaned signals that obj came from stack and needs no second pass.
+    '''
     strategy = obj.pop('__', 'merge-last')
     if strategy not in strategies:
         raise Exception('Unknown strategy "{0}", should be one of {1}'.format(
             strategy, strategies))
+    clean = _noop if cleaned else _cleanup
     if strategy == 'overwrite':
-        return _cleanup(obj)
-    else:
-        for k, v in six.iteritems(obj):
-            if strategy == 'remove':
-                stack.pop(k, None)
-                continue
-            if k in stack:
-                if strategy == 'merge-first':
-                    # merge-first is same as merge-last but the other way round
-                    # so let's switch stack[k] and v
-                    stack_k = stack[k]
-                    stack[k] = _cleanup(v)
-                    v = stack_k
-                if type(stack[k]) != type(v):
-                    log.debug('Force overwrite, types differ: '
-                              '\'{0}\' != \'{1}\''.format(stack[k], v))
-                    stack[k] = _cleanup(v)
-                elif isinstance(v, dict):
-                    stack[k] = _merge_dict(stack[k], v)
-                elif isinstance(v, list):
-                    stack[k] = _merge_list(stack[k], v)
-                else:
-                    stack[k] = v
-            else:
-                stack[k] = _cleanup(v)
+        return clean(obj)
+    if strategy == 'remove':
+        for k in obj:
+            stack.pop(k, None)
         return stack
+    for k, v in six.iteritems(obj):
+        if k in stack:
+            v_clean = clean
+            if strategy == 'merge-first':
+                # merge-first is same as merge-last but the other way round
+                # so let's switch stack[k] and v
+                stack_k = stack[k]
+                stack[k] = clean(v)
+                v = stack_k
+                v_clean = _noop
+            if type(stack[k]) != type(v):
+                log.debug('Force overwrite, types differ: '
+                          '\'{0}\' != \'{1}\''.format(stack[k], v))
+                stack[k] = v_clean(v)
+            elif isinstance(v, dict):
+                stack[k] = _merge_dict(stack[k], v, v_clean is _noop)
+            elif isinstance(v, list):
+                stack[k] = _merge_list(stack[k], v)
+            else:
+                stack[k] = v
+        else:
+            stack[k] = clean(v)
+    return stack
+
+
+def _noop(obj):
+    return obj
+
+
+def _remove_items(stack, obj):
+    '''
+    Return the items of stack which are not in obj.  Hashable items are
+    looked up in a set, only unhashable items are compared one by one.
+    '''
+    hashable = set()
+    unhashable = []
+    for item in obj:
+        try:
+            hashable.add(item)
+        except TypeError:
+            unhashable.append(item)
+    result = []
+    for item in stack:
+        try:
+            if item in hashable:
+                continue
+        except TypeError:
+            if item in unhashable:
+                continue
+        result.append(item)
+    return result
 
 
 def _merge_list(stack, obj):
@@ -496,7 +601,7 @@ def _merge_list(stack, obj):
     if strategy == 'overwrite':
         return obj
     elif strategy == 'remove':
-        return [item for item in stack if item not in obj]
+        return _remove_items(stack, obj)
     elif strategy == 'merge-first':
         return obj + stack
     else:
@@ -6,18 +6,21 @@ from __future__ import absolute_import
 import salt.client
 import salt.config
 
-import ast
 import logging
 import datetime
-import ipaddress
+import glob
+import gzip
+import json
+import math
 import jinja2
 import os
+import re
+import shutil
 import subprocess
 import sys
 import yaml
 from six.moves import filter
 from six.moves import zip
-from functools import reduce
 
 log = logging.getLogger(__name__)
 local_client = salt.client.LocalClient()
@@ -34,10 +37,194 @@ class bcolors:
     UNDERLINE = '\033[4m'
 
 
+class LogHistogram(object):
+    '''
+    Log scale buckets with about 1% relative error, so percentiles of
+    billions of samples need a few hundred counters
+    '''
+
+    def __init__(self, precision=0.01):
+        self.base = math.log(1 + precision)
+        self.buckets = {}
+        self.count = 0
+
+    def add(self, value, count=1):
+        key = int(math.log(value) / self.base) if value > 0 else None
+        self.buckets[key] = self.buckets.get(key, 0) + count
+        self.count += count
+
+    def merge(self, other):
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.count += other.count
+
+    def percentile(self, pct):
+        if not self.count:
+            return None
+        target = self.count * pct / 100.0
+        seen = 0
+        keys = sorted(self.buckets, key=lambda key: -1 if key is None else key)
+        for key in keys:
+            seen += self.buckets[key]
+            if seen >= target:
+                break
+        return 0.0 if key is None else math.exp((key + 0.5) * self.base)
+
+
+class LogStats(object):
+    '''
+    Streaming count, mean, min, max and a time series of window means for
+    one fio log and direction.  Latencies also keep a histogram.
+    '''
+    PERCENTILES = (50, 90, 99, 99.9)
+
+    def __init__(self, interval=1000, latency=False):
+        self.interval = interval
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.windows = {}
+        self.histogram = LogHistogram() if latency else None
+
+    def add(self, msec, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        window = self.windows.setdefault(msec // self.interval, [0, 0])
+        window[0] += value
+        window[1] += 1
+        if self.histogram is not None:
+            self.histogram.add(value)
+
+    def series(self):
+        return [[window * self.interval, total / float(count)]
+                for window, (total, count) in sorted(self.windows.items())]
+
+    def summary(self):
+        summary = {'count': self.count,
+                   'mean': self.total / float(self.count) if self.count else None,
+                   'min': self.min,
+                   'max': self.max,
+                   'series': self.series()}
+        if self.histogram is not None:
+            summary['percentiles'] = {'p{}'.format(pct): self.histogram.percentile(pct)
+                                      for pct in self.PERCENTILES}
+        return summary
+
+
+class FioLogs(object):
+    '''
+    Post process the bw, iops and latency logs of a fio run.  The logs are
+    read in chunks, never whole.  Each client gets a summary and time
+    series per log kind and direction.  The aggregate 'all' sums the
+    bandwidth and iops series of all clients and merges the latency
+    histograms.  Histogram logs are not summarized, only compressed.
+    '''
+    CHUNK = 1 << 20
+    LATENCY = ('lat', 'clat', 'slat')
+    DIRECTIONS = {'0': 'read', '1': 'write', '2': 'trim'}
+
+    def __init__(self, log_dir, prefix='output', interval=1000):
+        self.log_dir = log_dir
+        self.prefix = prefix
+        self.interval = interval
+        self.pattern = re.compile(r'^{}_(bw|iops|lat|clat|slat)\.\d+\.log'
+                                  r'(?:\.(.+))?$'.format(re.escape(prefix)))
+
+    def files(self):
+        '''
+        Return path, kind and client of each log
+        '''
+        logs = []
+        for path in sorted(glob.glob('{}/{}_*.log*'.format(self.log_dir, self.prefix))):
+            name = os.path.basename(path)
+            if name.endswith('.gz'):
+                name = name[:-len('.gz')]
+            match = self.pattern.match(name)
+            if match:
+                logs.append((path, match.group(1), match.group(2) or 'local'))
+        return logs
+
+    def _lines(self, path):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt') as handle:
+            while True:
+                lines = handle.readlines(self.CHUNK)
+                if not lines:
+                    break
+                for line in lines:
+                    yield line
+
+    def ingest(self):
+        '''
+        Return the summaries by client, kind and direction
+        '''
+        stats = {}
+        for path, kind, client in self.files():
+            latency = kind in self.LATENCY
+            for line in self._lines(path):
+                fields = line.split(',')
+                if len(fields) < 3:
+                    continue
+                try:
+                    msec, value = int(fields[0]), int(fields[1])
+                except ValueError:
+                    continue
+                direction = self.DIRECTIONS.get(fields[2].strip(), fields[2].strip())
+                key = (client, kind, direction)
+                if key not in stats:
+                    stats[key] = LogStats(self.interval, latency)
+                stats[key].add(msec, value)
+
+        summary = {}
+        totals = {}
+        for (client, kind, direction), entry in sorted(stats.items()):
+            summary.setdefault(client, {}).setdefault(kind, {})[direction] = entry.summary()
+            total = totals.setdefault((kind, direction), {'series': {}, 'histogram': None})
+            if entry.histogram is not None:
+                if total['histogram'] is None:
+                    total['histogram'] = LogHistogram()
+                total['histogram'].merge(entry.histogram)
+            else:
+                for start, mean in entry.series():
+                    total['series'][start] = total['series'].get(start, 0) + mean
+
+        for (kind, direction), total in totals.items():
+            aggregate = {}
+            if total['histogram'] is not None:
+                aggregate['count'] = total['histogram'].count
+                aggregate['percentiles'] = {
+                    'p{}'.format(pct): total['histogram'].percentile(pct)
+                    for pct in LogStats.PERCENTILES}
+            else:
+                series = sorted(total['series'].items())
+                aggregate['series'] = [list(point) for point in series]
+                values = [mean for _, mean in series]
+                aggregate['mean'] = sum(values) / len(values) if values else None
+            summary.setdefault('all', {}).setdefault(kind, {})[direction] = aggregate
+        return summary
+
+    def compress(self):
+        '''
+        Gzip the raw logs including histogram logs, remove the originals
+        '''
+        compressed = []
+        for path in sorted(glob.glob('{}/{}_*.log*'.format(self.log_dir, self.prefix))):
+            if path.endswith('.gz'):
+                continue
+            with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+                shutil.copyfileobj(source, target, self.CHUNK)
+            os.remove(path)
+            compressed.append(path + '.gz')
+        return compressed
+
+
 class Fio(object):
 
     def __init__(self, client_glob, target, bench_dir, work_dir,
-                 log_dir, job_dir):
+                 log_dir, job_dir, compress_logs=False):
         '''
         get a list of the minions ip addresses and pick the one that falls into
         the public_network
@@ -53,10 +240,9 @@ class Fio(object):
             raise Exception('No minions found for glob {}'.format(client_glob))
 
         clients = []
-        ip_filter = lambda add: ipaddress.ip_address(
-            add.decode()) in ipaddress.ip_network(public_network.decode())
+        index = __utils__['subnets.index'](public_network)
         for minion, ip_list in minion_ip_lists.items():
-            clients.extend(list(filter(ip_filter, ip_list)))
+            clients.extend(index.filter(ip_list))
 
         if not clients:
             raise Exception(
@@ -76,6 +262,7 @@ class Fio(object):
         self.log_dir = log_dir
         self.work_dir = work_dir
         self.job_dir = job_dir
+        self.compress_logs = compress_logs
 
         self.jinja_env = jinja2.Environment(
             loader=jinja2.FileSystemLoader('{}/{}'.format(bench_dir,
@@ -105,8 +292,53 @@ class Fio(object):
         output = subprocess.check_output(
             [self.cmd] + self.cmd_global_args + log_args + client_jobs)
 
+        results = self._results('{}/output.json'.format(job_log_dir))
+        self._ingest(job_log_dir, results)
+        __utils__['benchstore.record'](__opts__, self.target, results, job=job_name,
+                                       clients=self.clients)
         return output
 
+    def _ingest(self, job_log_dir, results):
+        '''
+        Summarize the bw, iops and latency logs into summary.json, add the
+        completion latency percentiles to the results and optionally
+        compress the raw logs
+        '''
+        logs = FioLogs(job_log_dir)
+        summary = logs.ingest()
+        with open('{}/summary.json'.format(job_log_dir), 'w') as summary_file:
+            json.dump(summary, summary_file)
+        for client, kinds in summary.items():
+            for direction, entry in kinds.get('clat', {}).items():
+                for name, value in entry.get('percentiles', {}).items():
+                    results.setdefault(client, {})[
+                        '{}_clat_{}_ns'.format(direction, name)] = value
+        if self.compress_logs:
+            logs.compress()
+        return summary
+
+    def _results(self, output_file):
+        '''
+        Return bandwidth, iops and mean completion latency by client from
+        the fio json output.  The aggregate of all clients is 'all'.
+        '''
+        try:
+            with open(output_file, 'r') as output:
+                stats = json.load(output).get('client_stats', [])
+        except (IOError, OSError, ValueError) as error:
+            log.warning('Cannot parse {}: {}'.format(output_file, error))
+            return {}
+        results = {}
+        for entry in stats:
+            key = 'all' if entry.get('jobname') == 'All clients' else entry.get('hostname')
+            metrics = results.setdefault(key, {})
+            for direction in ['read', 'write']:
+                io = entry.get(direction, {})
+                metrics['{}_bw'.format(direction)] = io.get('bw')
+                metrics['{}_iops'.format(direction)] = io.get('iops')
+                metrics['{}_lat_ns'.format(direction)] = io.get('clat_ns', {}).get('mean')
+        return results
+
     def _parse_job(self, job_spec, job_name, job_log_dir, client):
         # parse yaml and get job spec
         job = self._get_job_parameters(job_spec, job_log_dir, client)
@@ -195,9 +427,21 @@ def help():
 
                  Run CephFS benchmarks
 
-             salt-run benchmark.baseline work_dir=/path log_dir=/path job_dir=/path default_collection=simple.yml client_glob=target
+             salt-run benchmark.baseline work_dir=/path log_dir=/path job_dir=/path default_collection=simple.yml client_glob=target per_host=1 concurrency=16
+
+                 Run Baseline benchmarks, at most per_host OSDs of a host and
+                 concurrency OSDs at once
+
+                 rbd, cephfs and blockdev accept compress_logs=True to gzip the raw fio logs
+                 once they are summarized into summary.json
+
+             salt-run benchmark.compare kind=osd_bench runs=5 threshold=10
+
+                 Compare the latest run against the previous runs and report regressions
 
-                 Run Baseline benchmarks
+             salt-run benchmark.history kind=osd_bench limit=10
+
+                 List stored runs
              """)
     print(usage)
     return ""
@@ -220,7 +464,8 @@ def rbd(**kwargs):
               dir_options['bench_dir'],
               dir_options['work_dir'],
               dir_options['log_dir'],
-              dir_options['job_dir'])
+              dir_options['job_dir'],
+              compress_logs=kwargs.get('compress_logs', False))
 
     for job_spec in default_collection['rbd']:
         print(fio.run(job_spec))
@@ -246,7 +491,8 @@ def cephfs(**kwargs):
               dir_options['bench_dir'],
               dir_options['work_dir'],
               dir_options['log_dir'],
-              dir_options['job_dir'])
+              dir_options['job_dir'],
+              compress_logs=kwargs.get('compress_logs', False))
 
     for job_spec in default_collection['fs']:
         print(fio.run(job_spec))
@@ -254,57 +500,119 @@ def cephfs(**kwargs):
     return True
 
 
-def baseline(margin=10, verbose=False, **kwargs):
+class RunningStats(object):
+    '''
+    Streaming mean and standard deviation (Welford)
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def stddev(self):
+        if self.count < 2:
+            return 0.0
+        return (self._m2 / (self.count - 1)) ** 0.5
+
+
+def baseline(margin=10, verbose=False, per_host=1, concurrency=16, **kwargs):
     '''
-    trigger 'ceph tell osd.$n bench' on all $n OSDs and check the results for
-    slow outliers
+    run the osd bench on all OSDs and check the results for slow outliers.
+    The master minion benches at most per_host OSDs of a host and
+    concurrency OSDs in total at once in a single job.
+
+    Returns median, MAD, percentiles and outliers of all OSDs and per host
+    and device class, see outliers.analyze.
     '''
     client_glob = kwargs.get('client_glob',
                              'I@roles:storage and I@cluster:ceph')
     log.info('client glob is {}'.format(client_glob))
 
     # gotta get the master_minion...not pretty but works
-    master_minion = local_client.cmd(
+    master_minion = list(local_client.cmd(
         'I@roles:master', 'pillar.get',
-        ['master_minion'], expr_form='compound').items()[0][1]
-
-    # get all osd ids for a given client_glob
-    osd_list = local_client.cmd(master_minion, 'cmd.shell',
-        ['ceph osd ls'])
-
-    if not osd_list:
-        raise Exception('No OSDs found for glob {}'.format(client_glob))
-
-    ids = osd_list[master_minion].split("\n")
+        ['master_minion'], tgt_type='compound').values())[0]
 
     sys.stdout.write('\nRunning osd benchmarks')
     sys.stdout.flush()
-    results = []
-    for id in ids:
-        sys.stdout.write('.')
-        sys.stdout.flush()
-        output = local_client.cmd(master_minion, 'cmd.shell',
-                                  ['ceph tell osd.{} bench'.format(id)])
-        results.append(output)
+    stats = RunningStats()
+    perf = {}
+    groups = {'host': {}, 'class': {}}
+    timeout = int(kwargs.get('timeout', 86400))
+    with __utils__['collector.collector'](__opts__, timeout=timeout) as jobs:
+        jobs.publish(local_client, master_minion, 'osd.bench',
+                     kwarg={'per_host': per_host, 'concurrency': concurrency})
+        for _, _, ret in jobs.iter_returns():
+            if not isinstance(ret, dict):
+                raise Exception('osd.bench failed on {}: {}'.format(master_minion, ret))
+            for osd_id, result in ret.items():
+                groups['host'][osd_id] = result['host']
+                groups['class'][osd_id] = result['class']
+                perf[osd_id] = result['bytes_per_sec']
+                if result['bytes_per_sec'] is None:
+                    log.error('osd.{} bench failed'.format(osd_id))
+                    continue
+                stats.add(result['bytes_per_sec'])
+
+    if not stats.count:
+        raise Exception('No OSD benchmarks returned for glob {}'.format(client_glob))
+
+    ids = sorted([osd_id for osd_id in perf if perf[osd_id] is not None], key=int)
+    perf_abs = [perf[osd_id] for osd_id in ids]
+    avg = stats.mean
+
+    print('\n\nAverage OSD performance: {}/s (stddev {}/s)\n'.format(
+        __human_size(avg), __human_size(stats.stddev)))
+
+    dev_percent = [(p - avg) / (avg * 0.01) for p in perf_abs]
 
-    # minion output is a string, so must be parsed; ditch the key
-    parsed_results = [ast.literal_eval(r[master_minion]) for r in results]
+    if(verbose):
+        __print_verbose(dev_percent, perf_abs, ids, margin)
+    else:
+        __print_outliers(dev_percent, perf_abs, ids, margin)
 
-    perf_abs = [r['bytes_per_sec'] for r in parsed_results]
+    __utils__['benchstore.record'](__opts__, 'osd_bench', perf,
+                                   cluster=kwargs.get('cluster', 'ceph'),
+                                   metric='bytes_per_sec')
 
-    avg = reduce(lambda r1, r2: r1 + r2, perf_abs)/len(perf_abs)
+    analysis = __utils__['outliers.analyze'](perf, groups=groups)
+    analysis['stddev'] = stats.stddev
+    return analysis
 
-    print('\n\nAverage OSD performance: {}/s\n'.format(__human_size(avg)))
 
-    dev_abs = [p - avg for p in perf_abs]
-    dev_percent = [d / (avg*0.01) for d in dev_abs]
+def compare(kind='osd_bench', runs=5, threshold=10, cluster='ceph', job=None,
+            run=None, **kwargs):
+    '''
+    Compare the latest run of a kind (osd_bench, iperf, iperf_public,
+    iperf_cluster, rbd, cephfs, blockdev) against the median of the
+    previous runs with the same job and clients.  Reports the results
+    which are threshold percent worse.
+    '''
+    store = __utils__['benchstore.store'](__opts__)
+    try:
+        return store.compare(kind, cluster=cluster, job=job, runs=int(runs),
+                             threshold=float(threshold), run=run)
+    finally:
+        store.close()
 
-    if(verbose):
-        __print_verbose(dev_percent, perf_abs, ids, margin)
-    else:
-        __print_outliers(dev_percent, perf_abs, ids, margin)
 
-    return True
+def history(kind='osd_bench', cluster='ceph', job=None, limit=10, **kwargs):
+    '''
+    List the stored runs of a kind, newest first
+    '''
+    store = __utils__['benchstore.store'](__opts__)
+    try:
+        return store.runs(kind, cluster=cluster, job=job, limit=int(limit))
+    finally:
+        store.close()
 
 
 def blockdev(**kwargs):
@@ -325,7 +633,8 @@ def blockdev(**kwargs):
               dir_options['bench_dir'],
               None,
               dir_options['log_dir'],
-              dir_options['job_dir'])
+              dir_options['job_dir'],
+              compress_logs=kwargs.get('compress_logs', False))
 
     for job_spec in default_collection['blockdev']:
         print(fio.run(job_spec))
@@ -12,6 +12,7 @@ from __future__ import absolute_import
 import pprint
 import os
 import sys
+import time
 import logging
 # pylint: disable=import-error,3rd-party-module-not-gated,redefined-builtin
 import salt.client
@@ -26,31 +27,42 @@ def help_():
     """
     Usage
     """
-    usage = ("""salt-run cephprocesses.check
+    usage = ("""salt-run cephprocesses.check [batch=True]
                    Checks the process status according to assigned role.
+                   With batch=True, all roles are checked with a single job
+                   instead of one job per role.
 
                 salt-run cephprocesses.mon
                    Query monitors to determine if Ceph cluster is active.
 
+                salt-run cephprocesses.timing
+                   Run the check per role and batched, and return the round
+                   trip time of each.
+
                 salt-run cephprocesses.wait
                    Wait for all processes to be up according to assigned roles.
+                   All roles of a minion are checked in one job already, so
+                   wait takes no batch argument.
              """)
     print(usage)
     return ""
 
 
 # pylint: disable=dangerous-default-value
-def check(cluster='ceph', roles=[], tolerate_down=0, quiet=False):
+def check(cluster='ceph', roles=[], tolerate_down=0, quiet=False, batch=False):
     """
     Query the status of running processes for each role.  Also, verify that
     all minions assigned roles do respond.  Return False if any fail.
+
+    With batch set, all roles are queried in a single job instead of one
+    job per role.
     """
     search = "I@cluster:{}".format(cluster)
 
     if not roles:
         roles = _cached_roles(search)
 
-    status = _status(search, roles, quiet)
+    status = _status(search, roles, quiet, batch=batch)
 
     log.debug("roles: {}".format(pprint.pformat(roles)))
     log.debug("status: {}".format(pprint.pformat(status)))
@@ -150,30 +162,121 @@ def need_restart(role=None, cluster='ceph'):
     return False
 
 
-def _status(search, roles, quiet):
+def _status(search, roles, quiet, batch=False, timings=None):
     """
     Return a structure of roles with module results
+
+    The elapsed time of each salt call is stored in timings, keyed by role
+    or by 'batch' for the single batched call.
     """
     # When search matches no minions, salt prints to stdout.  Suppress stdout.
     _stdout = sys.stdout
     sys.stdout = open(os.devnull, 'w')
 
-    status = {}
+    if timings is None:
+        timings = {}
     local = salt.client.LocalClient()
 
-    for role in roles:
-        role_search = search + " and I@roles:{}".format(role)
-        status[role] = local.cmd(role_search,
-                                 'cephprocesses.check',
-                                 kwarg={'roles': [role]},
-                                 quiet=quiet,
-                                 tgt_type="compound")
+    if batch:
+        status = _batched_status(local, search, roles, quiet, timings)
+    else:
+        status = {}
+        for role in roles:
+            role_search = search + " and I@roles:{}".format(role)
+            start = time.time()
+            status[role] = local.cmd(role_search,
+                                     'cephprocesses.check',
+                                     kwarg={'roles': [role]},
+                                     quiet=quiet,
+                                     tgt_type="compound")
+            timings[role] = time.time() - start
 
     sys.stdout = _stdout
     log.debug(pprint.pformat(status))
+    _log_timings(roles, timings)
     return status
 
 
+def _batched_status(local, search, roles, quiet, timings):
+    """
+    Query every role with one job.  Each minion evaluates all of its
+    assigned roles and returns a dictionary keyed by role, which is
+    rearranged into the same structure _status returns.
+    """
+    status = {}
+    for role in roles:
+        status[role] = {}
+    if not roles:
+        return status
+
+    role_search = "{} and ( {} )".format(
+        search, " or ".join(["I@roles:{}".format(role) for role in roles]))
+    start = time.time()
+    results = local.cmd(role_search,
+                        'cephprocesses.check',
+                        kwarg={'roles': roles, 'per_role': True},
+                        quiet=quiet,
+                        tgt_type="compound")
+    timings['batch'] = time.time() - start
+
+    assigned = None
+    for minion, result in six.iteritems(results):
+        if isinstance(result, dict):
+            for role in result:
+                if role in status:
+                    status[role][minion] = result[role]
+            continue
+        # The minion did not return per role results, i.e. it failed.
+        # Mark it down for each role the master assigned to it.
+        log.error("minion {} returned {}".format(minion, result))
+        if assigned is None:
+            assigned = _cached_role_map(search)
+        for role in roles:
+            if minion in assigned.get(role, []):
+                status[role][minion] = False
+    return status
+
+
+def _log_timings(roles, timings):
+    """
+    Log the round trip cost per role
+    """
+    if 'batch' in timings:
+        per_role = timings['batch'] / len(roles) if roles else 0
+        log.info("cephprocesses.check: 1 job for {} roles took {:.2f}s, "
+                 "{:.2f}s per role".format(len(roles), timings['batch'], per_role))
+    else:
+        for role in roles:
+            log.info("cephprocesses.check: role {} took {:.2f}s".format(role, timings[role]))
+        log.info("cephprocesses.check: {} jobs took {:.2f}s".format(
+            len(roles), sum(timings.values())))
+
+
+def timing(cluster='ceph', roles=[], quiet=True):
+    """
+    Run the per role and the batched check and return the round trip
+    cost of each.
+    """
+    search = "I@cluster:{}".format(cluster)
+
+    if not roles:
+        roles = _cached_roles(search)
+
+    serial = {}
+    _status(search, roles, quiet, timings=serial)
+    batched = {}
+    _status(search, roles, quiet, batch=True, timings=batched)
+
+    summary = {'serial': {'roles': {},
+                          'total': round(sum(serial.values()), 3)},
+               'batch': {'total': round(batched['batch'], 3)}}
+    for role in serial:
+        summary['serial']['roles'][role] = round(serial[role], 3)
+    if roles:
+        summary['batch']['per_role'] = round(batched['batch'] / len(roles), 3)
+    return summary
+
+
 def _cached_roles(search):
     """
     Return the cached roles in a convenient structure.  Trust the cached
@@ -181,6 +284,13 @@ def _cached_roles(search):
     from any dynamic query.  Also, do not worry about downed minions that
     are outside of the search criteria.
     """
+    return list(_cached_role_map(search).keys())
+
+
+def _cached_role_map(search):
+    """
+    Return the cached roles with the minions assigned to each role
+    """
     pillar_util = salt.utils.master.MasterPillarUtil(search, "compound",
                                                      use_cached_grains=True,
                                                      grains_fallback=False,
@@ -194,7 +304,7 @@ def _cached_roles(search):
                 roles.setdefault(role, []).append(minion)
 
     log.debug(pprint.pformat(roles))
-    return list(roles.keys())
+    return roles
 
 
 def wait(cluster='ceph', **kwargs):
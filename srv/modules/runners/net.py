@@ -8,12 +8,10 @@ Network utilities
 
 from __future__ import absolute_import
 from __future__ import print_function
-import time
 import logging
 import operator
 import re
 # pylint: disable=import-error,3rd-party-module-not-gated
-from netaddr import IPNetwork, IPAddress
 # pylint: disable=relative-import
 # pylint: disable=import-error,3rd-party-module-not-gated,blacklisted-external-import,blacklisted-module
 from six.moves import range
@@ -21,6 +19,8 @@ from six.moves import range
 
 log = logging.getLogger(__name__)
 
+IPERF_PORT = 5200
+
 try:
     import salt.client
 except ImportError:
@@ -51,7 +51,8 @@ def help_():
              'salt-run net.iperf:\n'
              'salt-run net.iperf ceph:\n'
              'salt-run net.iperf cluster=ceph:\n'
-             'salt-run net.iperf exclude=target:\n\n'
+             'salt-run net.iperf exclude=target:\n'
+             'salt-run net.iperf rounds=3 concurrency=50:\n\n'
              '    Summarizes bandwidth throughput between minion interfaces\n'
              '\n\n')
     print(usage)
@@ -69,11 +70,16 @@ def get_cpu_count(server):
     return cpu_core
 
 
-def iperf(cluster=None, exclude=None, output=None, **kwargs):
+def iperf(cluster=None, exclude=None, output=None, rounds=None,
+          concurrency=None, **kwargs):
     """
-    iperf server created from the each minions and then clients are created
-    base on the server's cpu count and request that number of other minions
-    as client to hit the server and report the total bendwidth.
+    iperf servers are started on all minions in one job.  Clients follow a
+    round robin schedule, every round pairs each address with a new peer
+    and both sides test each other.  The average bandwidth per server is
+    reported together with median, MAD, percentiles and outliers.
+
+    A full mesh takes one round per address.  Use rounds to test against
+    fewer peers and concurrency to limit the pairs running at once.
 
     CLI Example: (Before DeepSea with a cluster configuration)
     .. code-block:: bash
@@ -90,6 +96,9 @@ def iperf(cluster=None, exclude=None, output=None, **kwargs):
     To get all host iperf result
         sudo salt-run net.iperf cluster=ceph output=full
 
+    To test each address against three peers, 50 pairs at a time
+        sudo salt-run net.iperf cluster=ceph rounds=3 concurrency=50
+
     """
     exclude_string = exclude_iplist = None
     if exclude:
@@ -128,9 +137,13 @@ def iperf(cluster=None, exclude=None, output=None, **kwargs):
             log.debug("iperf: cluster_network {} ".format(cluster_addresses))
         result = {}
         _create_server(public_addresses)
-        p_result = _create_client(public_addresses)
+        p_result = _create_client(public_addresses, rounds, concurrency)
+        __utils__['benchstore.record'](__opts__, 'iperf_public', p_result, cluster=cluster,
+                                       clients=public_addresses, metric='mbits')
         _create_server(cluster_addresses)
-        c_result = _create_client(cluster_addresses)
+        c_result = _create_client(cluster_addresses, rounds, concurrency)
+        __utils__['benchstore.record'](__opts__, 'iperf_cluster', c_result, cluster=cluster,
+                                       clients=cluster_addresses, metric='mbits')
         p_sort = _add_unit(sorted(list(p_result.items()),
                                   key=operator.itemgetter(1), reverse=True))
         c_sort = _add_unit(sorted(list(c_result.items()),
@@ -143,10 +156,12 @@ def iperf(cluster=None, exclude=None, output=None, **kwargs):
         else:
             result.update({'Public Network':
                            {"Slowest 2 hosts": p_sort[-2:],
-                            "Fastest 2 hosts": p_sort[:2]}})
+                            "Fastest 2 hosts": p_sort[:2],
+                            "Statistics": __utils__['outliers.analyze'](p_result)}})
             result.update({'Cluster Network':
                            {"Slowest 2 hosts": c_sort[-2:],
-                            "Fastest 2 hosts": c_sort[:2]}})
+                            "Fastest 2 hosts": c_sort[:2],
+                            "Statistics": __utils__['outliers.analyze'](c_result)}})
             return result
     else:
         # pylint: disable=redefined-variable-type
@@ -168,7 +183,9 @@ def iperf(cluster=None, exclude=None, output=None, **kwargs):
         except ValueError:
             log.debug("ping: remove {} ip doesn't exist".format(ex_ip))
         _create_server(addresses)
-        result = _create_client(addresses)
+        result = _create_client(addresses, rounds, concurrency)
+        __utils__['benchstore.record'](__opts__, 'iperf', result, cluster='ceph',
+                                       clients=addresses, metric='mbits')
         sort_result = _add_unit(sorted(list(result.items()),
                                        key=operator.itemgetter(1),
                                        reverse=True))
@@ -176,7 +193,8 @@ def iperf(cluster=None, exclude=None, output=None, **kwargs):
             return sort_result
         else:
             return {"Slowest 2 hosts": sort_result[-2:],
-                    "Fastest 2 hosts": sort_result[:2]}
+                    "Fastest 2 hosts": sort_result[:2],
+                    "Statistics": __utils__['outliers.analyze'](result)}
 
 
 def _add_unit(records):
@@ -192,71 +210,62 @@ def _add_unit(records):
 
 def _create_server(addresses):
     """
-    Start iperf server
+    Start iperf servers on all addresses in a single job.  Each address
+    listens on its own port, see multi.iperf_servers.
     """
-    start_service = []
+    if not addresses:
+        return
     local = salt.client.LocalClient()
     log.debug("net.iperf._create_server: address list {} ".format(addresses))
-    for server in addresses:
-        cpu_core = get_cpu_count(server)
-        log.debug("net.iperf._create_server: server {} cpu count {} "
-                  .format(server, cpu_core))
-        for count in range(cpu_core):
-            log.debug("net.iperf._create_server: server {} count {} port {} "
-                      .format(server, count, 5200+count))
-            start_service.append(local.cmd("S@{}".format(server),
-                                           'multi.iperf_server_cmd',
-                                           [count, 5200+count], tgt_type="compound"))
+    search = " or ".join(["S@{}".format(address) for address in addresses])
+    local.cmd(search, 'multi.iperf_servers', list(addresses), tgt_type="compound")
 
 
-def _create_client(addresses):
+def _tournament(addresses, rounds=None):
     """
-    Start iperf client
+    Round robin schedule using the circle method.  Each round is a list of
+    disjoint pairs, every pair meets exactly once over all rounds.  An odd
+    number of addresses leaves one address idle per round.
     """
-    results = []
-    jid = []
+    nodes = list(addresses)
+    if len(nodes) % 2:
+        nodes.append(None)
+    schedule = []
+    for _ in range(len(nodes) - 1):
+        pairs = []
+        for idx in range(len(nodes) // 2):
+            first, second = nodes[idx], nodes[-1 - idx]
+            if first is not None and second is not None:
+                pairs.append((first, second))
+        if pairs:
+            schedule.append(pairs)
+        nodes.insert(1, nodes.pop())
+    if rounds:
+        return schedule[:int(rounds)]
+    return schedule
+
+
+def _create_client(addresses, rounds=None, concurrency=None):
+    """
+    Start iperf clients round by round.  Both addresses of a pair test each
+    other, so every server has at most one client at a time.  Concurrency
+    limits the number of pairs running at once.
+    """
+    ports = {address: IPERF_PORT + idx for idx, address in enumerate(addresses)}
     local = salt.client.LocalClient()
-    for server in addresses:
-        cpu_core = get_cpu_count(server)
-        log.debug("net.iperf._create_client: server {} cpu count {} "
-                  .format(server, cpu_core))
-        clients = list(addresses)
-        clients.remove(server)
-        clients_size = len(clients)
-        # pylint: disable=invalid-name
-        for x in range(0, cpu_core, clients_size):
-            # pylint: disable=invalid-name
-            for y, client in enumerate(clients):
-                log.debug("net.iperf._create_client:")
-                log.debug("server port:{}, x:{} client:{} to server:{}"
-                          .format(5200+x+y, x/clients_size, client, server))
-                if x+y < cpu_core:
-                    jid.append(
-                        local.cmd_async(
-                            "S@"+client,
-                            'multi.iperf',
-                            [server, x/clients_size, 5200+x+y],
-                            tgt_type="compound"))
-                    log.debug("net.iperf._create_client:")
-                    log.debug("calling from client:{} ".format(client))
-                    log.debug("to server:{} ".format(server))
-                    log.debug("cpu:{} port:{}".format(x/clients_size, 5200+x+y))
-        log.debug("net.iperf._create_client:")
-        log.debug("Server {} iperf client count {}".format(server, len(jid)))
-        time.sleep(8)
-
-    log.debug("iperf: All Async iperf client count {}".format(len(jid)))
-    not_done = True
-    while not_done:
-        not_done = False
-        for job in jid:
-            if not __salt__['jobs.lookup_jid'](job):
-                log.debug("iperf: job not done {} ".format(job))
-                time.sleep(1)
-                not_done = True
     results = []
-    for job in jid:
-        results.append(__salt__['jobs.lookup_jid'](job))
+    for count, pairs in enumerate(_tournament(addresses, rounds)):
+        size = int(concurrency) if concurrency else max(len(pairs), 1)
+        for start in range(0, len(pairs), size):
+            with __utils__['collector.collector'](__opts__) as jobs:
+                for pair in pairs[start:start + size]:
+                    for client, server in (pair, pair[::-1]):
+                        jobs.add(local.cmd_async("S@" + client, 'multi.iperf',
+                                                 [server, ports[client] - IPERF_PORT,
+                                                  ports[server]],
+                                                 tgt_type="compound"))
+                log.debug("iperf: round {} started {} clients".format(count, len(jobs.jobs)))
+                results.extend(jobs.collect().values())
     return _summarize_iperf(results)
 
 
@@ -374,14 +383,9 @@ def ping(cluster=None, exclude=None, ping_type=None, **kwargs):
 def _address(addresses, network):
     """
     Return all addresses in the given network
-
-    Note: list comprehension vs. netaddr vs. simple
     """
-    matched = []
-    for address in addresses:
-        log.debug("_address: ip {} in network {} ".format(address, network))
-        if IPAddress(address) in IPNetwork(network):
-            matched.append(address)
+    matched = __utils__['subnets.filter_addresses'](addresses, network)
+    log.debug("_address: {} in network {} ".format(matched, network))
     return matched
 
 
@@ -528,12 +532,12 @@ def _summarize_iperf(results):
     for key, result in six.iteritems(server_results):
         total = 0
         speed = result.split('Mbits/sec')
-        speed = [_f for _f in speed if _f]
+        speed = [_f for _f in speed if _f.strip()]
         try:
             for value in speed:
                 total += float(value.strip())
-            # server_results[key] = str(total) + " Mbits/sec"
-            server_results[key] = int(total)
+            # Servers are tested once per round, report the average
+            server_results[key] = int(total / max(len(speed), 1))
         except ValueError:
             continue
     return server_results
@@ -45,13 +45,12 @@ import uuid
 import ipaddress
 import logging
 # pylint: disable=relative-import
-import operator
 import pprint
 
 import sys
 import six
 from six.moves import range
-from functools import reduce, cmp_to_key
+from functools import cmp_to_key
 
 try:
     import configparser
@@ -91,11 +90,15 @@ class SaltWriter(object):
             self.overwrite = kwargs['overwrite']
         else:
             self.overwrite = False
+        # existing files of these minions are kept even when overwriting
+        self.unchanged = set()
 
-    def write(self, filename, contents):
+    def write(self, filename, contents, minion=None):
         """
         Write a yaml file in the conventional way
         """
+        if minion in self.unchanged and os.path.isfile(filename):
+            return
         if self.overwrite or not os.path.isfile(filename):
             log.info("Writing {}".format(filename))
             with open(filename, "w") as yml:
@@ -458,18 +461,104 @@ class DiskConfiguration(object):
         return assignments
 
 
+class DiscoveryCache(object):
+    """
+    Keep the discovery results of each minion with its fingerprint.  Only
+    minions with a new or changed fingerprint are queried again.
+    """
+
+    def __init__(self, search, filename=None):
+        """
+        Load the cache and collect the current fingerprints
+        """
+        if filename is None:
+            filename = "{}/deepsea/discovery.json".format(
+                __opts__.get('cachedir', '/var/cache/salt/master'))
+        self.filename = filename
+        self.entries = {}
+        try:
+            with open(filename, 'r') as cache:
+                self.entries = json.load(cache)
+        except (IOError, OSError, ValueError) as err:
+            log.debug("Ignoring discovery cache {}: {}".format(filename, err))
+
+        local = salt.client.LocalClient()
+        self.fingerprints = local.cmd(search, 'deepsea.fingerprint', [],
+                                      tgt_type="compound")
+        self.changed = set()
+        for minion, fingerprint in six.iteritems(self.fingerprints):
+            entry = self.entries.get(minion)
+            if (not self._valid(fingerprint) or entry is None or
+                    entry['fingerprint'] != fingerprint):
+                self.changed.add(minion)
+                self.entries[minion] = {'fingerprint': fingerprint,
+                                        'results': {}}
+        log.info("Discovery: {} of {} minions changed".format(
+            len(self.changed), len(self.fingerprints)))
+
+    @staticmethod
+    def _valid(fingerprint):
+        """
+        Minions without the deepsea module return an error message
+        """
+        return (isinstance(fingerprint, six.string_types) and
+                not fingerprint.endswith("is not available."))
+
+    def minions(self):
+        """
+        Return the responding minions
+        """
+        return sorted(self.fingerprints)
+
+    def query(self, fun, arg):
+        """
+        Return the results of fun for all minions.  Only the minions
+        without a cached result are queried.
+        """
+        key = "{} {}".format(fun, " ".join(arg))
+        stale = [minion for minion in self.fingerprints
+                 if key not in self.entries[minion]['results']]
+        if stale:
+            local = salt.client.LocalClient()
+            ret = local.cmd(stale, fun, arg, tgt_type="list")
+            for minion in ret:
+                if minion in self.entries:
+                    self.entries[minion]['results'][key] = ret[minion]
+        return {minion: self.entries[minion]['results'][key]
+                for minion in self.fingerprints
+                if key in self.entries[minion]['results']}
+
+    def save(self):
+        """
+        Save the entries of the responding minions
+        """
+        entries = {minion: self.entries[minion] for minion in self.fingerprints
+                   if self._valid(self.fingerprints[minion])}
+        try:
+            if not os.path.isdir(os.path.dirname(self.filename)):
+                os.makedirs(os.path.dirname(self.filename))
+            tmp = "{}.{}".format(self.filename, os.getpid())
+            with open(tmp, 'w') as cache:
+                json.dump(entries, cache)
+            os.rename(tmp, self.filename)
+        except (IOError, OSError) as err:
+            log.warning("Could not save discovery cache {}: {}".format(self.filename, err))
+
+
 class CephRoles(object):
     """
     Create reasonable proposals from the existing hardware
     """
 
-    def __init__(self, settings, cluster, servers, writer):
+    def __init__(self, settings, cluster, servers, writer, discovery=None):
         """
         Initialize role secrets, track parameters
         """
         self.cluster = cluster
         self.servers = servers
         self.writer = writer
+        self.discovery = discovery
+        self._cidrs = {}
 
         self.root_dir = settings.root_dir
         self.search = __utils__['deepsea_minions.show']()
@@ -579,7 +668,7 @@ class CephRoles(object):
             filename = cluster_dir + "/" +  server + ".sls"
             contents = {}
             contents['roles'] = [role]
-            self.writer.write(filename, contents)
+            self.writer.write(filename, contents, server)
 
     def cluster_config(self):
         """
@@ -610,9 +699,7 @@ class CephRoles(object):
         """
 
         networks = {}
-        local = salt.client.LocalClient()
-
-        interfaces = local.cmd(self.search, 'network.interfaces', [], tgt_type="compound")
+        interfaces = self._query('network.interfaces', [])
 
         for minion in interfaces:
             for nic in interfaces[minion]:
@@ -628,11 +715,25 @@ class CephRoles(object):
                             networks[cidr] = [(minion, nic, addr['address'])]
         return networks
 
+    def _query(self, fun, arg):
+        """
+        Run fun on all minions or return the discovery cache results
+        """
+        if self.discovery:
+            return self.discovery.query(fun, arg)
+        local = salt.client.LocalClient()
+        return local.cmd(self.search, fun, arg, tgt_type="compound")
+
     def _network(self, address, netmask):
         """
-        Return CIDR network
+        Return CIDR network.  The network is computed on integers and the
+        ipaddress object is only created once per distinct network.
         """
-        return ipaddress.ip_interface(u'{}/{}'.format(address, netmask)).network
+        key = __utils__['subnets.network'](address, netmask)
+        if key not in self._cidrs:
+            self._cidrs[key] = ipaddress.ip_interface(
+                u'{}/{}'.format(address, netmask)).network
+        return self._cidrs[key]
 
     def public_cluster(self, networks):
         """
@@ -658,15 +759,18 @@ class CephRoles(object):
         priorities = sorted(priorities, key=cmp_to_key(network_sort))
 
         # first step, find public networks using hostname -i in all minions
+        index = __utils__['subnets.index']()
+        for _, network in priorities:
+            index.add(str(network), network)
+
         public_addrs = []
-        local = salt.client.LocalClient()
-        cmd_result = local.cmd(self.search, 'cmd.run', ['hostname -i'], tgt_type="compound")
+        cmd_result = self._query('cmd.run', ['hostname -i'])
         for _, addrs in cmd_result.items():
-            addr_list = addrs.split(' ')
-            public_addrs.extend([ipaddress.ip_address(u'{}'.format(addr))
-                                 for addr in addr_list if not addr.startswith('127.')])
+            public_addrs.extend([addr for addr in addrs.split(' ')
+                                 if not addr.startswith('127.')])
+        found = index.count(public_addrs)
         for _, network in priorities:
-            if reduce(operator.__or__, [addr in network for addr in public_addrs], False):
+            if network in found:
                 public_networks.append(network)
         for network in public_networks:
             networks.pop(network)
@@ -675,13 +779,13 @@ class CephRoles(object):
         master_addrs = []
         __opts__ = salt.config.minion_config('/etc/salt/minion')
         __grains__ = salt.loader.grains(__opts__)
-        master_addrs.extend([ipaddress.ip_address(u'{}'.format(addr))
-                            for addr in __grains__['ipv4'] if not addr.startswith('127.')])
+        master_addrs.extend([addr for addr in __grains__['ipv4']
+                             if not addr.startswith('127.')])
+        found = index.count(master_addrs)
         for _, network in priorities:
             if network not in networks:
                 continue
-            if reduce(operator.__and__, [addr not in network for addr in master_addrs], True) and \
-               len(networks[network]) > 1:
+            if network not in found and len(networks[network]) > 1:
                 cluster_networks.append(network)
         for network in cluster_networks:
             networks.pop(network)
@@ -703,15 +807,14 @@ class CephRoles(object):
 
         # fourth step, remove redudant public networks
         filtered_list = []
-        cmd_result = local.cmd(self.search, 'grains.get', ['ipv4'], tgt_type="compound")
+        cmd_result = self._query('grains.get', ['ipv4'])
+        index = __utils__['subnets.index']()
+        for network in public_networks:
+            index.add(str(network), network)
+        memberships = {key: index.count(addr_list)
+                       for key, addr_list in cmd_result.items()}
         for network in public_networks:
-            to_remove = []
-            for key, addr_list in cmd_result.items():
-                if reduce(operator.__or__,
-                          [ipaddress.ip_address(u'{}'.format(addr)) in network
-                           for addr in addr_list],
-                          False):
-                    to_remove.append(key)
+            to_remove = [key for key in cmd_result if network in memberships[key]]
             for key in to_remove:
                 cmd_result.pop(key)
             filtered_list.append(network)
@@ -742,7 +845,7 @@ class CephCluster(object):
     Generate cluster assignment files
     """
 
-    def __init__(self, settings, writer, **kwargs):
+    def __init__(self, settings, writer, discovery=None, **kwargs):
         """
         Track cluster names, set minions to actively responding minions
 
@@ -758,7 +861,10 @@ class CephCluster(object):
         self.search = __utils__['deepsea_minions.show']()
 
         local = salt.client.LocalClient()
-        self.minions = local.cmd(self.search, 'grains.get', ['id'], tgt_type="compound")
+        if discovery:
+            self.minions = {minion: minion for minion in discovery.minions()}
+        else:
+            self.minions = local.cmd(self.search, 'grains.get', ['id'], tgt_type="compound")
 
         _rgws = local.cmd(self.search, 'pillar.get', ['rgw_configurations'], tgt_type="compound")
         for node in _rgws:
@@ -786,7 +892,7 @@ class CephCluster(object):
                 contents = {}
                 contents['cluster'] = cluster
 
-                self.writer.write(filename, contents)
+                self.writer.write(filename, contents, minion)
 
     def _global(self):
         """
@@ -863,6 +969,8 @@ def help_():
     """
     usage = ('salt-run populate.proposals:\n\n'
              '    Generate the necessary configuration fragments for Salt\n'
+             '    Only minions with a changed network or disk fingerprint are\n'
+             '    queried again, cache=False rediscovers all minions\n'
              '\n\n')
     print(usage)
     return ""
@@ -877,14 +985,22 @@ def proposals(**kwargs):
 
     salt_writer = SaltWriter(**kwargs)
 
-    ceph_cluster = CephCluster(settings, salt_writer, **kwargs)
+    discovery = None
+    if kwargs.get('cache', True):
+        discovery = DiscoveryCache(__utils__['deepsea_minions.show']())
+        salt_writer.unchanged = set(discovery.minions()) - discovery.changed
+
+    ceph_cluster = CephCluster(settings, salt_writer, discovery, **kwargs)
     ceph_cluster.generate()
 
     for name in ceph_cluster.names:
         # Determine roles and save proposals
-        ceph_roles = CephRoles(settings, name, ceph_cluster.minions, salt_writer)
+        ceph_roles = CephRoles(settings, name, ceph_cluster.minions, salt_writer,
+                               discovery)
         ceph_roles.generate()
         ceph_roles.cluster_config()
+    if discovery:
+        discovery.save()
     return [True]
 
 
@@ -5,18 +5,23 @@ Generates the hardware profiles for a minion
 """
 from __future__ import absolute_import
 from __future__ import print_function
+import ctypes
 import pprint
 from os.path import isdir, isfile, join
 import os
 import re
+import shutil
+import time
 
 # pylint: disable=redefined-builtin
 from sys import exit
 import logging
 from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 
 # pylint: disable=import-error,3rd-party-module-not-gated,redefined-builtin
 import salt.client
+import six
 import yaml
 
 # pylint: disable=import-error
@@ -280,31 +285,287 @@ def peek(**kwargs):
             pprint.pprint(_proposal)
 
 
+def _label(drive):
+    """
+    Label a drive by vendor (or model for virtual machines) and capacity like
+    populate.HardwareProfile does
+    """
+    vendor = drive.get("Vendor", drive.get("Model", ""))
+    if " " in vendor:
+        if re.search(r"intel", vendor, re.IGNORECASE):
+            vendor = "Intel"
+        else:
+            vendor = vendor.split()[-1]
+    return vendor + re.sub(" ", "", drive.get("Capacity", ""))
+
+
+def _signature(disks):
+    """
+    Return the hardware signature of a node. Nodes with the same signature
+    have the same drives in the same order and receive the same proposal
+    up to the device names.
+    """
+    return tuple(
+        (_label(disk), disk.get("rotational"), disk.get("Driver")) for disk in disks
+    )
+
+
+def _kind(path):
+    """
+    Identify the naming scheme of a device link by stripping the serial,
+    e.g. scsi-SATA_INTEL_SSDSC2BA40_<serial> or wwn-<id>
+    """
+    dirname, basename = os.path.split(path)
+    if "_" in basename:
+        return dirname, basename.rsplit("_", 1)[0]
+    return dirname, basename.split("-")[0]
+
+
+def _device_map(rep_disks, disks):
+    """
+    Map the device names of one node to the device names of the same drive
+    slots of an identical node. Ambiguous names are left out.
+    """
+    mapping = {}
+    for rep_disk, disk in zip(rep_disks, disks):
+        mapping[rep_disk["Device File"]] = disk["Device File"]
+        kinds = {}
+        for path in disk.get("Device Files", "").split(", "):
+            kinds.setdefault(_kind(path), []).append(path)
+        for path in rep_disk.get("Device Files", "").split(", "):
+            candidates = kinds.get(_kind(path), [])
+            if len(candidates) == 1:
+                mapping[path] = candidates[0]
+    return mapping
+
+
+def _map_proposal(proposal, mapping):
+    """
+    Replace the device names of a proposal. Returns None if a device name
+    cannot be mapped.
+    """
+    if isinstance(proposal, dict):
+        mapped = {}
+        for key, value in proposal.items():
+            key = _map_proposal(key, mapping)
+            value = _map_proposal(value, mapping)
+            if key is None or value is None:
+                return None
+            mapped[key] = value
+        return mapped
+    if isinstance(proposal, list):
+        mapped = [_map_proposal(item, mapping) for item in proposal]
+        if None in mapped:
+            return None
+        return mapped
+    if isinstance(proposal, six.string_types) and proposal.startswith("/dev/"):
+        return mapping.get(proposal)
+    return proposal
+
+
+def _generate(local_client, target, args):
+    """
+    Run proposal.generate once per hardware signature and derive the
+    proposals of identical nodes by mapping their device names. Nodes
+    which cannot be mapped generate their own proposal.
+    """
+    disks = local_client.cmd(target, "cephdisks.list", tgt_type="compound", kwarg=args)
+
+    groups = {}
+    fallback = []
+    for node in sorted(disks):
+        if isinstance(disks[node], list):
+            groups.setdefault(_signature(disks[node]), []).append(node)
+        else:
+            fallback.append(node)
+    log.info(
+        "{} nodes with {} distinct hardware signatures".format(len(disks), len(groups))
+    )
+
+    representatives = [nodes[0] for nodes in groups.values()]
+    proposals = {}
+    if representatives:
+        proposals = local_client.cmd(
+            representatives, "proposal.generate", tgt_type="list", kwarg=args
+        )
+
+    for nodes in groups.values():
+        rep = nodes[0]
+        if not isinstance(proposals.get(rep), dict):
+            fallback.extend(nodes[1:])
+            continue
+        for node in nodes[1:]:
+            mapping = _device_map(disks[rep], disks[node])
+            proposal = _map_proposal(proposals[rep], mapping)
+            if proposal is None:
+                log.info("cannot map proposal of {} to {}".format(rep, node))
+                fallback.append(node)
+            else:
+                proposals[node] = proposal
+
+    if fallback:
+        proposals.update(
+            local_client.cmd(fallback, "proposal.generate", tgt_type="list", kwarg=args)
+        )
+    return proposals
+
+
+def _dump(filename, content, overwrite=True):
+    """
+    Write content as yaml unless the file already has the same content.
+    Returns True if the file changed.
+    """
+    data = yaml.dump(content, default_flow_style=False)
+    if isfile(filename):
+        if not overwrite:
+            return False
+        with open(filename) as infile:
+            if infile.read() == data:
+                return False
+    with open(filename, "w") as outfile:
+        outfile.write(data)
+    return True
+
+
 def _write_proposal(prop, profile_dir):
     """
-    Save the proposal for a specific minion
+    Save the proposal for a specific minion. Returns the changed files
+    relative to profile_dir.
     """
     node, proposal = list(prop.items())[0]
+    changed = []
 
     # write out roles
-    role_file = "{}/cluster/{}.sls".format(profile_dir, node)
-
-    with open(role_file, "w") as outfile:
-        content = {"roles": ["storage"]}
-        # implement merge of existing data
-        yaml.dump(content, outfile, default_flow_style=False)
+    role_file = "cluster/{}.sls".format(node)
+    # implement merge of existing data
+    if _dump(join(profile_dir, role_file), {"roles": ["storage"]}):
+        changed.append(role_file)
 
     # TODO do not hardcode cluster name ceph here
-    profile_file = "{}/stack/default/ceph/minions/{}.yml".format(profile_dir, node)
-    if isfile(profile_file):
+    profile_file = "stack/default/ceph/minions/{}.yml".format(node)
+    if isfile(join(profile_dir, profile_file)):
         log.warning("not overwriting existing proposal {}".format(node))
-        return
+        return changed
 
     # write storage profile
-    with open(profile_file, "w") as outfile:
-        content = {"ceph": {"storage": {"osds": proposal}}}
-        # implement merge of existing data
-        yaml.dump(content, outfile, default_flow_style=False)
+    content = {"ceph": {"storage": {"osds": proposal}}}
+    # implement merge of existing data
+    if _dump(join(profile_dir, profile_file), content, overwrite=False):
+        changed.append(profile_file)
+    return changed
+
+
+def _exchange(path1, path2):
+    """
+    Atomically exchange two paths with renameat2, which needs Linux 3.15
+    and glibc 2.28.  Returns False if not supported.
+    """
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return False
+    at_fdcwd, rename_exchange = -100, 2
+    if renameat2(at_fdcwd, path1.encode("utf-8"), at_fdcwd,
+                 path2.encode("utf-8"), rename_exchange) != 0:
+        log.warning("renameat2 failed: {}".format(os.strerror(ctypes.get_errno())))
+        return False
+    return True
+
+
+class ProposalWriter(object):
+    """
+    Write the proposals of all nodes into a staging copy of the profile
+    directory and switch to it at once, so that a partially written or a
+    missing profile is never visible.
+
+    The profile directory is a symlink to a hidden version directory.  A
+    new version is activated by renaming a new symlink over the old one.
+    """
+
+    def __init__(self, profile_dir, threads=8):
+        self.profile_dir = profile_dir
+        parent, name = os.path.split(profile_dir)
+        # hidden, so policy.cfg globs do not match
+        self.staging_dir = join(
+            parent, ".{}.{}-{}".format(name, int(time.time() * 1000000), os.getpid())
+        )
+        self.link = join(parent, ".{}.link-{}".format(name, os.getpid()))
+        self.threads = threads
+
+    def _stage(self):
+        """
+        Copy the current profile directory
+        """
+        if isdir(self.staging_dir):
+            shutil.rmtree(self.staging_dir)
+        if isdir(self.profile_dir):
+            shutil.copytree(self.profile_dir, self.staging_dir, symlinks=True)
+        # TODO do not hardcode cluster name ceph here
+        for subdir in ["stack/default/ceph/minions", "cluster"]:
+            if not isdir(join(self.staging_dir, subdir)):
+                os.makedirs(join(self.staging_dir, subdir), 0o755)
+
+    def _swap(self):
+        """
+        Point the profile directory to the staging directory
+        """
+        if os.path.lexists(self.link):
+            os.remove(self.link)
+        os.symlink(os.path.basename(self.staging_dir), self.link)
+        if os.path.islink(self.profile_dir) or not os.path.lexists(self.profile_dir):
+            previous = None
+            if os.path.islink(self.profile_dir):
+                previous = os.path.realpath(self.profile_dir)
+            os.rename(self.link, self.profile_dir)
+            if previous and isdir(previous):
+                shutil.rmtree(previous)
+            return
+        # A plain directory from an earlier version is replaced once
+        if not _exchange(self.link, self.profile_dir):
+            log.warning(
+                "Replacing {} is not atomic without renameat2".format(self.profile_dir)
+            )
+            os.rename(self.profile_dir, "{}.old".format(self.link))
+            os.rename(self.link, self.profile_dir)
+            os.rename("{}.old".format(self.link), self.link)
+        shutil.rmtree(self.link)
+
+    def write(self, proposals, args):
+        """
+        Write all proposals and the filter. Returns a manifest of the
+        changed files and minions, which is also saved as .manifest.
+        """
+        self._stage()
+        pool = ThreadPool(self.threads)
+        try:
+            changed = pool.map(
+                lambda prop: _write_proposal(prop, self.staging_dir), proposals
+            )
+            _record_filter(args, self.staging_dir)
+            manifest = {
+                "files": sorted([f for files in changed for f in files]),
+                "minions": sorted(
+                    [list(prop)[0] for prop, files in zip(proposals, changed) if files]
+                ),
+            }
+            _dump(join(self.staging_dir, ".manifest"), manifest)
+            self._swap()
+        # pylint: disable=broad-except
+        except Exception:
+            if isdir(self.staging_dir):
+                shutil.rmtree(self.staging_dir)
+            if os.path.islink(self.link):
+                os.remove(self.link)
+            raise
+        finally:
+            pool.close()
+            pool.join()
+        log.info(
+            "Changed {} files of {} minions".format(
+                len(manifest["files"]), len(manifest["minions"])
+            )
+        )
+        return manifest
 
 
 def _record_filter(args, base_dir):
@@ -319,7 +580,7 @@ def _record_filter(args, base_dir):
 
     current_filter = {}
     with open(filter_file) as filehandle:
-        current_filter = yaml.load(filehandle)
+        current_filter = yaml.safe_load(filehandle)
     if current_filter is None:
         current_filter = {}
 
@@ -552,10 +813,19 @@ class ReplaceDiskOn(object):
         return None
 
 
+def _replace(minion):
+    """
+    Replace the disks of a minion, returns the minion name
+    """
+    replace_operation = ReplaceDiskOn(minion)
+    replace_operation.replace()
+    return replace_operation.name
+
+
 def populate(**kwargs):
     """
     Aggregate the results of the modules and save the desired proposal for
-    all minions.
+    all minions. Returns the manifest of changed files and minions.
     """
     args = _parse_args(kwargs)
 
@@ -568,41 +838,31 @@ def populate(**kwargs):
 
     non_targets = []
     if minions_to_replace:
-        for minion in minions_to_replace:
-            replace_operation = ReplaceDiskOn(minion)
-            replace_operation.replace()
-            non_targets.append(replace_operation.name)
+        pool = ThreadPool(min(len(minions_to_replace), 8))
+        try:
+            non_targets = pool.map(_replace, minions_to_replace)
+        finally:
+            pool.close()
+            pool.join()
 
         # generate proposals for all nodes but the ones with a replace operation
-        proposals = local_client.cmd(
+        proposals = _generate(
+            local_client,
             "{} and not {}".format(args["target"], " and not ".join(non_targets)),
-            "proposal.generate",
-            tgt_type="compound",
-            kwarg=args,
+            args,
         )
     else:
-        proposals = local_client.cmd(
-            args["target"], "proposal.generate", tgt_type="compound", kwarg=args
-        )
-
-    # check if profile of 'name' exists
-    if not isdir(profile_dir):
-        os.makedirs(profile_dir, 0o755)
-    # TODO do not hardcode cluster name ceph here
-    if not isdir("{}/stack/default/ceph/minions".format(profile_dir)):
-        os.makedirs("{}/stack/default/ceph/minions".format(profile_dir), 0o755)
-    if not isdir("{}/cluster".format(profile_dir)):
-        os.makedirs("{}/cluster".format(profile_dir), 0o755)
+        proposals = _generate(local_client, args["target"], args)
 
     # determine which proposal to choose
+    chosen = []
     for node, proposal in proposals.items():
         _proposal = _choose_proposal(node, proposal, args)
         if _proposal:
-            _write_proposal(_proposal, profile_dir)
-    # write out .filter here...will need some logic to merge existing data too.
-    _record_filter(args, profile_dir)
-
-    return True
+            chosen.append(_proposal)
+    # the writer records the .filter too...will need some logic to merge
+    # existing data.
+    return ProposalWriter(profile_dir).write(chosen, args)
 
 
 __func_alias__ = {"help_": "help"}
@@ -42,6 +42,11 @@ def help_():
              'salt-run select.from pillar=var role=default_role attr=value1,value2 :\n\n'
              '    Returns an array of grain values that matches the pillar variable.\n'
              '    Defaults to role if variable is not found.\n'
+             '\n\n'
+             'salt-run select.failure_domains failure_domain=rack hosts=2 '
+             'key=value [key=value...]:\n\n'
+             '    Returns an array of minion batches.  No batch contains two minions\n'
+             '    within the same CRUSH bucket of the failure domain type.\n'
              '\n\n')
     print(usage)
     return ""
@@ -221,6 +226,75 @@ def from_(pillar, role, *args, **kwargs):
         return results
     return [[None] * (1 + len(args))]
 
+
+def failure_domains(failure_domain='rack', hosts=0, **kwargs):
+    """
+    Return batches of minions matching the search criteria where no batch
+    holds two minions of the same failure domain, e.g. the same rack.  At
+    most hosts minions are in a batch if set.  Minions that are not part
+    of the CRUSH map form a failure domain of their own.
+    """
+    _minions = minions(**kwargs)
+    if not _minions:
+        return []
+
+    # When search matches no minions, salt prints to stdout.  Suppress stdout.
+    _stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+
+    local = salt.client.LocalClient()
+    grains = local.cmd(_minions, 'grains.item', ['host'], tgt_type="list")
+    master_minion = __salt__['master.minion']()
+    tree = local.cmd(master_minion, 'osd.tree_from_master').get(master_minion, {})
+
+    sys.stdout = _stdout
+
+    domains = _crush_domains(tree, failure_domain)
+    grouped = {}
+    for minion in sorted(_minions):
+        host = grains.get(minion, {}).get('host', minion)
+        grouped.setdefault(domains.get(host, host), []).append(minion)
+    log.debug("failure domains: {}".format(grouped))
+
+    # Take from the failure domains with the most minions left first
+    batches = []
+    while grouped:
+        order = sorted(grouped, key=lambda domain: (-len(grouped[domain]), domain))
+        if int(hosts) > 0:
+            order = order[:int(hosts)]
+        batches.append([grouped[domain].pop(0) for domain in order])
+        for domain in order:
+            if not grouped[domain]:
+                del grouped[domain]
+    return batches
+
+
+def _crush_domains(tree, failure_domain):
+    """
+    Return a mapping of CRUSH host names to the name of their ancestor
+    bucket of type failure_domain
+    """
+    nodes = {}
+    parents = {}
+    for node in tree.get('nodes', []):
+        nodes[node['id']] = node
+        for child in node.get('children', []):
+            parents[child] = node['id']
+
+    domains = {}
+    for node in nodes.values():
+        if node['type'] != 'host':
+            continue
+        domains[node['name']] = node['name']
+        ancestor = parents.get(node['id'])
+        while ancestor is not None:
+            if nodes[ancestor]['type'] == failure_domain:
+                domains[node['name']] = nodes[ancestor]['name']
+                break
+            ancestor = parents.get(ancestor)
+    return domains
+
+
 __func_alias__ = {
                  'from_': 'from',
                  'help_': 'help',
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=modernize-parse-error
+"""
+Append only store of benchmark results.
+
+Every run is indexed by cluster, kind (e.g. osd_bench, iperf_public, rbd),
+job spec, client set and timestamp.  Results are stored per key (an OSD id,
+an address or a client) and metric.  A new run can be compared against the
+median of the previous runs of the same kind, job and client set.
+"""
+
+from __future__ import absolute_import
+import logging
+import os
+import sqlite3
+import time
+import six
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cluster TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    job TEXT NOT NULL,
+    clients TEXT NOT NULL,
+    timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_lookup
+    ON runs (cluster, kind, job, clients, timestamp);
+CREATE TABLE IF NOT EXISTS results (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    key TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_run ON results (run);
+"""
+
+
+def _median(values):
+    """
+    Return the median of a list of numbers
+    """
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+def _lower_is_better(metric):
+    """
+    Latencies regress when they grow
+    """
+    return 'lat' in metric
+
+
+class BenchmarkStore(object):
+    """
+    SQLite backed result store
+    """
+
+    def __init__(self, filename):
+        """
+        Open or create the database
+        """
+        self.filename = filename
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.conn = sqlite3.connect(filename)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        """
+        Close the database
+        """
+        self.conn.close()
+
+    @staticmethod
+    def _clients(clients):
+        """
+        Normalize the client set
+        """
+        return ",".join(sorted(set(str(client) for client in clients or [])))
+
+    def record(self, kind, results, cluster='ceph', job='', clients=None,
+               metric='value', timestamp=None):
+        """
+        Append a run.  Results map a key to a number, or to a dict of metric
+        and number.  Values which are not numbers are skipped.  Returns the
+        run id.
+        """
+        rows = []
+        for key, value in results.items():
+            metrics = value if isinstance(value, dict) else {metric: value}
+            for name, number in metrics.items():
+                if isinstance(number, (int, float)) and not isinstance(number, bool):
+                    rows.append((str(key), name, float(number)))
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO runs (cluster, kind, job, clients, timestamp) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (cluster, kind, job, self._clients(clients),
+                 timestamp if timestamp is not None else time.time()))
+            run = cursor.lastrowid
+            self.conn.executemany(
+                "INSERT INTO results (run, key, metric, value) VALUES (?, ?, ?, ?)",
+                [(run,) + row for row in rows])
+        log.debug("Recorded run {} of {} with {} results".format(run, kind, len(rows)))
+        return run
+
+    def runs(self, kind, cluster='ceph', job=None, clients=None, limit=None, before=None):
+        """
+        Return the runs of a kind, newest first.  Job and clients narrow
+        the selection when given.
+        """
+        query = "SELECT id, cluster, kind, job, clients, timestamp FROM runs " \
+                "WHERE cluster = ? AND kind = ?"
+        args = [cluster, kind]
+        if job is not None:
+            query += " AND job = ?"
+            args.append(job)
+        if clients is not None:
+            query += " AND clients = ?"
+            args.append(clients if isinstance(clients, six.string_types)
+                        else self._clients(clients))
+        if before is not None:
+            query += " AND id < ?"
+            args.append(before)
+        query += " ORDER BY timestamp DESC, id DESC"
+        if limit:
+            query += " LIMIT ?"
+            args.append(int(limit))
+        columns = ['id', 'cluster', 'kind', 'job', 'clients', 'timestamp']
+        return [dict(zip(columns, row)) for row in self.conn.execute(query, args)]
+
+    def values(self, run):
+        """
+        Return the results of a run by key and metric
+        """
+        results = {}
+        for key, metric, value in self.conn.execute(
+                "SELECT key, metric, value FROM results WHERE run = ?", (run,)):
+            results.setdefault(key, {})[metric] = value
+        return results
+
+    def compare(self, kind, cluster='ceph', job=None, clients=None, runs=5,
+                threshold=10, run=None):
+        """
+        Compare a run, by default the latest, against the median of the
+        previous runs with the same job and client set.  A key regresses
+        when a metric is threshold percent worse than its history.
+        """
+        if run is None:
+            latest = self.runs(kind, cluster, job, clients, limit=1)
+        else:
+            latest = [row for row in self.runs(kind, cluster) if row['id'] == int(run)]
+        if not latest:
+            return {}
+        latest = latest[0]
+        history = self.runs(kind, cluster, latest['job'], latest['clients'],
+                            limit=runs, before=latest['id'])
+        past = {}
+        for row in history:
+            for key, metrics in self.values(row['id']).items():
+                for metric, value in metrics.items():
+                    past.setdefault((key, metric), []).append(value)
+
+        regressions = {}
+        for key, metrics in self.values(latest['id']).items():
+            for metric, value in metrics.items():
+                if (key, metric) not in past:
+                    continue
+                median = _median(past[(key, metric)])
+                if not median:
+                    continue
+                change = (value - median) * 100.0 / median
+                worse = change if _lower_is_better(metric) else -change
+                if worse >= threshold:
+                    regressions.setdefault(key, {})[metric] = {
+                        'value': value, 'median': median, 'change': round(change, 2)}
+        return {'run': latest,
+                'compared': [row['id'] for row in history],
+                'regressions': regressions}
+
+
+def store(opts=None, filename=None):
+    """
+    Salt exporter func
+    """
+    if filename is None:
+        cachedir = (opts or {}).get('cachedir', '/var/cache/salt/master')
+        filename = os.path.join(cachedir, 'deepsea', 'benchmarks.db')
+    return BenchmarkStore(filename)
+
+
+def record(opts, kind, results, **kwargs):
+    """
+    Append results to the store in the cachedir of opts and return the run
+    id.  A failing store does not fail the benchmark, None is returned.
+    """
+    try:
+        _store = store(opts)
+        try:
+            return _store.record(kind, results, **kwargs)
+        finally:
+            _store.close()
+    except Exception as error:  # pylint: disable=broad-except
+        log.warning("Cannot store {} results: {}".format(kind, error))
+    return None
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=modernize-parse-error
+"""
+Collect job returns from the master event bus.
+
+Runners publishing with cmd_async used to poll jobs.lookup_jid for every
+outstanding jid.  The collector listens to salt/job/<jid>/ret/<minion>
+events instead and gives up on minions which do not return in time.
+"""
+
+from __future__ import absolute_import
+import logging
+import time
+# pylint: disable=import-error,3rd-party-module-not-gated
+import salt.config
+import salt.utils.event
+
+log = logging.getLogger(__name__)
+
+
+class Collector(object):
+    """
+    Gather returns of published jobs.  Create the collector before
+    publishing, so that no return is missed.
+    """
+
+    def __init__(self, opts=None, timeout=60):
+        """
+        Subscribe to the master event bus
+        """
+        if opts is None:
+            opts = salt.config.client_config('/etc/salt/master')
+        self.timeout = timeout
+        self.event = salt.utils.event.get_master_event(opts, opts['sock_dir'], listen=True)
+        self.jobs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, jid, minions=None):
+        """
+        Track a job.  Without the expected minions, the minions are taken
+        from the salt/job/<jid>/new event.  Jobs which did not match any
+        minion (jid 0 or empty) are ignored.
+        """
+        if not jid:
+            return
+        self.jobs[str(jid)] = {'minions': set(minions) if minions is not None else None,
+                               'returns': {},
+                               'deadline': time.time() + self.timeout,
+                               'done': False}
+
+    def publish(self, local, tgt, fun, arg=(), **kwargs):
+        """
+        Publish a job with the LocalClient and track it
+        """
+        pub = local.run_job(tgt, fun, list(arg), **kwargs)
+        if pub:
+            self.add(pub['jid'], pub.get('minions'))
+        return pub.get('jid') if pub else None
+
+    def _update(self, job):
+        """
+        Mark the job done when every expected minion returned
+        """
+        if job['minions'] is not None and job['minions'] <= set(job['returns']):
+            job['done'] = True
+
+    def _expire(self, now):
+        """
+        Give up on minions which have not returned before the deadline
+        """
+        for jid, job in self.jobs.items():
+            if not job['done'] and now > job['deadline']:
+                job['done'] = True
+                missing = (job['minions'] or set()) - set(job['returns'])
+                log.warning("Job {} timed out waiting for {}".format(jid, sorted(missing)))
+
+    def iter_returns(self):
+        """
+        Yield jid, minion and return as the returns arrive
+        """
+        while not all(job['done'] for job in self.jobs.values()):
+            event = self.event.get_event(wait=1, tag='salt/job/', full=True,
+                                         match_type='startswith')
+            if event:
+                parts = event['tag'].split('/')
+                job = self.jobs.get(parts[2]) if len(parts) > 3 else None
+                if job and not job['done']:
+                    data = event.get('data', {})
+                    if parts[3] == 'new' and job['minions'] is None:
+                        job['minions'] = set(data.get('minions', []))
+                    elif parts[3] == 'ret' and len(parts) > 4:
+                        minion = data.get('id', parts[4])
+                        job['returns'][minion] = data.get('return')
+                        yield parts[2], minion, data.get('return')
+                    self._update(job)
+            self._expire(time.time())
+
+    def collect(self):
+        """
+        Wait for all jobs and return the returns by jid and minion
+        """
+        for _ in self.iter_returns():
+            pass
+        return {jid: job['returns'] for jid, job in self.jobs.items()}
+
+    def missing(self):
+        """
+        Return the minions which did not return by jid
+        """
+        return {jid: sorted(job['minions'] - set(job['returns']))
+                for jid, job in self.jobs.items()
+                if job['minions'] and job['minions'] - set(job['returns'])}
+
+    def close(self):
+        """
+        Unsubscribe from the event bus
+        """
+        self.event.destroy()
+
+
+def collector(opts=None, timeout=60):
+    """
+    Salt exporter func
+    """
+    return Collector(opts, timeout)
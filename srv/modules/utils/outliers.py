@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=modernize-parse-error
+"""
+Robust statistics for benchmark results.
+
+Results are summarized by median, MAD and percentiles.  Outliers are
+values whose modified z-score (Iglewicz and Hoaglin) exceeds a threshold,
+overall and within groups such as host or device class.
+"""
+
+from __future__ import absolute_import
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# 0.6745 is the 75th percentile of the standard normal distribution, which
+# makes the MAD comparable to the standard deviation
+MAD_SCALE = 0.6745
+
+# Scale of the mean absolute deviation, used when more than half of the
+# values are identical and the MAD is 0
+MEANAD_SCALE = 0.7979
+
+
+def _numbers(values):
+    """
+    Keep numeric values only, failures are often reported as strings
+    """
+    return {key: float(value) for key, value in values.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)}
+
+
+def percentile(ordered, pct):
+    """
+    Return the percentile of a sorted list with linear interpolation
+    """
+    if not ordered:
+        return None
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values, percentiles=PERCENTILES):
+    """
+    Return count, mean, median, MAD and percentiles of a list of numbers
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return {'count': 0}
+    median = percentile(ordered, 50)
+    deviations = sorted([abs(value - median) for value in ordered])
+    return {'count': len(ordered),
+            'mean': sum(ordered) / len(ordered),
+            'min': ordered[0],
+            'max': ordered[-1],
+            'median': median,
+            'mad': percentile(deviations, 50),
+            'meanad': sum(deviations) / len(deviations),
+            'percentiles': {'p{}'.format(pct): percentile(ordered, pct)
+                            for pct in percentiles}}
+
+
+def scores(values, summary):
+    """
+    Return the modified z-score of each value
+    """
+    if summary['mad']:
+        scale = summary['mad'] / MAD_SCALE
+    elif summary['meanad']:
+        scale = summary['meanad'] / MEANAD_SCALE
+    else:
+        return {key: 0.0 for key in values}
+    return {key: (value - summary['median']) / scale for key, value in values.items()}
+
+
+def _outliers(values, summary, threshold):
+    """
+    Return the values with a score beyond the threshold
+    """
+    found = {}
+    for key, score in scores(values, summary).items():
+        if abs(score) > threshold:
+            found[key] = {'value': values[key], 'score': round(score, 2)}
+    return found
+
+
+def analyze(values, groups=None, threshold=3.5, percentiles=PERCENTILES):
+    """
+    Summarize values by key and find outliers.  Groups map a group name to
+    the member of each key, e.g. {'host': {'0': 'data1'}, 'class': {...}}.
+    Each member of a group gets its own summary and outliers.
+    """
+    numbers = _numbers(values)
+    result = summarize(numbers.values(), percentiles)
+    result['failed'] = sorted([key for key in values if key not in numbers])
+    if not numbers:
+        return result
+    result['outliers'] = _outliers(numbers, result, threshold)
+    result['groups'] = {}
+    for name, membership in (groups or {}).items():
+        members = {}
+        for key, value in numbers.items():
+            members.setdefault(str(membership.get(key)), {})[key] = value
+        result['groups'][name] = {}
+        for member, member_values in members.items():
+            summary = summarize(member_values.values(), percentiles)
+            summary['outliers'] = _outliers(member_values, summary, threshold)
+            result['groups'][name][member] = summary
+    return result
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=modernize-parse-error
+"""
+Integer based subnet index shared by the runners.
+
+Addresses and networks are kept as (version, integer) pairs, so membership
+is a mask and a dictionary lookup instead of constructing ipaddress objects
+for every address and network combination.
+"""
+
+from __future__ import absolute_import
+import socket
+import binascii
+from collections import Counter
+import six
+
+FAMILIES = {4: (socket.AF_INET, 32), 6: (socket.AF_INET6, 128)}
+
+
+def _mask(version, prefix):
+    """
+    Return the network mask of prefix as integer
+    """
+    bits = FAMILIES[version][1]
+    return ((1 << bits) - 1) ^ ((1 << (bits - prefix)) - 1)
+
+
+def address(addr):
+    """
+    Return (version, integer) of an address or None if it cannot be parsed,
+    e.g. a scoped link local address
+    """
+    if not isinstance(addr, six.string_types):
+        try:
+            addr = addr.decode()
+        except AttributeError:
+            return None
+    version = 6 if ':' in addr else 4
+    try:
+        packed = socket.inet_pton(FAMILIES[version][0], addr.strip())
+    except (socket.error, ValueError):
+        return None
+    return version, int(binascii.hexlify(packed), 16)
+
+
+def _prefix(version, netmask):
+    """
+    Return the prefix length of a netmask given as length or address
+    """
+    if str(netmask).isdigit():
+        return int(netmask)
+    parsed = address(netmask)
+    if parsed is None or parsed[0] != version:
+        return None
+    return bin(parsed[1]).count('1')
+
+
+def network(addr, netmask=None):
+    """
+    Return (version, integer, prefix) of a network given as cidr, or as
+    address and netmask. Host bits are cleared. None if it cannot be parsed.
+    """
+    if netmask is None:
+        if '/' not in addr:
+            return None
+        addr, netmask = addr.split('/', 1)
+    parsed = address(addr)
+    if parsed is None:
+        return None
+    version, value = parsed
+    prefix = _prefix(version, netmask)
+    if prefix is None or prefix > FAMILIES[version][1]:
+        return None
+    return version, value & _mask(version, prefix), prefix
+
+
+def _networks(networks):
+    """
+    Accept a single network, a comma separated string or a list
+    """
+    if isinstance(networks, six.string_types):
+        networks = networks.split(',')
+    return [net.strip() for net in networks if net.strip()]
+
+
+class SubnetIndex(object):
+    """
+    Networks grouped by version and prefix length. A lookup masks the
+    address once per distinct prefix length.
+    """
+
+    def __init__(self, networks=None):
+        self.buckets = {}
+        for net in _networks(networks or []):
+            self.add(net)
+
+    def add(self, net, value=None):
+        """
+        Add a network. The value is returned by lookups and defaults to the
+        network string.
+        """
+        parsed = network(net) if isinstance(net, six.string_types) else net
+        if parsed is None:
+            return False
+        version, value_int, prefix = parsed
+        bucket = self.buckets.setdefault((version, prefix), {})
+        bucket.setdefault(value_int, net if value is None else value)
+        return True
+
+    def lookup(self, addr):
+        """
+        Return the values of all networks containing addr
+        """
+        parsed = address(addr) if not isinstance(addr, tuple) else addr
+        if parsed is None:
+            return []
+        version, value = parsed
+        found = []
+        for (bucket_version, prefix), bucket in self.buckets.items():
+            if bucket_version == version:
+                net = value & _mask(version, prefix)
+                if net in bucket:
+                    found.append(bucket[net])
+        return found
+
+    def contains(self, addr):
+        """
+        Check whether any network contains addr
+        """
+        return bool(self.lookup(addr))
+
+    def filter(self, addresses):
+        """
+        Return the addresses which are in any network
+        """
+        return [addr for addr in addresses if self.contains(addr)]
+
+    def count(self, addresses):
+        """
+        Count the addresses per network
+        """
+        counter = Counter()
+        for addr in addresses:
+            counter.update(self.lookup(addr))
+        return counter
+
+    def most_common(self, addresses):
+        """
+        Return the network with the most addresses or None
+        """
+        common = self.count(addresses).most_common(1)
+        return common[0][0] if common else None
+
+
+def index(networks=None):
+    """
+    Salt exporter func
+    """
+    return SubnetIndex(networks)
+
+
+def filter_addresses(addresses, networks):
+    """
+    Return the addresses which are in one of the networks
+    """
+    return SubnetIndex(networks).filter(addresses)
@@ -9,6 +9,7 @@ from __future__ import absolute_import
 from __future__ import print_function
 import os
 import re
+import json
 import xml.etree.ElementTree as et
 from glob import glob
 from subprocess import Popen, PIPE
@@ -26,6 +27,21 @@ except ImportError:
 
 VERSION = 0.2
 
+# Arguments of HardwareDetections, only these invalidate the device cache
+DETECTION_OPTIONS = ('detection_method', 'hw_raid', 'raid_controller_name', 'sw_raid')
+
+# GPT partition type codes created by ceph-disk
+GUID_CODES = {'data': "45B0969E-9B03-4F30-B4C6-B4B80CEFF106",
+              'journal': "4FBD7E29-9D25-41B8-AFD0-062C0CEFF05D",
+              'db': "30CD0809-C2B2-499C-8879-2D6B78529876",
+              'wal': "5CE17FCE-4087-4169-B7FF-056CC58473F9",
+              'osd_lockbox': "FB3AABF9-D25F-47CC-BF5E-721D1816496B",
+              'luks_journal': "45B0969E-9B03-4F30-B4C6-35865CEFF106",
+              'luks_wal': "86A32090-3647-40B9-BBBD-38D8C573AA86",
+              'luks_db': "166418DA-C469-4022-ADF4-B30AFD37F176",
+              'plain_wal': "306E8683-4FE2-4330-B7C0-00A917C16966",
+              'plain_db': "93B0052D-02D9-4D8A-A43B-33A3EE4DFBC3"}
+
 
 # pylint: disable=too-few-public-methods
 class HardwareDetections(object):
@@ -46,6 +62,8 @@ class HardwareDetections(object):
         gptfdisk, pciutils, smartmontools
         """
         self.detection_method = self._find_detection_tool(kwargs.get('detection_method', None))
+        self.partition_types = None
+        self._probed = None
         self.hw_raid = kwargs.get('hw_raid', None)
         self.hw_raid_name = kwargs.get('raid_controller_name', None)
         self.software_raid = kwargs.get('sw_raid', None)
@@ -272,9 +290,12 @@ class HardwareDetections(object):
             return self._lshw
         if overwrite_method == 'hwinfo':
             return self._hwinfo
+        if overwrite_method == 'lsblk':
+            return self._lsblk
         if overwrite_method:
             err_msg = """ The tool: {} you specified for hardware detection
-            is not implemented in cephdisks. Use lshw or hwinfo, please.""".format(overwrite_method)
+            is not implemented in cephdisks. Use lshw, hwinfo or lsblk, please.""".format(
+                overwrite_method)
             log.error(err_msg)
             raise Exception(err_msg)
 
@@ -294,17 +315,29 @@ class HardwareDetections(object):
         """
         Parse hwinfo output into dictionary
 
+        Without a device, probe all disks with a single hwinfo call and
+        return the parsed entries keyed by device file.
+
         args:
             device (str): short name of device(sda, sdb..)
         return:
             dict: hwinfo output as dict
         """
-        results = {}
         hwinfo_path = self._which('hwinfo')
-        cmd = "{} --disk --only /dev/{}".format(hwinfo_path, device)
+        if device is None:
+            cmd = "{} --disk".format(hwinfo_path)
+        else:
+            cmd = "{} --disk --only /dev/{}".format(hwinfo_path, device)
         proc = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True)
+        sections = []
+        results = {}
         for line in proc.stdout:
             line = __salt__['helper.convert_out'](line)
+            if line and not line[0].isspace():
+                # "33: SCSI 20.0: 10600 Disk" starts the next disk
+                results = {}
+                sections.append(results)
+                continue
             match = re.match("  ([^:]+): (.*)", line)
             if match:
                 if match.group(1) == "Capacity":
@@ -322,6 +355,154 @@ class HardwareDetections(object):
                                                          match.group(2))
                 else:
                     results[match.group(1)] = re.sub(r'"', '', match.group(2))
+        if device is not None:
+            if not sections:
+                return results
+            return sections[-1]
+        disks = {}
+        for section in sections:
+            if 'Device File' in section:
+                disks[section['Device File']] = section
+        return disks
+
+    def _lsblk_table(self):
+        """
+        Return all block devices from a single lsblk call.  lsblk reads
+        the udev database and does not probe the devices.
+        """
+        lsblk_path = self._which('lsblk', failhard=False)
+        if not lsblk_path:
+            return []
+        cmd = ("{} --json --list --bytes "
+               "--output KNAME,PKNAME,TYPE,PARTTYPE,SERIAL".format(lsblk_path))
+        proc = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True)
+        stdout, _ = proc.communicate()
+        if proc.returncode != 0 or not stdout:
+            log.info("lsblk failed, falling back to per partition queries")
+            return []
+        stdout = __salt__['helper.convert_out'](stdout)
+        try:
+            return json.loads(stdout)['blockdevices']
+        except (ValueError, KeyError):
+            log.info("Could not parse lsblk output")
+            return []
+
+    def _partition_types(self, table):
+        """
+        Return the GPT partition type codes by partition name, e.g.
+        { 'sda1': '4FBD7E29-9D25-41B8-AFD0-062C0CEFF05D' }
+        """
+        types = {}
+        for entry in table:
+            if entry.get('type') == 'part' and entry.get('parttype'):
+                types[entry['kname']] = entry['parttype'].upper()
+        return types
+
+    def _device_links(self):
+        """
+        Map devices to their symlinks in /dev/disk/by-id and
+        /dev/disk/by-path by reading the links directly
+        """
+        links = {}
+        for directory in ['/dev/disk/by-id', '/dev/disk/by-path']:
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                target = os.path.normpath(os.path.join(directory, os.readlink(path)))
+                links.setdefault(target, []).append(path)
+        return links
+
+    # pylint: disable=no-self-use
+    def _sysfs(self, base, attribute):
+        """
+        Return a stripped sysfs attribute or an empty string
+        """
+        filename = os.path.join(base, attribute)
+        if not os.path.exists(filename):
+            return ""
+        with open(filename, 'r') as _fd:
+            return _fd.read().strip()
+
+    # pylint: disable=no-self-use
+    def _drivers(self, base):
+        """
+        Return the drivers of the device and its controller in the
+        same order hwinfo lists them, e.g. 'megaraid_sas, sd' or 'nvme'
+        """
+        drivers = []
+        own = os.path.realpath(os.path.join(base, 'device'))
+        path = own
+        while path.startswith('/sys/devices/'):
+            driver = os.path.join(path, 'driver')
+            if os.path.exists(driver):
+                drivers.insert(0, os.path.basename(os.path.realpath(driver)))
+                if path != own:
+                    break
+            path = os.path.dirname(path)
+        return ", ".join(drivers)
+
+    # pylint: disable=no-self-use
+    def _capacity(self, size):
+        """
+        Format bytes as hwinfo does, e.g. 1862 GB
+        """
+        units = ['kB', 'MB', 'GB', 'TB', 'PB']
+        value = size // 1024
+        index = 0
+        while value >= 10000 and index < len(units) - 1:
+            value //= 1024
+            index += 1
+        return "{} {}".format(value, units[index])
+
+    def _lsblk(self):
+        """
+        Assemble the hwinfo fields used by the proposals (Capacity, Bytes,
+        Model, Vendor, Device, Driver, Serial ID, Device File and Device
+        Files) from one lsblk call, /sys/block and /dev/disk.
+
+        return:
+            dict: entries keyed by device file
+        """
+        table = self._lsblk_table()
+        self.partition_types = self._partition_types(table)
+        serials = {}
+        for entry in table:
+            if entry.get('serial'):
+                serials[entry['kname']] = entry['serial']
+        links = self._device_links()
+
+        results = {}
+        for path in glob('/sys/block/*/device'):
+            base = os.path.dirname(path)
+            device = os.path.basename(base)
+            device_file = "/dev/" + device
+            disk = {'Device File': device_file,
+                    'Device Files': ", ".join([device_file] + links.get(device_file, [])),
+                    'Driver': self._drivers(base)}
+
+            size = int(self._sysfs(base, 'size') or 0) * 512
+            disk['Capacity'] = self._capacity(size)
+            disk['Bytes'] = str(size)
+
+            vendor = self._sysfs(base, 'device/vendor')
+            model = self._sysfs(base, 'device/model')
+            if not model:
+                # Virtual machines do not have vendors
+                disk['Model'] = 'Disk'
+            elif vendor and vendor != 'ATA':
+                disk['Vendor'] = vendor
+                disk['Device'] = model
+                disk['Model'] = "{} {}".format(vendor, model)
+            elif ' ' in model:
+                disk['Vendor'], disk['Device'] = model.split(' ', 1)
+                disk['Model'] = model
+            else:
+                disk['Model'] = model
+
+            if device in serials:
+                disk['Serial ID'] = serials[device]
+            results[device_file] = disk
         return results
 
     def _udevadm(self, device):
@@ -344,29 +525,31 @@ class HardwareDetections(object):
             raise Exception(err_msg)
         return device
 
-    def _osd(self, device, ids):
+    def _osd(self, device, ids, codes=None):
         """
         Search for Ceph Data and Journal partitions
+
+        Partition type codes already known, i.e. from lsblk, are passed
+        in codes by partition id.  Only the others are queried with sgdisk.
         """
         log.debug("Checking partitions {} on device {}".format(ids, device))
-        guuid_table = {'data': "45B0969E-9B03-4F30-B4C6-B4B80CEFF106",
-                       'journal': "4FBD7E29-9D25-41B8-AFD0-062C0CEFF05D",
-                       'db': "30CD0809-C2B2-499C-8879-2D6B78529876",
-                       'wal': "5CE17FCE-4087-4169-B7FF-056CC58473F9",
-                       'osd_lockbox': "FB3AABF9-D25F-47CC-BF5E-721D1816496B",
-                       'luks_journal': "45B0969E-9B03-4F30-B4C6-35865CEFF106",
-                       'luks_wal': "86A32090-3647-40B9-BBBD-38D8C573AA86",
-                       'luks_db': "166418DA-C469-4022-ADF4-B30AFD37F176",
-                       'plain_wal': "306E8683-4FE2-4330-B7C0-00A917C16966",
-                       'plain_db': "93B0052D-02D9-4D8A-A43B-33A3EE4DFBC3"}
-        sgdisk_path = self._which('sgdisk')
+        if codes is None:
+            codes = {}
+        sgdisk_path = None
         for partition_id in ids:
+            if codes.get(partition_id):
+                if codes[partition_id] in GUID_CODES.values():
+                    log.debug('Found signs that {} belongs to ceph'.format(device))
+                    return True
+                continue
+            if sgdisk_path is None:
+                sgdisk_path = self._which('sgdisk')
             cmd = "{} -i {} {}".format(sgdisk_path, partition_id, device)
             proc = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True)
             for line in proc.stdout:
                 line = __salt__['helper.convert_out'](line)
                 if line.startswith("Partition GUID code:"):
-                    for guuid_code in guuid_table.values():
+                    for guuid_code in GUID_CODES.values():
                         if guuid_code in line:
                             log.debug('Found signs that {} belongs to ceph'.format(device))
                             return True
@@ -445,7 +628,73 @@ class HardwareDetections(object):
             if _rf not in hardware_dict or not hardware_dict[_rf]:
                 raise ValueError("{} is not included in the hardware dict.".format(_rf))
 
-    def assemble_device_list(self):
+    def _probe(self):
+        """
+        Run the expensive detections once per instance.  Only needed when
+        at least one disk has to be examined.
+
+        returns:
+            (tuple): raid controller information and detection results
+        """
+        if self._probed is None:
+            raid_ctrl = self._detect_raidctrl()
+            _hw = self.detection_method()
+            if self.partition_types is None:
+                self.partition_types = self._partition_types(self._lsblk_table())
+            self._probed = (raid_ctrl, _hw)
+        return self._probed
+
+    def _assemble_device(self, base):
+        """
+        Examine a single disk.
+
+        args:
+            base (str): base sys path of device
+        returns:
+            (dict): hardware information or None for unusable devices
+        """
+        device = os.path.basename(base)
+        raid_ctrl, _hw = self._probe()
+        # Check this on a per disk basis
+        # Skip partitioned, non-osd drives
+        partitions = glob(base + "/" + device + "*")
+        if partitions:
+            if 'nvme' in device:
+                ids = [re.sub(r'.+p(\d+)', r'\1', partition)
+                       for partition in partitions]
+            else:
+                ids = [re.sub(r'\D+', '', partition)
+                       for partition in partitions]
+            codes = {}
+            for _id, partition in zip(ids, partitions):
+                codes[_id] = self.partition_types.get(os.path.basename(partition))
+            if not self._osd("/dev/" + device, ids, codes):
+                return None
+        else:
+            log.debug('No partitions detected on {}'.format(device))
+
+        if self._is_removable(base):
+            return None
+
+        if _hw and '/dev/' + device in _hw:
+            hardware = _hw['/dev/'+device]
+        else:
+            hardware = self.detection_method(device)
+
+        if raid_ctrl['raidtype'] and self._which('smartctl'):
+            # Trying to correct the kernel's assumption here
+            log.info("Requirements met to utilize S.M.A.R.T on {}".format(device))
+            rotational = self._query_disktype(device, raid_ctrl, base)
+            hardware['rotational'] = rotational
+        else:
+            hardware['rotational'] = self._is_rotational(base)
+
+        hardware['device'] = device
+        hardware['blank'] = not partitions
+        self._preflight_check(hardware)
+        return hardware
+
+    def assemble_device_list(self, cache=None):
         """
         Find all unpartitioned and allocated osds.  Return unified dict.
 
@@ -453,56 +702,148 @@ class HardwareDetections(object):
         smartctl rather than on lshw/hwinfo. The kernel might have wrong
         information here.
 
+        With a DeviceCache, disks with an unchanged fingerprint are taken
+        from the cache and the detection tools only run when a disk changed.
+
         return:
             (list): list of dicts containing information about usable devices
         """
 
         drives = []
-        raid_ctrl = self._detect_raidctrl()
-        _hw = self.detection_method()
         for path in glob('/sys/block/*/device'):
             log.debug("Checking path: {}".format(path))
             base = os.path.dirname(path)
             device = os.path.basename(base)
-            # Check this on a per disk basis
-            # Skip partitioned, non-osd drives
-            partitions = glob(base + "/" + device + "*")
-            if partitions:
-                # pylint: disable=unused-variable
-                for partition in partitions:
-                    if 'nvme' in device:
-                        ids = [re.sub(r'.+p(\d+)', r'\1', partition)
-                               for partition in partitions]
-                    else:
-                        ids = [re.sub(r'\D+', '', partition)
-                               for partition in partitions]
-                if not self._osd("/dev/" + device, ids):
-                    continue
+            if cache is None:
+                hardware = self._assemble_device(base)
             else:
-                log.debug('No partitions detected on {}'.format(device))
+                fingerprint = cache.fingerprint(base)
+                if cache.valid(device, fingerprint):
+                    log.debug("Using cached entry for {}".format(device))
+                    hardware = cache.get(device)
+                else:
+                    hardware = self._assemble_device(base)
+                    cache.set(device, fingerprint, hardware)
+            if hardware:
+                log.debug('Adding {} to the list of cephdisks.'.format(device))
+                drives.append(hardware)
+        if cache is not None:
+            cache.save()
+        return drives
 
-            if self._is_removable(base):
-                continue
 
-            if _hw:
-                hardware = _hw['/dev/'+device]
-            else:
-                hardware = self.detection_method(device)
+class DeviceCache(object):
+    """
+    On disk cache of the assembled device list.  Each disk is stored with
+    a fingerprint of its sysfs attributes, partitions and udev database
+    entry.  The udev entry is rewritten on every change event, such as a
+    new partition table, which invalidates the disk.
+    """
 
-            if raid_ctrl['raidtype'] and self._which('smartctl'):
-                # Trying to correct the kernel's assumption here
-                log.info("Requirements met to utilize S.M.A.R.T on {}".format(device))
-                rotational = self._query_disktype(device, raid_ctrl, base)
-                hardware['rotational'] = rotational
-            else:
-                hardware['rotational'] = self._is_rotational(base)
+    def __init__(self, filename, options=None):
+        """
+        Load the cache.  A different module version or different options
+        discard all entries.
+        """
+        self.filename = filename
+        self.options = options or {}
+        self.devices = {}
+        self.seen = set()
+        try:
+            with open(filename, 'r') as _fd:
+                content = json.load(_fd)
+            if (content.get('version') == VERSION and
+                    content.get('options') == self.options):
+                self.devices = content.get('devices', {})
+        except (IOError, OSError, ValueError) as error:
+            log.debug("Ignoring cache {}: {}".format(filename, error))
 
-            hardware['device'] = device
-            hardware['blank'] = not partitions
-            self._preflight_check(hardware)
-            log.debug('Adding {} to the list of cephdisks.'.format(device))
-            drives.append(hardware)
-        return drives
+    # pylint: disable=no-self-use
+    def _read(self, base, attribute):
+        """
+        Return stripped contents of a sysfs attribute or None
+        """
+        try:
+            with open(os.path.join(base, attribute), 'r') as _fd:
+                return _fd.read().strip()
+        except (IOError, OSError):
+            return None
+
+    def _mtime(self, base):
+        """
+        Return the modification time of the udev database entry
+        """
+        dev = self._read(base, 'dev')
+        if dev:
+            try:
+                return os.path.getmtime("/run/udev/data/b{}".format(dev))
+            except OSError:
+                pass
+        return None
+
+    def fingerprint(self, base):
+        """
+        Collect the values that change when a disk is replaced, resized
+        or repartitioned
+        """
+        device = os.path.basename(base)
+        values = [self._read(base, 'size'),
+                  self._read(base, 'removable'),
+                  self._read(base, 'queue/rotational'),
+                  self._mtime(base)]
+        for partition in sorted(glob(base + "/" + device + "*")):
+            values.append([os.path.basename(partition),
+                           self._read(partition, 'start'),
+                           self._read(partition, 'size'),
+                           self._mtime(partition)])
+        return values
+
+    def valid(self, device, fingerprint):
+        """
+        Check that a cached entry exists for an unchanged device
+        """
+        self.seen.add(device)
+        return (device in self.devices and
+                self.devices[device]['fingerprint'] == fingerprint)
+
+    def get(self, device):
+        """
+        Return the cached hardware information
+        """
+        return self.devices[device]['hardware']
+
+    def set(self, device, fingerprint, hardware):
+        """
+        Store the hardware information, None for unusable devices
+        """
+        self.seen.add(device)
+        self.devices[device] = {'fingerprint': fingerprint,
+                                'hardware': hardware}
+
+    def clear(self):
+        """
+        Discard all entries
+        """
+        self.devices = {}
+
+    def save(self):
+        """
+        Write the entries of the devices seen atomically.  Failures only
+        cost a rescan on the next call.
+        """
+        devices = {device: entry for device, entry in self.devices.items()
+                   if device in self.seen}
+        content = {'version': VERSION, 'options': self.options,
+                   'devices': devices}
+        tmp = "{}.{}".format(self.filename, os.getpid())
+        try:
+            with open(tmp, 'w') as _fd:
+                json.dump(content, _fd)
+            os.rename(tmp, self.filename)
+        except (IOError, OSError, TypeError, ValueError) as error:
+            log.warning("Could not write cache {}: {}".format(self.filename, error))
+            if os.path.exists(tmp):
+                os.remove(tmp)
 
 
 def device_(devicename, pathname=None, match=None):
@@ -512,15 +853,36 @@ def device_(devicename, pathname=None, match=None):
     pathname = _pathname_setting(pathname)
     match = _match_setting(match)
 
-    cmd = (r"find -L {} -samefile {} \( {} \)".format(pathname, devicename, match))
-    _, _stdout, _stderr = __salt__['helper.run'](cmd)
-    if _stdout:
+    patterns = _match_patterns(match)
+    if patterns is None:
+        cmd = (r"find -L {} -samefile {} \( {} \)".format(pathname, devicename, match))
+        _, _stdout, _stderr = __salt__['helper.run'](cmd)
         _devices = _stdout.split()
+    else:
+        _devices = __salt__['devlinks.aliases'](devicename, pathname=pathname,
+                                                patterns=patterns)
+    if _devices:
         index = _prefer_underscores(_devices)
         return _devices[index]
     return devicename
 
 
+def _match_patterns(match):
+    """
+    Convert a find expression of -name tests joined by -o to shell
+    patterns.  Return None for any other expression, which still needs find.
+    """
+    tokens = match.split()
+    if len(tokens) % 3 != 2:
+        return None
+    patterns = []
+    for idx in range(0, len(tokens), 3):
+        if tokens[idx] != '-name' or (idx + 2 < len(tokens) and tokens[idx + 2] != '-o'):
+            return None
+        patterns.append(tokens[idx + 1])
+    return patterns
+
+
 def _match_setting(match):
     """
     Predence is command line, pillar, then default
@@ -580,20 +942,50 @@ def _prefer_underscores(devicenames):
     return index
 
 
-def list_(**kwargs):
+def _detection_setting(kwargs):
+    """
+    Predence is command line, pillar, then the available tools
+    """
+    if 'detection_method' not in kwargs:
+        method = _seek('ceph:modules:cephdisks:detection_method'.split(':'), __pillar__)
+        if method:
+            log.info("Using pillar value {} for detection_method".format(method))
+            kwargs['detection_method'] = method
+    return kwargs
+
+
+def _device_cache(kwargs, refresh=False):
+    """
+    Return the device cache in the minion cachedir.  Only the options of
+    HardwareDetections change the result, other arguments such as those
+    passed by proposal.populate or Salt's own __pub arguments are ignored.
+    """
+    options = {key: value for key, value in kwargs.items()
+               if key in DETECTION_OPTIONS}
+    cachedir = __opts__.get('cachedir', '/var/cache/salt/minion')
+    cache = DeviceCache(os.path.join(cachedir, 'cephdisks.json'), options)
+    if refresh:
+        cache.clear()
+    return cache
+
+
+def list_(refresh=False, **kwargs):
     """
-    List the disks
+    List the disks.  Unchanged disks are returned from the cache unless
+    refresh is set.
     """
+    kwargs = _detection_setting(kwargs)
     hwd = HardwareDetections(**kwargs)
-    return hwd.assemble_device_list()
+    return hwd.assemble_device_list(_device_cache(kwargs, refresh))
 
 
-def filter_(key="Device File", **kwargs):
+def filter_(key="Device File", refresh=False, **kwargs):
     """
     Return list of specified key
     """
+    kwargs = _detection_setting(kwargs)
     hwd = HardwareDetections(**kwargs)
-    result = hwd.assemble_device_list()
+    result = hwd.assemble_device_list(_device_cache(kwargs, refresh))
     results = [device[key] for device in result]
     return sorted(results)
 
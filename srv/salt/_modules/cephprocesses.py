@@ -158,6 +158,64 @@ class ProcInfo(object):
             raise NoOSDIDFound
 
 
+class ProcessTable(object):
+    """
+    Snapshot of the process table reduced to the processes named in
+    the processes map.  Only these get a ProcInfo, everything else is
+    skipped after a name lookup.
+
+    A refresh only builds a ProcInfo for processes that were not seen
+    before, so repeated refreshes (i.e. in wait) do not reexamine the whole
+    table.  Processes are identified by pid and creation time to notice
+    reused pids.  Skipped processes keep their key across an exec, so their
+    name is checked again on every refresh.
+    """
+
+    def __init__(self):
+        self.processes = []
+        self.by_name = {}
+        self.osds = {}
+        self._seen = {}
+
+    def refresh(self):
+        """
+        Update the snapshot from the current process table
+        """
+        names = set()
+        for bin_names in processes.values():
+            names.update(bin_names)
+
+        seen = {}
+        for proc in psutil.process_iter():
+            try:
+                key = (proc.pid, proc.create_time())
+                if self._seen.get(key) is not None:
+                    seen[key] = self._seen[key]
+                elif proc.name() in names:
+                    seen[key] = ProcInfo(proc)
+                else:
+                    seen[key] = None
+            except psutil.Error:
+                # process vanished or is not accessible
+                continue
+        self._seen = seen
+        self._index()
+        return self
+
+    def _index(self):
+        """
+        Rebuild the lookups by process name, or executable, and osd id
+        """
+        self.processes = [procinfo for procinfo in self._seen.values() if procinfo]
+        self.by_name = {}
+        self.osds = {}
+        for procinfo in self.processes:
+            for name in set([procinfo.name, procinfo.exe]):
+                self.by_name.setdefault(name, []).append(procinfo)
+            if procinfo.osd_id is not None:
+                self.osds[str(procinfo.osd_id)] = procinfo
+
+
 class NoOSDIDFound(Exception):
     """
     Custom Exception to raise when no OSD ID is found.
@@ -176,6 +234,7 @@ class MetaCheck(object):
         self.running = True
         self.quiet = kwargs.get('quiet', False)
         self.insufficient_osd_count = False
+        self.table = None
         self.__blacklist = kwargs.get('blacklist', dict())
 
     @property
@@ -224,6 +283,20 @@ class MetaCheck(object):
         if prc.exe in processes[role] or prc.name in processes[role]:
             self.up.append(prc)
 
+    def collect(self, table, role):
+        """
+        Add the processes of a role found in the name index of a
+        ProcessTable
+        """
+        self.table = table
+        found = []
+        for name in processes[role]:
+            for prc in table.by_name.get(name, []):
+                if prc not in found:
+                    found.append(prc)
+        for prc in found:
+            self.add(prc, role)
+
     def check_inverts(self, role):
         """
         Running indicates whether the service is in its expected state
@@ -232,8 +305,9 @@ class MetaCheck(object):
         finished yet and is still 'working'
         """
         if role in absent_processes.keys():
+            up_names = self._up_names
             for proc in absent_processes[role]:
-                if proc in [prc.name for prc in self.up]:
+                if proc in up_names:
                     self.running = False
                     # pylint: disable=line-too-long
                     log.error("ERROR: process {} for role {} is pending(working)".format(proc, role))
@@ -243,19 +317,29 @@ class MetaCheck(object):
         If found processes are not in the list of required
         processes, set running to False and mark as down
         """
+        up_names = self._up_names
         for proc in processes[role]:
-            if proc not in [prc.name for prc in self.up]:
+            if proc not in up_names:
                 if not self.quiet:
                     # pylint: disable=line-too-long
                     log.error("ERROR: process {} for role {} is not running".format(proc, role))
                 self.running = False
                 self.down.append(proc)
 
+    @property
+    def _up_names(self):
+        """
+        Property that returns the names of the found processes
+        """
+        return set(prc.name for prc in self.up)
+
     @property
     def _up_osds(self):
         """
         Property that returns a str(osd_id) of filtered ceph-osd processes
         """
+        if self.table is not None:
+            return list(self.table.osds)
         return [str(x.osd_id) for x in self.filter_for('ceph-osd')]
 
     @property
@@ -269,11 +353,14 @@ class MetaCheck(object):
         """
         Check if the sufficient number of OSDs are up
         """
-        if len(self.expected_osds) > len(self._up_osds):
+        expected_osds = self.expected_osds
+        up_osds = self._up_osds
+        if len(expected_osds) > len(up_osds):
             if not self.quiet:
+                missing_osds = list(set(expected_osds) - set(up_osds))
                 # pylint: disable=line-too-long
-                log.error("{} OSDs not running: {}".format(len(self._missing_osds), self._missing_osds))
-                log.error("Found less OSDs then expected. Expected {} | Found {}".format(len(self.expected_osds), len(self._up_osds)))
+                log.error("{} OSDs not running: {}".format(len(missing_osds), missing_osds))
+                log.error("Found less OSDs then expected. Expected {} | Found {}".format(len(expected_osds), len(up_osds)))
             self.insufficient_osd_count = True
         else:
             self.insufficient_osd_count = False
@@ -331,28 +418,52 @@ def _extend_processes():
             processes[rgw_config] = ['radosgw']
 
 
-def check(results=False, **kwargs):
+def check(results=False, per_role=False, table=None, **kwargs):
 
     """
     Query the status of running processes for each role.  Return False if any
     fail.  If results flag is set, return a dictionary of the form:
       { 'down': [ process, ... ], 'up': { process: [ pid, ... ], ...} }
+
+    If per_role is set, evaluate each assigned role separately and return a
+    dictionary keyed by role, e.g. { 'mon': True, 'storage': False }.  Roles
+    that are not assigned to this minion are skipped.  The process table is
+    walked only once regardless of the number of roles.
     """
     _extend_processes()
-    res = MetaCheck(**kwargs)
 
     if 'roles' not in __pillar__:
         log.error("Did not find _roles_ in pillar. Aborting")
         return False
-    for role in kwargs.get('roles', __pillar__['roles']):
-        for running_proc in psutil.process_iter():
-            res.add(ProcInfo(running_proc), role)
+    if table is None:
+        table = ProcessTable().refresh()
+    roles = kwargs.get('roles', __pillar__['roles'])
+
+    if per_role:
+        status = {}
+        for role in roles:
+            if role not in __pillar__['roles']:
+                continue
+            res = _evaluate(MetaCheck(**kwargs), table, [role])
+            status[role] = res.report() if results else res.running
+        return status
+
+    res = _evaluate(MetaCheck(**kwargs), table, roles)
+    return res.report() if results else res.running
+
+
+def _evaluate(res, table, roles):
+    """
+    Run the checks of a MetaCheck for the given roles against an already
+    refreshed ProcessTable
+    """
+    for role in roles:
+        res.collect(table, role)
         res.check_inverts(role)
         res.check_absents(role)
         if role == 'storage':
             res.check_osds()
-
-    return res.report() if results else res.running
+    return res
 
 
 def down():
@@ -366,7 +477,8 @@ def down():
 def wait(**kwargs):
     """
     Periodically check until all services are up or until the timeout is
-    reached.  Use a backoff for the delay to avoid filling logs.
+    reached.  Use a backoff for the delay to avoid filling logs.  The
+    process snapshot is kept between checks and only refreshed.
     """
     settings = {
         'timeout': _timeout(),
@@ -376,8 +488,10 @@ def wait(**kwargs):
 
     end_time = time.time() + settings['timeout']
     current_delay = settings['delay']
+    table = ProcessTable()
     while end_time > time.time():
-        if check(**kwargs):
+        table.refresh()
+        if check(table=table, **kwargs):
             log.debug("Services are up")
             return True
         time.sleep(current_delay)
@@ -3,6 +3,9 @@
 # pylint: disable=import-error,3rd-party-module-not-gated,redefined-builtin
 
 from __future__ import absolute_import
+import hashlib
+import json
+from glob import glob
 
 
 def show_low_sls(*states):
@@ -19,6 +22,26 @@ def show_low_sls(*states):
     return result
 
 
+def fingerprint():
+    """
+    Returns a hash of the network configuration and block devices. Stage 1
+    only rediscovers minions whose fingerprint changed.
+    """
+    interfaces = __salt__['network.interfaces']()
+    addresses = sorted([nic, addr.get('address'), addr.get('netmask')]
+                       for nic in interfaces
+                       for addr in interfaces[nic].get('inet', []))
+    disks = []
+    for path in sorted(glob('/sys/block/*/size')):
+        with open(path, 'r') as size:
+            disks.append([path, size.read().strip()])
+    content = {'addresses': addresses,
+               'hostname': __salt__['cmd.run']('hostname -i'),
+               'ipv4': sorted(__grains__.get('ipv4', [])),
+               'disks': disks}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+
 def user():
     """
     Returns the system user name for running the salt-master and own files
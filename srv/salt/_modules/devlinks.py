@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+In process index of the /dev/disk symlinks.
+
+Device aliases used to be resolved with find -L ... -samefile, which forks
+and walks a whole directory for every lookup.  The index maps each alias
+to its device and each device, by inode, to its aliases.  A directory is
+scanned again when its mtime changes, which happens whenever udev adds or
+removes a link, or when invalidate is called.
+"""
+
+from __future__ import absolute_import
+import fnmatch
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+DIRECTORIES = ['/dev/disk/by-id', '/dev/disk/by-path', '/dev/disk/by-uuid']
+
+
+class Resolver(object):
+    """
+    Bidirectional index of symlinks and devices
+    """
+
+    def __init__(self, directories=None):
+        """
+        Directories are scanned on first use
+        """
+        self.directories = list(directories or DIRECTORIES)
+        self.index = {}
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def _inode(pathname):
+        """
+        Return the identity find -samefile compares, following links
+        """
+        try:
+            stat = os.stat(pathname)
+        except OSError:
+            return None
+        return (stat.st_dev, stat.st_ino)
+
+    def _scan(self, directory):
+        """
+        Return the index of a directory, scan it again if it changed
+        """
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            mtime = None
+        with self.lock:
+            entry = self.index.get(directory)
+            if entry and mtime is not None and entry['mtime'] == mtime:
+                return entry
+            links = {}
+            aliases = {}
+            if mtime is not None:
+                for name in sorted(os.listdir(directory)):
+                    pathname = os.path.join(directory, name)
+                    inode = self._inode(pathname)
+                    if inode:
+                        links[pathname] = (inode, os.path.realpath(pathname))
+                        aliases.setdefault(inode, []).append(pathname)
+            log.debug("Indexed {} links in {}".format(len(links), directory))
+            entry = {'mtime': mtime, 'links': links, 'aliases': aliases}
+            self.index[directory] = entry
+            return entry
+
+    def resolve(self, device):
+        """
+        Return the device of a symlink, same as readlink -f
+        """
+        entry = self._scan(os.path.dirname(device)) \
+            if os.path.dirname(device) in self.directories else None
+        if entry and device in entry['links']:
+            return entry['links'][device][1]
+        return os.path.realpath(device)
+
+    def aliases(self, device, directories=None, patterns=None):
+        """
+        Return the symlinks referring to the same device, optionally
+        limited to names matching any of the shell patterns
+        """
+        inode = self._inode(device)
+        if inode is None:
+            return []
+        result = []
+        for directory in directories or self.directories:
+            for pathname in self._scan(directory)['aliases'].get(inode, []):
+                name = os.path.basename(pathname)
+                if patterns and not any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                    continue
+                result.append(pathname)
+        return result
+
+    def invalidate(self):
+        """
+        Forget the index, e.g. after partitioning
+        """
+        with self.lock:
+            self.index = {}
+
+
+_RESOLVER = Resolver()
+
+
+def resolve(device):
+    """
+    Return the device of a symlink, same as readlink -f
+
+    CLI Example:
+    .. code-block:: bash
+        sudo salt 'node' devlinks.resolve /dev/disk/by-path/pci-0000:00:1f.2-ata-1
+    """
+    return _RESOLVER.resolve(device)
+
+
+def aliases(device, pathname=None, patterns=None):
+    """
+    Return the symlinks of a device in /dev/disk/by-id, by-path and
+    by-uuid, or in pathname.  Patterns is a list of shell patterns for
+    the link names.
+
+    CLI Example:
+    .. code-block:: bash
+        sudo salt 'node' devlinks.aliases /dev/sda
+        sudo salt 'node' devlinks.aliases /dev/sda pathname=/dev/disk/by-path
+    """
+    directories = [pathname] if pathname else None
+    return _RESOLVER.aliases(device, directories, patterns)
+
+
+def short(device):
+    """
+    Return the device node in /dev for an alias, or an empty string
+
+    CLI Example:
+    .. code-block:: bash
+        sudo salt 'node' devlinks.short /dev/disk/by-id/wwn-0x5000c500a1b2c3d4
+    """
+    inode = Resolver._inode(device)
+    target = _RESOLVER.resolve(device)
+    if inode and os.path.dirname(target) == '/dev' and Resolver._inode(target) == inode:
+        return target
+    return ""
+
+
+def invalidate():
+    """
+    Forget the index, the next lookup scans /dev/disk again
+
+    CLI Example:
+    .. code-block:: bash
+        sudo salt 'node' devlinks.invalidate
+    """
+    _RESOLVER.invalidate()
+    return True
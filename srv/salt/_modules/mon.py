@@ -11,7 +11,6 @@ import json
 import logging
 # pylint: disable=import-error,3rd-party-module-not-gated
 import salt.ext.six as six
-import rados
 # pylint: disable=incompatible-py3-code
 log = logging.getLogger(__name__)
 
@@ -40,10 +39,9 @@ class Monitors(object):
 
     def _connect(self):
         """
-        Connect to Ceph cluster
+        Connect to Ceph cluster through the shared connection broker
         """
-        self.cluster = rados.Rados(conffile=self.settings['conf'])
-        self.cluster.connect()
+        self.cluster = __salt__['rados_broker.connect'](conffile=self.settings['conf'])
 
     def list(self):
         """
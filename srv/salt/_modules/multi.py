@@ -146,6 +146,7 @@ def iperf(server, cpu, port):
         sudo salt 'node' multi.iperf <hostname>|<ip> <cpu_core> <port>
     '''
     log.debug('iperf server ={}'.format(server))
+    cpu = int(cpu) % multiprocessing.cpu_count()
     return _summarize_iperf(iperf_client_cmd(server, cpu, port))
 
 
@@ -190,6 +191,25 @@ def iperf_server_cmd(cpu=0, port=5200):
     return LOCALHOST_NAME + ": iperf3 started at cpu " + str(cpu) + " port " + str(port) + "\n"
 
 
+def iperf_servers(*addresses):
+    '''
+    Start an iperf server for each local address in the list.  The port is
+    5200 plus the position of the address in the list, so every address of
+    a host can be tested at the same time.
+
+    CLI Example:
+    .. code-block:: bash
+        sudo salt 'node' multi.iperf_servers <ip> <ip>....
+    '''
+    local = set(__grains__.get('ipv4', []) + __grains__.get('ipv6', []))
+    cpus = multiprocessing.cpu_count()
+    started = []
+    for idx, address in enumerate(addresses):
+        if address in local:
+            started.append(iperf_server_cmd(idx % cpus, 5200 + idx))
+    return "".join(started)
+
+
 def kill_iperf_cmd():
     '''
     Clean up all the iperf3 server and clean it.
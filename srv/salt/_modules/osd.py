@@ -8,6 +8,8 @@ All OSD related functions
 
 from __future__ import absolute_import
 from __future__ import print_function
+import contextlib
+import fcntl
 import glob
 import os
 import json
@@ -15,6 +17,9 @@ import logging
 import time
 import re
 import pprint
+import sqlite3
+import threading
+from multiprocessing.pool import ThreadPool
 import yaml
 # pylint: disable=import-error,3rd-party-module-not-gated,redefined-builtin
 
@@ -31,11 +36,6 @@ try:
 except ImportError:
     log.error("Could not import salt.ext.six")
 
-try:
-    import rados
-except ImportError:
-    pass
-
 # The first functions are different queries for osds.  These can be combined.
 # The two classes should be combined as well.  I thought I would wait for now.
 
@@ -199,8 +199,7 @@ def _tree(**kwargs):
     """
     Return osd tree
     """
-    cluster = rados.Rados(**kwargs)
-    cluster.connect()
+    cluster = __salt__['rados_broker.connect'](**kwargs)
     cmd = json.dumps({"prefix": "osd tree", "format": "json"})
     _, output, _ = cluster.mon_command(cmd, b'', timeout=6)
     osd_tree = json.loads(output)
@@ -224,9 +223,7 @@ def tree_from_any():
     """
     kwargs = {
         'conffile': "/etc/ceph/ceph.conf",
-        'conf': {
-            'keyring': '/var/lib/ceph/bootstrap-osd/ceph.keyring',
-        },
+        'keyring': '/var/lib/ceph/bootstrap-osd/ceph.keyring',
         'name': 'client.bootstrap-osd'
     }
     return _tree(**kwargs)
@@ -253,14 +250,9 @@ class OSDWeight(object):
         }
         self.settings.update(kwargs)
         log.debug("settings: {}".format(pprint.pformat(self.settings)))
-        # self.cluster = rados.Rados(conffile=self.settings['conf'])
-        self.cluster = rados.Rados(conffile=self.settings['conf'],
-                                   conf=dict(keyring=self.settings['keyring']),
-                                   name=self.settings['client'])
-        try:
-            self.cluster.connect()
-        except Exception as error:
-            raise RuntimeError("connection error: {}".format(error))
+        self.cluster = __salt__['rados_broker.connect'](conffile=self.settings['conf'],
+                                                        keyring=self.settings['keyring'],
+                                                        name=self.settings['client'])
 
     def save(self):
         """
@@ -379,60 +371,145 @@ class OSDWeight(object):
         return msg
 
 
+class PollDelay(object):
+    """
+    Delays between polls that start short and grow to a maximum.  This
+    returns quickly when a condition is met within seconds, but avoids
+    hammering the monitors during long waits.
+
+    Optionally, subscribe to the cluster log.  Any message (e.g. PG state
+    changes, health updates) ends the current delay early.
+    """
+
+    def __init__(self, maximum, minimum=1, backoff=2, cluster=None):
+        self.maximum = maximum
+        self.minimum = min(minimum, maximum)
+        self.backoff = backoff
+        self.current = self.minimum
+        self.waited = 0
+        self.event = threading.Event()
+        self.cluster = None
+        if cluster:
+            self._subscribe(cluster)
+
+    def _subscribe(self, cluster):
+        """
+        Register for cluster log messages, ignore clients without support
+        """
+        try:
+            cluster.monitor_log('info', self._notify, None)
+            self.cluster = cluster
+        except Exception as error:  # pylint: disable=broad-except
+            log.debug("Not subscribing to cluster log: {}".format(error))
+
+    # pylint: disable=unused-argument
+    def _notify(self, *args):
+        """
+        Cluster log callback
+        """
+        self.event.set()
+
+    def sleep(self):
+        """
+        Wait for the current delay or until the cluster log reports
+        a change.  Increase the delay for the next call.
+        """
+        start = time.time()
+        if self.cluster:
+            self.event.wait(self.current)
+            self.event.clear()
+            self.waited += time.time() - start
+        else:
+            time.sleep(self.current)
+            self.waited += self.current
+        self.current = min(self.current * self.backoff, self.maximum)
+
+    def reset(self):
+        """
+        Restart the window of time waited without progress
+        """
+        self.waited = 0
+
+    def close(self):
+        """
+        Unregister from the cluster log
+        """
+        if self.cluster:
+            try:
+                self.cluster.monitor_log('info', None, None)
+            except Exception as error:  # pylint: disable=broad-except
+                log.debug("Unregistering from cluster log failed: {}".format(error))
+            self.cluster = None
+
+
 class CephPGs(object):
     """
     Query PG states and pause until all are active+clean
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self, cluster=None, **kwargs):
         """
-        Initialize settings, connect to Ceph cluster
+        Initialize settings, connect to Ceph cluster unless a connected
+        cluster is passed in
         """
         self.settings = {
             'conf': "/etc/ceph/ceph.conf",
             'timeout': 120,
             'keyring': '/etc/ceph/ceph.client.admin.keyring',
             'client': 'client.admin',
-            'delay': 12
+            'delay': 12,
+            'min_delay': 1,
+            'backoff': 2,
+            'events': False
         }
         self.settings.update(kwargs)
         log.debug("settings: {}".format(pprint.pformat(self.settings)))
-        self.cluster = rados.Rados(conffile=self.settings['conf'],
-                                   conf=dict(keyring=self.settings['keyring']),
-                                   name=self.settings['client'])
-        try:
-            self.cluster.connect()
-        except Exception as error:
-            raise RuntimeError("connection error: {}".format(error))
+        if cluster:
+            self.cluster = cluster
+            return
+        self.cluster = __salt__['rados_broker.connect'](conffile=self.settings['conf'],
+                                                        keyring=self.settings['keyring'],
+                                                        name=self.settings['client'])
 
     def quiescent(self):
         """
         Wait until PGs are active+clean or timeout is reached.  Default is a
         2 minute sliding window.  Return if no PGs are present.
+
+        Polling starts at min_delay and backs off to delay.  With events
+        enabled, cluster log messages cut the current delay short.
         """
-        i = 0
         last = []
         if self.settings['delay'] == 0:
             raise ValueError("The delay cannot be 0")
-        while i < self.settings['timeout']/self.settings['delay']:
-            current = self.pg_states()
-            if not current:
-                log.warning("PGs are not present")
-                return
-            if len(current) == 1 and current[0]['name'] == 'active+clean':
-                log.warning("PGs are active+clean")
-                return
-            log.warning("Waiting on active+clean {}".format(pprint.pformat(current)))
-            if self._pg_value(last) != self._pg_value(current):
-                # Making progress - reset counter
-                log.debug("Resetting active+clean counter")
-                i = 0
-                last = current
-
-            i += 1
-            log.debug("iteration: {} last: {} current: {}".
-                      format(i, self._pg_value(last), self._pg_value(current)))
-            time.sleep(self.settings['delay'])
+        cluster = None
+        if self.settings.get('events', False):
+            cluster = self.cluster
+        delay = PollDelay(self.settings['delay'],
+                          minimum=self.settings.get('min_delay', 1),
+                          backoff=self.settings.get('backoff', 2),
+                          cluster=cluster)
+        try:
+            while delay.waited < self.settings['timeout']:
+                current = self.pg_states()
+                if not current:
+                    log.warning("PGs are not present")
+                    return
+                if len(current) == 1 and current[0]['name'] == 'active+clean':
+                    log.warning("PGs are active+clean")
+                    return
+                log.warning("Waiting on active+clean {}".format(pprint.pformat(current)))
+                if self._pg_value(last) != self._pg_value(current):
+                    # Making progress - reset window
+                    log.debug("Resetting active+clean window")
+                    delay.reset()
+                    last = current
+
+                log.debug("waited: {} last: {} current: {}".
+                          format(delay.waited, self._pg_value(last), self._pg_value(current)))
+                delay.sleep()
+        finally:
+            delay.close()
 
         log.error("Timeout expired waiting on active+clean")
         raise RuntimeError("Timeout expired waiting on active+clean")
@@ -457,6 +534,101 @@ class CephPGs(object):
         return json.loads(output)['pg_summary']['num_pg_by_state']
 
 
+class OSDBench(object):
+    """
+    Run the OSD bench through librados on many OSDs at once.  At most
+    per_host OSDs of a host and concurrency OSDs in total are busy.
+    """
+
+    def __init__(self, per_host=1, concurrency=16, **kwargs):
+        """
+        Initialize settings, connect to Ceph cluster
+        """
+        self.settings = {
+            'conf': "/etc/ceph/ceph.conf",
+            'timeout': 300,
+            'keyring': '/etc/ceph/ceph.client.admin.keyring',
+            'client': 'client.admin'
+        }
+        self.settings.update(kwargs)
+        self.per_host = max(int(per_host), 1)
+        self.concurrency = max(int(concurrency), 1)
+        self.cluster = __salt__['rados_broker.connect'](conffile=self.settings['conf'],
+                                                        keyring=self.settings['keyring'],
+                                                        name=self.settings['client'])
+
+    def locations(self):
+        """
+        Return the host and device class of each OSD from the osd tree
+        """
+        cmd = json.dumps({"prefix": "osd tree", "format": "json"})
+        _, output, _ = self.cluster.mon_command(cmd, b'', timeout=6)
+        locations = {}
+        for node in json.loads(output)['nodes']:
+            if node['type'] == 'host':
+                for _id in node.get('children', []):
+                    locations.setdefault(_id, {})['host'] = node['name']
+            elif node['type'] == 'osd':
+                location = locations.setdefault(node['id'], {})
+                location.setdefault('host', None)
+                location['class'] = node.get('device_class')
+        return locations
+
+    @staticmethod
+    def order(ids, hosts):
+        """
+        Interleave the ids by host, so that consecutive OSDs are on
+        different hosts and workers do not queue behind one host
+        """
+        by_host = {}
+        for _id in ids:
+            by_host.setdefault(hosts.get(_id), []).append(_id)
+        queues = [by_host[host] for host in sorted(by_host, key=str)]
+        ordered = []
+        for idx in range(max([len(queue) for queue in queues] or [0])):
+            ordered.extend([queue[idx] for queue in queues if idx < len(queue)])
+        return ordered
+
+    def _bench(self, _id, locks, hosts):
+        """
+        Bench a single OSD, return id and bytes per second or None
+        """
+        cmd = json.dumps({"prefix": "bench", "format": "json"})
+        with locks[hosts.get(_id)]:
+            try:
+                _rc, output, err = self.cluster.osd_command(int(_id), cmd, b'',
+                                                            timeout=self.settings['timeout'])
+            except Exception as error:  # pylint: disable=broad-except
+                _rc, err = 1, str(error)
+        if _rc != 0:
+            log.error("osd.{} bench failed: {}".format(_id, err))
+            return _id, None
+        return _id, json.loads(output)['bytes_per_sec']
+
+    def run(self, ids=None):
+        """
+        Bench the listed or all OSDs.  Returns bytes per second, host and
+        device class by id.
+        """
+        locations = self.locations()
+        hosts = {_id: locations[_id].get('host') for _id in locations}
+        if ids is None:
+            ids = sorted(locations)
+        ids = [int(_id) for _id in ids]
+        locks = {host: threading.BoundedSemaphore(self.per_host)
+                 for host in set(hosts.get(_id) for _id in ids)}
+        pool = ThreadPool(min(self.concurrency, len(ids)) or 1)
+        try:
+            results = pool.imap_unordered(lambda _id: self._bench(_id, locks, hosts),
+                                          self.order(ids, hosts))
+            return {str(_id): {'bytes_per_sec': bps,
+                               'host': hosts.get(_id),
+                               'class': locations.get(_id, {}).get('class')}
+                    for _id, bps in results}
+        finally:
+            pool.close()
+
+
 def _settings(**kwargs):
     """
     Initialize settings to use the client.storage name and keyring
@@ -513,6 +685,20 @@ def restore_weight(osd_id, **kwargs):
     return True
 
 
+def bench(ids=None, per_host=1, concurrency=16, **kwargs):
+    """
+    Run the OSD bench on the listed or all OSDs, at most per_host OSDs of a
+    host and concurrency OSDs in total at once.  Returns bytes per second,
+    host and device class by OSD id.  Failed OSDs have None bytes per second.
+
+    CLI Example:
+    .. code-block:: bash
+        sudo salt 'admin*' osd.bench per_host=2 concurrency=32
+    """
+    settings = {key: kwargs[key] for key in kwargs if not key.startswith('__')}
+    return OSDBench(per_host=per_host, concurrency=concurrency, **settings).run(ids)
+
+
 def _find_paths(device):
     """
     Return matching pathnames, special case devices ending with digits
@@ -528,12 +714,94 @@ def readlink(device, follow=True):
     """
     Return the short name for a symlink device
     """
-    option = ''
     if follow:
-        option = '-f'
-    cmd = "readlink {} {}".format(option, device)
-    _, stdout, _ = __salt__['helper.run'](cmd)
-    return stdout
+        return __salt__['devlinks.resolve'](device)
+    try:
+        return os.readlink(device)
+    except OSError:
+        return ""
+
+
+class DeviceSnapshot(object):
+    """
+    One view of the mount table, the /dev/disk symlinks, the sysfs device
+    sizes and the cephdisks mine.  Evaluating many OSDs against a snapshot
+    reads each source once and forks no subprocesses.
+    """
+
+    def __init__(self, mounts="/proc/mounts", disk_dir="/dev/disk",
+                 sysfs="/sys/class/block"):
+        """
+        Read the mount table and the /dev/disk symlinks
+        """
+        self.sysfs = sysfs
+        self.mounts = self._mounts(mounts)
+        self.links = self._links(disk_dir)
+        self.sizes = {}
+        self.cache = {}
+
+    @staticmethod
+    def _mounts(filename):
+        """
+        Return the device and mount point of each mount
+        """
+        entries = []
+        with open(filename, "r") as mounts:
+            for line in mounts:
+                entry = line.split()
+                if len(entry) > 1:
+                    entries.append((entry[0], entry[1]))
+        return entries
+
+    @staticmethod
+    def _links(disk_dir):
+        """
+        Resolve every symlink below /dev/disk
+        """
+        links = {}
+        for pathname in glob.glob("{}/*/*".format(disk_dir)):
+            if os.path.islink(pathname):
+                links[pathname] = os.path.realpath(pathname)
+        return links
+
+    def readlink(self, device):
+        """
+        Return the short name for a symlink device, same as readlink -f
+        """
+        if device not in self.links:
+            self.links[device] = os.path.realpath(device)
+        return self.links[device]
+
+    def mountpoint(self, device):
+        """
+        Return the first mount point of a device or its partitions
+        """
+        for source, mountpoint in self.mounts:
+            if source.startswith(device):
+                return mountpoint
+        return None
+
+    def size(self, device):
+        """
+        Return the size in bytes of a block device from sysfs
+        """
+        if device not in self.sizes:
+            filename = "{}/{}/size".format(self.sysfs, os.path.basename(device))
+            try:
+                with open(filename, "r") as sectors:
+                    self.sizes[device] = int(sectors.read()) * 512
+            except (IOError, OSError, ValueError):
+                log.warning("No size for {} in {}".format(device, self.sysfs))
+                self.sizes[device] = None
+        return self.sizes[device]
+
+    def memo(self, key, func):
+        """
+        Compute a value once per snapshot
+        """
+        if key not in self.cache:
+            self.cache[key] = func()
+        return self.cache[key]
 
 
 # pylint: disable=too-many-instance-attributes
@@ -562,12 +830,16 @@ class OSDConfig(object):
     DEFAULT_FORMAT_FOR_V1 = 'filestore'
     DEFAULT_FORMAT_FOR_V2 = 'bluestore'
 
+    snapshot = None
+
     # pylint: disable=unused-argument
-    def __init__(self, device, **kwargs):
+    def __init__(self, device, snapshot=None, **kwargs):
         """
-        Set attributes for an OSD
+        Set attributes for an OSD.  A DeviceSnapshot replaces the readlink
+        forks and mine lookups.
         """
-        self.device = readlink(device)
+        self.snapshot = snapshot
+        self.device = self._readlink(device)
         # top_level_identifiier
         self.tli = self._set_tli()
         self.capacity = self.set_capacity()
@@ -586,6 +858,23 @@ class OSDConfig(object):
         self.types = self.set_types()
         log.debug("OSD config: \n{}".format(pprint.pformat(vars(self))))
 
+    def _readlink(self, device):
+        """
+        Resolve a device with the snapshot, if available
+        """
+        if self.snapshot:
+            return self.snapshot.readlink(device)
+        return readlink(device)
+
+    def _disks(self):
+        """
+        Return the cephdisks.list mine, once per snapshot
+        """
+        if self.snapshot:
+            return self.snapshot.memo('disks', lambda: __salt__['mine.get'](
+                tgt=__grains__['id'], fun='cephdisks.list'))
+        return __salt__['mine.get'](tgt=__grains__['id'], fun='cephdisks.list')
+
     def _set_tli(self):
         """
         Return the dictionary below ceph:storage:osds, if available
@@ -594,7 +883,10 @@ class OSDConfig(object):
             'storage' in __pillar__['ceph'] and
             'osds' in __pillar__['ceph']['storage']):
 
-            return self._convert_tli(__pillar__['ceph']['storage']['osds'])
+            osds = __pillar__['ceph']['storage']['osds']
+            if self.snapshot:
+                return self.snapshot.memo('tli', lambda: self._convert_tli(osds))
+            return self._convert_tli(osds)
         return None
 
     # pylint: disable=no-self-use
@@ -604,11 +896,11 @@ class OSDConfig(object):
         """
         result = {}
         for osd in osds:
-            short_osd = readlink(osd)
+            short_osd = self._readlink(osd)
             result[short_osd] = {}
             for attr in osds[osd]:
                 if attr == 'journal' or attr == 'wal' or attr == 'db':
-                    result[short_osd][attr] = readlink(osds[osd][attr])
+                    result[short_osd][attr] = self._readlink(osds[osd][attr])
                 else:
                     result[short_osd][attr] = osds[osd][attr]
         return result
@@ -617,7 +909,7 @@ class OSDConfig(object):
         """
         Return the bytes from the mine for this disk
         """
-        disks = __salt__['mine.get'](tgt=__grains__['id'], fun='cephdisks.list')
+        disks = self._disks()
         if disks:
             for disk in disks[__grains__['id']]:
                 if disk['Device File'] == self.device:
@@ -631,7 +923,7 @@ class OSDConfig(object):
         """
         Return the capacity from the mine for this disk
         """
-        disks = __salt__['mine.get'](tgt=__grains__['id'], fun='cephdisks.list')
+        disks = self._disks()
         if disks:
             for disk in disks[__grains__['id']]:
                 if disk['Device File'] == self.device:
@@ -706,7 +998,7 @@ class OSDConfig(object):
         result = {}
         for pair in struct:
             for osd, journal in six.iteritems(pair):
-                result[readlink(osd)] = readlink(journal)
+                result[self._readlink(osd)] = self._readlink(journal)
         return result
 
     # pylint: disable=no-self-use
@@ -738,7 +1030,7 @@ class OSDConfig(object):
         Return the size of the journal.  Account for small disks.
         """
         if self.journal:
-            disks = __salt__['mine.get'](tgt=__grains__['id'], fun='cephdisks.list')
+            disks = self._disks()
             if disks:
                 for disk in disks[__grains__['id']]:
                     # Check size of journal disk
@@ -816,13 +1108,20 @@ class OSDPartitions(object):
 
     Generally, partitions are created on devices other than the OSD.  Not
     creating partitions is fine.
+
+    With a pending dictionary, new partitions are recorded by device instead
+    of probing the device after each one.  The caller probes and wipes them
+    all at once.
     """
 
-    def __init__(self, config):
+    pending = None
+
+    def __init__(self, config, pending=None):
         """
         Initialize configuration, disks from mine
         """
         self.osd = config
+        self.pending = pending
         # self.disks = __salt__['mine.get'](tgt=__grains__['id'], fun='cephdisks.list')
 
     def clean(self):
@@ -987,19 +1286,28 @@ class OSDPartitions(object):
                 log.debug("Stdout of {}: {}".format(cmd, _stdout))
                 log.debug("Stderr of {}: {}".format(cmd, _stderr))
                 raise RuntimeError("{} failed".format(cmd))
-            log.info("partprobing disk {}".format(device))
-            self._part_probe(device)
-            # Seems odd to wipe a just created partition ; however, ghost
-            # filesystems on reused disks seem to be an issue
-            if os.path.exists("{}{}".format(device, number)):
-                prefix = ''
-                if device.startswith('/dev/nvme'):
-                    prefix = 'p'
-                wipe_cmd = ("dd if=/dev/zero of={}{}{} bs=4096 count=1 "
-                            "oflag=direct".format(device, prefix, number))
-                __salt__['helper.run'](wipe_cmd)
+            if self.pending is None:
+                log.info("partprobing disk {}".format(device))
+                self._part_probe(device)
+                self.wipe(device, number)
+            else:
+                self.pending.setdefault(device, []).append(number)
             index += 1
 
+    # pylint: disable=no-self-use
+    def wipe(self, device, number):
+        """
+        Seems odd to wipe a just created partition ; however, ghost
+        filesystems on reused disks seem to be an issue
+        """
+        if os.path.exists("{}{}".format(device, number)):
+            prefix = ''
+            if device.startswith('/dev/nvme'):
+                prefix = 'p'
+            wipe_cmd = ("dd if=/dev/zero of={}{}{} bs=4096 count=1 "
+                        "oflag=direct".format(device, prefix, number))
+            __salt__['helper.run'](wipe_cmd)
+
     # pylint: disable=no-self-use
     def _part_probe(self, device):
         """
@@ -1019,16 +1327,18 @@ class OSDPartitions(object):
     def _last_partition(self, device):
         """
         Return the last partition. Only the number is needed for the sgdisk
-        command.
+        command.  Pending partitions are not visible as devices yet.
         """
+        last_part = 0
         pathnames = _find_paths(device)
         if pathnames:
             _partitions = sorted([re.sub(r"{}p?".format(device), '', p)
                                   for p in pathnames], key=int)
             log.debug("partitions: {}".format(_partitions))
-            last_part = _partitions[-1]
-            return int(last_part)
-        return 0
+            last_part = int(_partitions[-1])
+        if self.pending and device in self.pending:
+            last_part = max([last_part] + self.pending[device])
+        return last_part
 
 
 def partition(device):
@@ -1044,13 +1354,19 @@ class OSDCommands(object):
     """
     Manage the generation of commands and checks for the ceph namespace and
     original namespace.
+
+    Partitions pending a partprobe, see OSDPartitions, are considered when
+    searching for the highest partition.
     """
 
-    def __init__(self, config):
+    pending = None
+
+    def __init__(self, config, pending=None):
         """
         Initialize settings
         """
         self.osd = config
+        self.pending = pending
         self.settings = {}
         self.error = None
 
@@ -1095,6 +1411,10 @@ class OSDCommands(object):
         if device:
             log.debug("{} device: {}".format(partition_type, device))
             pathnames = _find_paths(device)
+            if self.pending and device in self.pending:
+                prefix = 'p' if re.match(r'.*\d$', device) else ''
+                pathnames = list(set(pathnames) | set(
+                    "{}{}{}".format(device, prefix, number) for number in self.pending[device]))
             # the to int -> key=int conversion fails here
             _partitions = sorted([re.sub(r"{}p?".format(device), '', p)
                                   for p in pathnames], key=int, reverse=True)
@@ -1143,6 +1463,8 @@ class OSDCommands(object):
         """
         result = _find_paths(device)
         log.debug("Found {} partitions on {}".format(result, device))
+        if self.pending and self.pending.get(device):
+            return True
         return result != []
 
     def _filestore_args(self):
@@ -1317,12 +1639,16 @@ class OSDCommands(object):
             return False
 
         pathname = None
-        with open("/proc/mounts", "r") as mounts:
-            for line in mounts:
-                entry = line.split()
-                if entry[0].startswith(self.osd.device):
-                    pathname = entry[1]
-                    break
+        snapshot = getattr(self.osd, 'snapshot', None)
+        if snapshot:
+            pathname = snapshot.mountpoint(self.osd.device)
+        else:
+            with open("/proc/mounts", "r") as mounts:
+                for line in mounts:
+                    entry = line.split()
+                    if entry[0].startswith(self.osd.device):
+                        pathname = entry[1]
+                        break
 
         if pathname:
             filename = "{}/type".format(pathname)
@@ -1377,14 +1703,21 @@ class OSDCommands(object):
         """
         Check that the device and size match the configuration
         """
-        devicename = readlink("{}/{}".format(pathname, attr))
+        snapshot = getattr(self.osd, 'snapshot', None)
+        if snapshot:
+            devicename = snapshot.readlink("{}/{}".format(pathname, attr))
+        else:
+            devicename = readlink("{}/{}".format(pathname, attr))
         if device and not devicename.startswith(device):
             log.info("OSD {} {} does not match {}".format(attr, devicename, device))
             return True
         if size:
-            cmd = "blockdev --getsize64 {}".format(devicename)
-            _, _stdout, _stderr = __salt__['helper.run'](cmd)
-            bsize = int(_stdout)
+            if snapshot:
+                bsize = snapshot.size(devicename)
+            else:
+                cmd = "blockdev --getsize64 {}".format(devicename)
+                _, _stdout, _stderr = __salt__['helper.run'](cmd)
+                bsize = int(_stdout)
             _bytes = self._convert(size)
             if _bytes != bsize:
                 log.info("OSD {} size {} does not match {} ({})".format(attr, bsize, size, _bytes))
@@ -1413,11 +1746,11 @@ def _detect(osd_id, pathname="/var/lib/ceph/osd"):
     return None
 
 
-def split_partition(_partition):
+def split_partition(_partition, snapshot=None):
     """
     Return the device and partition
     """
-    part = readlink(_partition)
+    part = snapshot.readlink(_partition) if snapshot else readlink(_partition)
     # if os.path.exists(part):
     log.debug("splitting partition {}".format(part))
     match = re.match(r"(.+\D)(\d+)", part)
@@ -1867,17 +2200,64 @@ class OSDDestroyed(object):
        indication to future runs that this device can safely be skipped. On
        the first attempt, return as failed with instructions.
     3) Admin is saving actual device name of new device.
+
+    Entries live in an SQLite database keyed by device.  Every change is a
+    transaction under an exclusive file lock, so that concurrent removals on
+    the same host cannot lose entries.  The previous YAML file is imported
+    once and renamed.
     """
 
-    def __init__(self):
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS destroyed "
+              "(device TEXT PRIMARY KEY, osd_id NOT NULL)")
+
+    def __init__(self, filename="/etc/ceph/destroyedOSDs.db",
+                 legacy="/etc/ceph/destroyedOSDs.yml"):
         """
-        Set the default filename.
+        Set the default filenames.
         """
-        self.filename = "/etc/ceph/destroyedOSDs.yml"
+        self.filename = filename
+        self.legacy = legacy
+        self.lockfile = "{}.lock".format(filename)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """
+        Yield a connection inside a transaction holding the file lock
+        """
+        with open(self.lockfile, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            conn = sqlite3.connect(self.filename, timeout=30)
+            try:
+                with conn:
+                    conn.execute(self.SCHEMA)
+                    imported = self._import(conn)
+                if imported:
+                    os.rename(self.legacy, "{}.migrated".format(self.legacy))
+                with conn:
+                    yield conn
+            finally:
+                conn.close()
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _import(self, conn):
+        """
+        Copy the entries of the YAML file into the database
+        """
+        if not self.legacy or not os.path.exists(self.legacy):
+            return False
+        with open(self.legacy, 'r') as destroyed:
+            content = yaml.safe_load(destroyed) or {}
+        conn.executemany("INSERT OR IGNORE INTO destroyed (device, osd_id) VALUES (?, ?)",
+                         list(content.items()))
+        log.info("Imported {} entries from {}".format(len(content), self.legacy))
+        return True
 
-        # Keep yaml human readable/editable
-        self.friendly_dumper = yaml.SafeDumper
-        self.friendly_dumper.ignore_aliases = lambda self, data: True
+    def _exists(self):
+        """
+        Nothing was recorded yet
+        """
+        return os.path.exists(self.filename) or \
+            bool(self.legacy and os.path.exists(self.legacy))
 
     def update(self, device, osd_id, force=False):
         """
@@ -1885,29 +2265,35 @@ class OSDDestroyed(object):
         exist, record current device and issue exception with instructions.
         If forced, record current device.
         """
-        content = {}
-        if os.path.exists(self.filename):
-            with open(self.filename, 'r') as destroyed:
-                content = yaml.safe_load(destroyed)
-                log.debug("content: {} {}".format(type(content), content))
+        return self.update_many([(device, osd_id)], force)[device]
+
+    def update_many(self, entries, force=False):
+        """
+        Record several devices and IDs in one transaction.  Returns the
+        message for each device, empty on success.
+        """
+        results = {}
+        with self._transaction() as conn:
+            for device, osd_id in entries:
+                results[device] = self._update(conn, device, osd_id, force)
+        return results
 
-        if device in content:
+    def _update(self, conn, device, osd_id, force):
+        """
+        Record a single device
+        """
+        if self._lookup(conn, device) is not None:
             # Exit early, no by-path equivalent from previous run
             return ""
 
         by_path = self._by_path(device)
-        if by_path and not force:
-            content[by_path] = osd_id
-        else:
-            # by-path device is missing, save current device to allow
-            # the OSD to be removed and rely on admin following instructions
-            # below OR admin is overriding the save manually with the new
-            # device name.  In either case, save the device name with the ID.
-            content[device] = osd_id
-
-        with open(self.filename, 'w') as destroyed:
-            destroyed.write(yaml.dump(content, Dumper=self.friendly_dumper,
-                            default_flow_style=False))
+        # If the by-path device is missing, save current device to allow
+        # the OSD to be removed and rely on admin following instructions
+        # below OR admin is overriding the save manually with the new
+        # device name.  In either case, save the device name with the ID.
+        key = by_path if by_path and not force else device
+        conn.execute("INSERT OR REPLACE INTO destroyed (device, osd_id) VALUES (?, ?)",
+                     (key, osd_id))
 
         if by_path or force:
             return ""
@@ -1922,60 +2308,74 @@ class OSDDestroyed(object):
         log.error(msg)
         return msg
 
+    @staticmethod
+    def _lookup(conn, device):
+        """
+        Return the ID recorded for exactly this device or None
+        """
+        row = conn.execute("SELECT osd_id FROM destroyed WHERE device = ?",
+                           (device,)).fetchone()
+        return row[0] if row else None
+
     def get(self, device):
         """
         Return ID
         """
-        if os.path.exists(self.filename):
-            with open(self.filename, 'r') as destroyed:
-                content = yaml.safe_load(destroyed)
-            by_path = self._by_path(device)
-            if by_path and by_path in content:
-                return content[by_path]
-            if device in content:
-                return content[device]
+        return self.get_many([device])[device]
 
-        return ""
+    def get_many(self, devices):
+        """
+        Return the ID of each device, empty if none is recorded
+        """
+        results = {device: "" for device in devices}
+        if not self._exists():
+            return results
+        with self._transaction() as conn:
+            for device in devices:
+                for key in [self._by_path(device), device]:
+                    osd_id = self._lookup(conn, key) if key else None
+                    if osd_id is not None:
+                        results[device] = osd_id
+                        break
+        return results
 
     # pylint: disable=no-self-use
     def _by_path(self, device):
         """
         Return the equivalent by-path device name
         """
-        cmd = (r"find -L /dev/disk/by-path -samefile {}".format(device))
-        _rc, _stdout, _stderr = __salt__['helper.run'](cmd)
-        if _stdout:
-            _devices = _stdout.split()
-            if _devices:
-                return _devices[0]
+        _devices = __salt__['devlinks.aliases'](device, pathname='/dev/disk/by-path')
+        if _devices:
+            return _devices[0]
         return ""
 
     def remove(self, device):
         """
         Remove entry
         """
-        if os.path.exists(self.filename):
-            with open(self.filename, 'r') as destroyed:
-                content = yaml.safe_load(destroyed)
-            by_path = self._by_path(device)
-            if by_path and by_path in content:
-                del content[by_path]
-            # Normally absent
-            if device in content:
-                del content[device]
-            with open(self.filename, 'w') as destroyed:
-                destroyed.write(yaml.dump(content, Dumper=self.friendly_dumper,
-                                default_flow_style=False))
+        self.remove_many([device])
+
+    def remove_many(self, devices):
+        """
+        Remove the entries of several devices in one transaction
+        """
+        if not self._exists():
+            return
+        with self._transaction() as conn:
+            for device in devices:
+                by_path = self._by_path(device)
+                # The device itself is normally absent
+                conn.executemany("DELETE FROM destroyed WHERE device = ?",
+                                 [(key,) for key in [by_path, device] if key])
 
     def dump(self):
         """
         Display all devices, IDs
         """
-        if os.path.exists(self.filename):
-            with open(self.filename, 'r') as destroyed:
-                content = yaml.safe_load(destroyed)
-            return content
-        return ""
+        if not self._exists():
+            return ""
+        with self._transaction() as conn:
+            return dict(conn.execute("SELECT device, osd_id FROM destroyed ORDER BY device"))
 
 
 def update_destroyed(device, osd_id):
@@ -2108,8 +2508,7 @@ def deploy_lvm():
     Dummy implementation to deplioy a ceph-volume OSD on an existing lv
     """
     for device in configured():
-        cmd = (r"find -L /dev/ -maxdepth 1 -samefile {}".format(device))
-        _rc, stdout, _stderr = __salt__['helper.run'](cmd)
+        stdout = __salt__['devlinks.short'](device)
         if stdout:
             log.info("using {} to deploy OSD".format(stdout))
             _rc, _out, _err = __salt__['helper.run'](
@@ -2129,9 +2528,156 @@ def deploy_lvm():
                                               '--all'])
 
 
-def deploy():
+class OSDDeploy(object):
+    """
+    Partition, prepare and activate the unprepared OSDs of this minion.
+
+    All devices are partitioned first.  Partitioning stays serial since
+    OSDs may share DB/WAL devices, and the prepare command of each device
+    is generated right after its partitions are created.  One partprobe and
+    udev settle then makes all new partitions visible.  Finally, prepare
+    and activate run for several devices at a time.  Only the OSDs with
+    partitions on a device that cannot be probed are not prepared.
     """
-    Partition, prepare and activate an OSD.
+
+    def __init__(self, concurrency=4):
+        """
+        Initialize settings
+        """
+        self.concurrency = max(int(concurrency), 1)
+        self.pending = {}
+        self.uses = {}
+        self.results = {}
+
+    # pylint: disable=no-self-use
+    def devices(self):
+        """
+        Return the configured devices which are not prepared
+        """
+        return [device for device in configured() if not is_prepared(device)]
+
+    def partition(self, devices, previous):
+        """
+        Clean and partition each device, return the commands by device
+        """
+        snapshot = DeviceSnapshot()
+        commands = {}
+        for device in devices:
+            before = {disk: len(numbers) for disk, numbers in self.pending.items()}
+            try:
+                config = OSDConfig(device, snapshot=snapshot)
+                osdp = OSDPartitions(config, pending=self.pending)
+                osdp.clean()
+                osdp.partition()
+                osdc = OSDCommands(config, pending=self.pending)
+                commands[device] = (osdc, osdc.prepare(previous.get(device)))
+            except RuntimeError as error:
+                log.error("Partitioning {} failed: {}".format(device, error))
+                self.results[device]['error'] = str(error)
+                continue
+            finally:
+                self.uses[device] = set(disk for disk, numbers in self.pending.items()
+                                        if len(numbers) != before.get(disk, 0))
+            self.results[device]['partitioned'] = True
+        return commands
+
+    def settle(self):
+        """
+        Probe all partitioned devices once, wait for udev and wipe the new
+        partitions.  If the probe fails, each device is probed separately.
+        Return the errors by device that could not be probed.
+        """
+        failed = {}
+        if not self.pending:
+            return failed
+        osdp = OSDPartitions(None)
+        try:
+            osdp._part_probe(" ".join(sorted(self.pending)))
+        except RuntimeError as error:
+            log.warning("{}, probing each device".format(error))
+            for device in sorted(self.pending):
+                try:
+                    osdp._part_probe(device)
+                except RuntimeError as error:
+                    log.error("Probing {} failed: {}".format(device, error))
+                    failed[device] = str(error)
+        __salt__['helper.run']('udevadm settle --timeout=60')
+        __salt__['devlinks.invalidate']()
+        for device in sorted(self.pending):
+            if device in failed:
+                continue
+            for number in self.pending[device]:
+                osdp.wipe(device, number)
+        return failed
+
+    # pylint: disable=no-self-use
+    def _deploy(self, job):
+        """
+        Prepare and activate a single device
+        """
+        device, osdc, prepare_cmd, previous_id = job
+        result = {}
+        try:
+            _rc, _stdout, _stderr = __salt__['helper.run'](prepare_cmd)
+            if _rc != 0:
+                result['error'] = "prepare failed: {}".format(osdc.error or _stderr)
+                return device, result
+            result['prepared'] = True
+            _rc, _stdout, _stderr = __salt__['helper.run'](osdc.activate())
+            if _rc != 0:
+                result['error'] = "activate failed: {}".format(_stderr)
+                return device, result
+            result['activated'] = True
+            if previous_id:
+                restore_weight(previous_id)
+        # pylint: disable=broad-except
+        except Exception as error:
+            result['error'] = str(error)
+        return device, result
+
+    def run(self):
+        """
+        Deploy all unprepared devices.  Return the result of each device.
+        """
+        devices = self.devices()
+        if not devices:
+            return {}
+        destroyed = OSDDestroyed()
+        previous = destroyed.get_many(devices)
+        for device in devices:
+            self.results[device] = {'partitioned': False, 'prepared': False,
+                                    'activated': False}
+            if previous[device] != "":
+                self.results[device]['osd_id'] = previous[device]
+
+        commands = self.partition(devices, previous)
+        failed = self.settle()
+        for device in devices:
+            for disk in sorted(self.uses.get(device, set()) & set(failed)):
+                self.results[device]['error'] = failed[disk]
+                commands.pop(device, None)
+
+        jobs = [(device, commands[device][0], commands[device][1], previous[device])
+                for device in devices if device in commands]
+        if jobs:
+            pool = ThreadPool(min(self.concurrency, len(jobs)))
+            try:
+                for device, result in pool.imap_unordered(self._deploy, jobs):
+                    if 'error' in result:
+                        log.error("Deploying {} failed: {}".format(device, result['error']))
+                    self.results[device].update(result)
+            finally:
+                pool.close()
+                pool.join()
+
+        destroyed.remove_many([device for device in devices
+                               if self.results[device]['activated']])
+        return self.results
+
+
+def deploy(concurrency=4):
+    """
+    Partition, prepare and activate the OSDs.
 
     Note: This cannot be done in a single state file.  This cannot be done in
     multiple state files through orchestration.
@@ -2153,56 +2699,185 @@ def deploy():
 
     The last idea is converting all of this into a state module that returns
     all the commands in the comment.
+
+    With concurrency above 1, that many devices are prepared and activated
+    at a time once all devices are partitioned.  Returns the result of each
+    device.
     """
-    for device in configured():
-        if not is_prepared(device):
-            config = OSDConfig(device)
-            osdp = OSDPartitions(config)
-            osdp.clean()
-            osdp.partition()
-            osdc = OSDCommands(config)
-            previous_id = find_destroyed(device)
-            __salt__['helper.run'](osdc.prepare(previous_id))
-            __salt__['helper.run'](osdc.activate())
-            remove_destroyed(device)
-            if previous_id:
-                restore_weight(previous_id)
+    osdd = OSDDeploy(concurrency=concurrency)
+    return osdd.run()
 
 
-def redeploy(simultaneous=False, **kwargs):
+class OSDRedeploy(object):
     """
-    Empty all PGs in parallel initially if necessary.  Then remove and
-    recreate each OSD that does not match its configuration.
+    Remove and recreate the OSDs of this minion that do not match their
+    configuration, several at a time.
+
+    OSDs are grouped into batches of at most concurrency OSDs.  With a
+    max_pgs budget, a batch also stops growing once the PGs on its OSDs
+    would exceed the budget.  All OSDs of a batch are drained together,
+    then removed, partitioned, prepared and activated.  Partitioning stays
+    serial since OSDs may share DB/WAL devices.  Once a batch is active,
+    the next batch starts draining while the current one backfills.
     """
-    if simultaneous:
+
+    def __init__(self, concurrency=1, max_pgs=0, **kwargs):
+        """
+        Initialize settings
+        """
+        self.settings = kwargs
+        self.concurrency = max(int(concurrency), 1)
+        self.max_pgs = int(max_pgs)
+        self.disks = {}
+        self.timeline = {}
+        self.start = time.time()
+        self._pgs = None
+
+    @property
+    def pgs(self):
+        """
+        One CephPGs, and with it one connection, for all OSDs
+        """
+        if self._pgs is None:
+            self._pgs = CephPGs(**self.settings)
+        return self._pgs
+
+    def candidates(self):
+        """
+        Return the ids that need to be redeployed
+        """
+        ids = []
         for _id in __grains__['ceph']:
             _part = _partition(_id)
             log.info("Partition: {}".format(_part))
             disk, _ = split_partition(_part)
             log.info("ID: {}".format(_id))
             log.info("Disk: {}".format(disk))
-            if is_incorrect(disk):
-                zero_weight(_id, wait=False)
+            if not os.path.exists(_part) or is_incorrect(disk):
+                self.disks[_id] = disk
+                ids.append(_id)
+        return ids
 
-    settings = _settings(**kwargs)
-    for _id in __grains__['ceph']:
-        _part = _partition(_id)
-        log.info("Partition: {}".format(_part))
-        disk, _ = split_partition(_part)
-        log.info("ID: {}".format(_id))
-        log.info("Disk: {}".format(disk))
-        if not os.path.exists(_part) or is_incorrect(disk):
-            pgs = CephPGs(**settings)
-            pgs.quiescent()
-            remove(_id, **settings)
-            config = OSDConfig(disk)
+    def pg_counts(self):
+        """
+        Return the number of PGs per OSD id
+        """
+        cmd = json.dumps({"prefix": "osd df", "format": "json"})
+        _, output, _ = self.pgs.cluster.mon_command(cmd, b'', timeout=6)
+        counts = {}
+        for entry in json.loads(output)['nodes']:
+            counts[str(entry['id'])] = entry.get('pgs', 0)
+        return counts
+
+    def batches(self, ids):
+        """
+        Group ids by concurrency and the PG budget.  A single OSD above
+        the budget still gets a batch of its own.
+        """
+        counts = {}
+        if self.max_pgs:
+            counts = self.pg_counts()
+        batches = []
+        batch = []
+        in_flight = 0
+        for _id in ids:
+            pgs = counts.get(str(_id), 0)
+            if batch and (len(batch) >= self.concurrency or
+                          (self.max_pgs and in_flight + pgs > self.max_pgs)):
+                batches.append(batch)
+                batch = []
+                in_flight = 0
+            batch.append(_id)
+            in_flight += pgs
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _mark(self, _id, phase):
+        """
+        Record the time of a phase relative to the start
+        """
+        self.timeline[_id][phase] = round(time.time() - self.start, 1)
+
+    def drain(self, batch):
+        """
+        Set the weight of each OSD to zero without waiting
+        """
+        for _id in batch:
+            if os.path.exists(_partition(_id)):
+                zero_weight(_id, wait=False, **self.settings)
+            self._mark(_id, 'drain')
+
+    def redeploy(self, batch):
+        """
+        Wait for the cluster, remove and recreate each OSD of a batch
+        """
+        self.pgs.quiescent()
+        removed = []
+        for _id in batch:
+            self._mark(_id, 'quiescent')
+            msg = remove(_id, **self.settings)
+            if msg:
+                self.timeline[_id]['error'] = msg
+                continue
+            self._mark(_id, 'removed')
+            removed.append(_id)
+
+        commands = {}
+        for _id in removed:
+            config = OSDConfig(self.disks[_id])
             osdp = OSDPartitions(config)
             osdp.partition()
-            osdc = OSDCommands(config)
-            __salt__['helper.run'](osdc.prepare(_id))
+            commands[_id] = OSDCommands(config)
+            self._mark(_id, 'partitioned')
+
+        for _id in removed:
+            __salt__['helper.run'](commands[_id].prepare(_id))
+            self._mark(_id, 'prepared')
             restore_weight(_id)
-            __salt__['helper.run'](osdc.activate())
-            remove_destroyed(disk)
+            __salt__['helper.run'](commands[_id].activate())
+            remove_destroyed(self.disks[_id])
+            self._mark(_id, 'activated')
+
+    def run(self, simultaneous=False):
+        """
+        Redeploy all candidates batch by batch.  Return the timeline.
+        """
+        ids = self.candidates()
+        batches = self.batches(ids)
+        for index, batch in enumerate(batches):
+            for _id in batch:
+                self.timeline[_id] = {'batch': index}
+        if simultaneous:
+            for _id in ids:
+                if os.path.exists(_partition(_id)):
+                    zero_weight(_id, wait=False)
+        elif batches and self.concurrency > 1:
+            self.drain(batches[0])
+
+        for index, batch in enumerate(batches):
+            log.info("Redeploying batch {}: {}".format(index, batch))
+            self.redeploy(batch)
+            if not simultaneous and self.concurrency > 1 and index + 1 < len(batches):
+                # Drain the next batch while this one backfills
+                self.drain(batches[index + 1])
+        return self.timeline
+
+
+def redeploy(simultaneous=False, concurrency=1, max_pgs=0, **kwargs):
+    """
+    Empty all PGs in parallel initially if necessary.  Then remove and
+    recreate each OSD that does not match its configuration.
+
+    Keyword arguments such as events=True or min_delay are passed to the
+    PG wait.
+
+    With concurrency above 1, redeploy that many OSDs at a time, limited
+    by max_pgs PGs in flight if set.  Returns the timeline of each OSD.
+    """
+    settings = _settings(**kwargs)
+    osdr = OSDRedeploy(concurrency=concurrency, max_pgs=max_pgs, **settings)
+    return osdr.run(simultaneous=simultaneous)
 
 
 def _partition(osd_id):
@@ -2297,11 +2972,11 @@ def detect(osd_id):
     return _detect(osd_id)
 
 
-def is_incorrect(device):
+def is_incorrect(device, snapshot=None):
     """
     Returns if the OSD does not match the desired configuration
     """
-    config = OSDConfig(device)
+    config = OSDConfig(device, snapshot=snapshot)
     osdc = OSDCommands(config)
     return osdc.is_incorrect()
 
@@ -2334,11 +3009,14 @@ def delete_grain(osd_id):
 
 def report(human=True):
     """
-    Display the difference between the pillar and grains for the OSDs
+    Display the difference between the pillar and grains for the OSDs.
+    All OSDs are evaluated against one snapshot of the mounts, device
+    links and sizes.
     """
-    active, unmounted = _report_grains()
-    un1, ch1 = _report_pillar(active)
-    un2, ch2 = _report_original_pillar(active)
+    snapshot = DeviceSnapshot()
+    active, unmounted = _report_grains(snapshot)
+    un1, ch1 = _report_pillar(active, snapshot)
+    un2, ch2 = _report_original_pillar(active, snapshot)
 
     unconfigured = un1 + un2
     changed = ch1 + ch2
@@ -2361,34 +3039,36 @@ def report(human=True):
                 'unmounted': unmounted}
 
 
-def _report_grains():
+def _report_grains(snapshot=None):
     """
     Return the active and unmounted lists
     """
+    _readlink = snapshot.readlink if snapshot else readlink
     active = []
     unmounted = []
     if 'ceph' in __grains__:
         for _id in __grains__['ceph']:
-            _partition = readlink(__grains__['ceph'][_id]['partitions']['osd'])
-            disk, _ = split_partition(_partition)
+            _partition = _readlink(__grains__['ceph'][_id]['partitions']['osd'])
+            disk, _ = split_partition(_partition, snapshot=snapshot)
             if disk:
                 active.append(disk)
             log.debug("checking /var/lib/ceph/osd/ceph-{}/fsid".format(_id))
             if not os.path.exists("/var/lib/ceph/osd/ceph-{}/fsid".format(_id)):
                 unmounted.append(disk)
             if 'lockbox' in __grains__['ceph'][_id]['partitions']:
-                _partition = readlink(__grains__['ceph'][_id]['partitions']['lockbox'])
-                disk, _ = split_partition(_partition)
+                _partition = _readlink(__grains__['ceph'][_id]['partitions']['lockbox'])
+                disk, _ = split_partition(_partition, snapshot=snapshot)
                 if disk:
                     active.append(disk)
     return active, unmounted
 
 
-def _report_pillar(active):
+def _report_pillar(active, snapshot=None):
     """
     Return the unconfigured and changed lists
     """
     log.debug("active: {}".format(active))
+    _readlink = snapshot.readlink if snapshot else readlink
 
     unconfigured = []
     changed = []
@@ -2396,9 +3076,9 @@ def _report_pillar(active):
         unconfigured = list(__pillar__['ceph']['storage']['osds'].keys())
         changed = list(unconfigured)
         for osd in __pillar__['ceph']['storage']['osds'].keys():
-            if readlink(osd) in active:
+            if _readlink(osd) in active:
                 unconfigured.remove(osd)
-                if not is_incorrect(readlink(osd)):
+                if not is_incorrect(_readlink(osd), snapshot=snapshot):
                     log.debug("Removed from changed {}".format(osd))
                     changed.remove(osd)
             else:
@@ -2409,11 +3089,12 @@ def _report_pillar(active):
     return unconfigured, changed
 
 
-def _report_original_pillar(active):
+def _report_original_pillar(active, snapshot=None):
     """
     Return the unconfigured and changed lists from the original pillar
     structure
     """
+    _readlink = snapshot.readlink if snapshot else readlink
     unconfigured = []
     changed = []
     if 'storage' in __pillar__:
@@ -2424,9 +3105,9 @@ def _report_original_pillar(active):
         changed = list(unconfigured)
         osds = list(unconfigured)
         for osd in osds:
-            if readlink(osd) in active:
+            if _readlink(osd) in active:
                 unconfigured.remove(osd)
-                if not is_incorrect(readlink(osd)):
+                if not is_incorrect(_readlink(osd), snapshot=snapshot):
                     log.debug("Removed from changed {}".format(osd))
                     changed.remove(osd)
             else:
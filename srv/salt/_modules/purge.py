@@ -58,7 +58,10 @@ def proposals():
         for partial in ['role-', 'cluster-', 'profile-', 'config']:
             if partial in path:
                 log.info("removing {}/{}".format(proposals_dir, path))
-                shutil.rmtree("{}/{}".format(proposals_dir, path))
+                if os.path.islink("{}/{}".format(proposals_dir, path)):
+                    os.remove("{}/{}".format(proposals_dir, path))
+                else:
+                    shutil.rmtree("{}/{}".format(proposals_dir, path))
 
 
 def default():
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Per process broker of long lived rados connections.
+
+Connecting to a cluster is a full monitor session handshake and
+authentication.  Modules ask the broker for a handle instead of creating
+their own.  Handles are shared by conffile, client name and keyring,
+checked before they are handed out, reconnected on failure and closed
+when idle.  Callers must not shut a shared handle down.
+
+Handles are handed out as leases.  A handle counts as in use while any of
+its leases is held and is only closed for idleness once all leases are
+released.
+"""
+
+from __future__ import absolute_import
+import atexit
+import logging
+import threading
+import time
+# pylint: disable=import-error,3rd-party-module-not-gated
+try:
+    import rados
+except ImportError:
+    pass
+
+log = logging.getLogger(__name__)
+
+
+class Lease(object):
+    """
+    A checked out handle.  Attributes are those of the rados handle.  The
+    lease is released explicitly, on leaving a with block or when it is
+    garbage collected.
+    """
+
+    def __init__(self, broker, key, cluster):
+        """
+        Hold the handle of key
+        """
+        self.broker = broker
+        self.key = key
+        self.cluster = cluster
+        self.released = False
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['cluster'], name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def __del__(self):
+        try:
+            self.release()
+        # pylint: disable=broad-except
+        except Exception:
+            pass
+
+    def release(self):
+        """
+        Return the handle to the broker
+        """
+        if not self.released:
+            self.released = True
+            self.broker.release(self.key, self.cluster)
+
+
+class Broker(object):
+    """
+    Cache of connected rados handles
+    """
+
+    def __init__(self, idle=300):
+        """
+        Handles unused for idle seconds are closed
+        """
+        self.idle = idle
+        self.handles = {}
+        self.lock = threading.RLock()
+
+    def get(self, conffile="/etc/ceph/ceph.conf", name=None, keyring=None):
+        """
+        Return a lease on a connected handle, reuse a healthy cached one
+        """
+        key = (conffile, name, keyring)
+        now = time.time()
+        with self.lock:
+            self.reap(now)
+            entry = self.handles.get(key)
+            if entry and not self._healthy(entry['cluster']):
+                log.info("Reconnecting rados handle {}".format(key))
+                self._close(key)
+                entry = None
+            if entry is None:
+                entry = {'cluster': self._connect(conffile, name, keyring),
+                         'connected': now, 'leases': 0}
+                self.handles[key] = entry
+            entry['used'] = now
+            entry['leases'] += 1
+            return Lease(self, key, entry['cluster'])
+
+    def release(self, key, cluster):
+        """
+        Count a lease as returned, the handle is idle from now on when no
+        other lease is held
+        """
+        with self.lock:
+            entry = self.handles.get(key)
+            if entry and entry['cluster'] is cluster:
+                entry['leases'] -= 1
+                entry['used'] = time.time()
+
+    @staticmethod
+    def _connect(conffile, name, keyring):
+        """
+        Create and connect a handle
+        """
+        kwargs = {'conffile': conffile}
+        if keyring:
+            kwargs['conf'] = dict(keyring=keyring)
+        if name:
+            kwargs['name'] = name
+        cluster = rados.Rados(**kwargs)
+        try:
+            cluster.connect()
+        except Exception as error:
+            raise RuntimeError("connection error: {}".format(error))
+        return cluster
+
+    @staticmethod
+    def _healthy(cluster):
+        """
+        Check the session without a monitor round trip
+        """
+        try:
+            return cluster.state == 'connected' and bool(cluster.get_fsid())
+        # pylint: disable=broad-except
+        except Exception:
+            return False
+
+    def _close(self, key):
+        """
+        Shut down and forget a handle
+        """
+        entry = self.handles.pop(key, None)
+        if entry:
+            try:
+                entry['cluster'].shutdown()
+            # pylint: disable=broad-except
+            except Exception as error:
+                log.debug("Shutdown of rados handle {} failed: {}".format(key, error))
+
+    def invalidate(self, cluster):
+        """
+        Drop a handle which failed, the next get reconnects
+        """
+        if isinstance(cluster, Lease):
+            cluster = cluster.cluster
+        with self.lock:
+            for key, entry in list(self.handles.items()):
+                if entry['cluster'] is cluster:
+                    self._close(key)
+
+    def reap(self, now=None):
+        """
+        Close handles which have been idle too long.  Leased handles are
+        in use and never idle.
+        """
+        now = now or time.time()
+        with self.lock:
+            for key, entry in list(self.handles.items()):
+                if not entry['leases'] and now - entry['used'] > self.idle:
+                    log.debug("Closing idle rados handle {}".format(key))
+                    self._close(key)
+
+    def close(self):
+        """
+        Close all handles
+        """
+        with self.lock:
+            for key in list(self.handles):
+                self._close(key)
+
+
+_BROKER = Broker()
+atexit.register(_BROKER.close)
+
+
+def connect(conffile="/etc/ceph/ceph.conf", name=None, keyring=None, **kwargs):
+    """
+    Return a lease on a shared, connected rados handle.  For use by other
+    modules.  The handle stays in use until the lease is released or
+    garbage collected.
+    """
+    return _BROKER.get(conffile, name, keyring)
+
+
+def mon_command(cmd, inbuf=b'', timeout=6, conffile="/etc/ceph/ceph.conf",
+                name=None, keyring=None, **kwargs):
+    """
+    Run a monitor command on a shared handle.  Reconnect and retry once if
+    the handle fails.
+    """
+    for attempt in range(2):
+        with _BROKER.get(conffile, name, keyring) as cluster:
+            try:
+                return cluster.mon_command(cmd, inbuf, timeout=timeout)
+            # pylint: disable=broad-except
+            except Exception as error:
+                log.warning("mon_command failed, reconnecting: {}".format(error))
+                _BROKER.invalidate(cluster)
+                if attempt:
+                    raise
+    return None
+
+
+def handles():
+    """
+    Return the cached handles with their leases, age and idle time in
+    seconds
+
+    CLI Example:
+    .. code-block:: bash
+        sudo salt 'node' rados_broker.handles
+    """
+    now = time.time()
+    with _BROKER.lock:
+        return [{'conffile': key[0], 'name': key[1], 'keyring': key[2],
+                 'leases': entry['leases'],
+                 'age': int(now - entry['connected']),
+                 'idle': int(now - entry['used'])}
+                for key, entry in _BROKER.handles.items()]
@@ -10,10 +10,6 @@ import time
 import logging
 # pylint: disable=import-error,3rd-party-module-not-gated
 import salt.ext.six as six
-try:
-    import rados
-except ImportError:
-    logging.info("Could not import rados")
 
 # pylint: disable=incompatible-py3-code
 log = logging.getLogger(__name__)
@@ -47,10 +43,9 @@ class HealthCheck(object):
 
     def _connect(self):
         """
-        Connect to Ceph cluster
+        Connect to Ceph cluster through the shared connection broker
         """
-        self.cluster = rados.Rados(conffile=self.settings['conf'])
-        self.cluster.connect()
+        self.cluster = __salt__['rados_broker.connect'](conffile=self.settings['conf'])
 
     def _wait(self, cmd, success):
         """
@@ -61,7 +56,8 @@ class HealthCheck(object):
 
         log.debug('wait on condition of command {}'.format(cmd))
         while i < (self.settings['timeout']/self.settings['delay']):
-            _ret, output, _err = self.cluster.mon_command(cmd, b'', timeout=6)
+            _ret, output, _err = __salt__['rados_broker.mon_command'](
+                cmd, b'', timeout=6, conffile=self.settings['conf'])
             json_output = json.loads(output)
 
             if success(json_output):
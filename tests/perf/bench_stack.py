@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# vim: ts=8 et sw=4 sts=4
+"""
+Microbenchmark of the pillar stack merge strategies on a synthetic stack
+of 1000 minions with 200 OSDs each.  Compares the previous quadratic
+implementation with the current one.
+
+    python tests/perf/bench_stack.py [minions] [osds]
+"""
+
+from __future__ import print_function
+import copy
+import sys
+import time
+sys.path.insert(0, 'srv/modules/pillar')
+import stack  # noqa: E402
+
+
+def _legacy_cleanup(obj):
+    if obj:
+        if isinstance(obj, dict):
+            obj.pop('__', None)
+            for k, v in obj.items():
+                obj[k] = _legacy_cleanup(v)
+        elif isinstance(obj, list) and isinstance(obj[0], dict) \
+                and '__' in obj[0]:
+            del obj[0]
+    return obj
+
+
+def _legacy_merge_dict(stack_, obj):
+    strategy = obj.pop('__', 'merge-last')
+    if strategy == 'overwrite':
+        return _legacy_cleanup(obj)
+    for k, v in obj.items():
+        if strategy == 'remove':
+            stack_.pop(k, None)
+            continue
+        if k in stack_:
+            if strategy == 'merge-first':
+                stack_k = stack_[k]
+                stack_[k] = _legacy_cleanup(v)
+                v = stack_k
+            if type(stack_[k]) != type(v):
+                stack_[k] = _legacy_cleanup(v)
+            elif isinstance(v, dict):
+                stack_[k] = _legacy_merge_dict(stack_[k], v)
+            elif isinstance(v, list):
+                stack_[k] = _legacy_merge_list(stack_[k], v)
+            else:
+                stack_[k] = v
+        else:
+            stack_[k] = _legacy_cleanup(v)
+    return stack_
+
+
+def _legacy_merge_list(stack_, obj):
+    strategy = 'merge-last'
+    if obj and isinstance(obj[0], dict) and '__' in obj[0]:
+        strategy = obj[0]['__']
+        del obj[0]
+    if strategy == 'overwrite':
+        return obj
+    elif strategy == 'remove':
+        return [item for item in stack_ if item not in obj]
+    elif strategy == 'merge-first':
+        return obj + stack_
+    return stack_ + obj
+
+
+def synthetic(minions, osds):
+    """
+    Return the base stack and the yaml files merged into it
+    """
+    def devices(host, start, end):
+        return ["/dev/disk/by-id/scsi-{}-{:04d}".format(host, osd)
+                for osd in range(start, end)]
+
+    hosts = ["data{}.ceph".format(host) for host in range(minions)]
+    base = {'ceph': {'storage': {'osds': {
+        host: {'format': 'bluestore', 'devices': devices(host, 0, osds)}
+        for host in hosts}}}}
+    removed = {'ceph': {'storage': {'osds': {
+        host: {'devices': [{'__': 'remove'}] + devices(host, 0, osds)[::2]}
+        for host in hosts}}}}
+    first = {'ceph': {'__': 'merge-first', 'storage': {'osds': {
+        host: {'format': 'filestore', 'devices': devices(host, osds, osds + 10)}
+        for host in hosts}}}}
+    return base, [removed, first]
+
+
+def measure(merge, base, objs, rounds):
+    best = None
+    for _ in range(rounds):
+        _base = copy.deepcopy(base)
+        _objs = copy.deepcopy(objs)
+        start = time.time()
+        for obj in _objs:
+            _base = merge(_base, obj)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, _base
+
+
+def main():
+    minions = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    osds = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    base, objs = synthetic(minions, osds)
+    legacy, expected = measure(_legacy_merge_dict, base, objs, 3)
+    current, result = measure(stack._merge_dict, base, objs, 3)
+    assert result == expected
+    print("{} minions, {} osds per minion".format(minions, osds))
+    print("legacy:  {:.3f}s".format(legacy))
+    print("current: {:.3f}s ({:.1f}x)".format(current, legacy / current))
+
+
+if __name__ == '__main__':
+    main()
@@ -161,6 +161,103 @@ class TestHardwareDetections():
         assert type(out) == dict
         assert expect == out
 
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._which')
+    @mock.patch('srv.salt._modules.cephdisks.Popen')
+    def test__hwinfo_all_disks(self, po, wm, output_helper, hwd):
+        """
+        A single hwinfo call returns every disk keyed by device file
+        """
+        wm.return_value = '/valid/path'
+        second = [line.replace('sda', 'sdb') for line in output_helper.hwinfo['stdout']]
+        po.return_value.stdout = output_helper.hwinfo['stdout'] + second
+        out = hwd.HardwareDetections()._hwinfo()
+        assert po.call_args[0][0] == '/valid/path --disk'
+        assert sorted(out.keys()) == ['/dev/sda', '/dev/sdb']
+        assert out['/dev/sda'] == output_helper.hwinfo['expected_return']
+
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._which')
+    @mock.patch('srv.salt._modules.cephdisks.Popen')
+    def test__osd_known_codes(self, po, wm, hwd):
+        """
+        Known partition type codes do not call sgdisk
+        """
+        codes = {'1': '45B0969E-9B03-4F30-B4C6-B4B80CEFF106'}
+        out = hwd.HardwareDetections()._osd('/dev/sda', ['1'], codes)
+        assert out is True
+        assert po.called is False
+
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._which')
+    @mock.patch('srv.salt._modules.cephdisks.Popen')
+    def test__osd_unknown_codes(self, po, wm, output_helper, hwd):
+        """
+        Partitions without a known type code fall back to sgdisk
+        """
+        wm.return_value = '/valid/path'
+        po.return_value.stdout = output_helper.sgdisk_invalid['stdout']
+        codes = {'1': '0FC63DAF-8483-4772-8E79-3D69D8477DE4', '2': None}
+        out = hwd.HardwareDetections()._osd('/dev/sda', ['1', '2'], codes)
+        assert out is False
+        assert po.call_count == 1
+        assert po.call_args[0][0] == '/valid/path -i 2 /dev/sda'
+
+    def test__partition_types(self, hwd):
+        table = [{'kname': 'sda', 'pkname': None, 'type': 'disk', 'parttype': None},
+                 {'kname': 'sda1', 'pkname': 'sda', 'type': 'part',
+                  'parttype': '4fbd7e29-9d25-41b8-afd0-062c0ceff05d'}]
+        out = hwd.HardwareDetections()._partition_types(table)
+        assert out == {'sda1': '4FBD7E29-9D25-41B8-AFD0-062C0CEFF05D'}
+
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._which')
+    @mock.patch('srv.salt._modules.cephdisks.Popen')
+    def test__lsblk_table(self, po, wm, hwd):
+        wm.return_value = '/valid/path'
+        stdout = b'{"blockdevices": [{"kname": "sda", "type": "disk"}]}'
+        po.return_value.communicate.return_value = (stdout, b'')
+        po.return_value.returncode = 0
+        out = hwd.HardwareDetections()._lsblk_table()
+        assert out == [{'kname': 'sda', 'type': 'disk'}]
+
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._which')
+    def test__lsblk_table_missing(self, wm, hwd):
+        wm.return_value = None
+        out = hwd.HardwareDetections()._lsblk_table()
+        assert out == []
+
+    @mock.patch('srv.salt._modules.cephdisks.glob')
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._drivers')
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._sysfs')
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._device_links')
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._lsblk_table')
+    def test__lsblk(self, table, links, sysfs, drivers, glob_mock, hwd):
+        table.return_value = [{'kname': 'sda', 'type': 'disk', 'serial': '0026a547'}]
+        links.return_value = {'/dev/sda': ['/dev/disk/by-id/scsi-SDELL_PERC_H700_0026a547',
+                                           '/dev/disk/by-path/pci-0000:02:00.0-scsi-0:2:0:0']}
+        sysfs.side_effect = lambda base, attr: {'size': '3905945600',
+                                                'device/vendor': 'DELL',
+                                                'device/model': 'PERC H700'}[attr]
+        drivers.return_value = 'megaraid_sas, sd'
+        glob_mock.return_value = ['/sys/block/sda/device']
+        out = hwd.HardwareDetections()._lsblk()
+        assert out == {'/dev/sda': {
+            'Bytes': '1999844147200',
+            'Capacity': '1862 GB',
+            'Device': 'PERC H700',
+            'Device File': '/dev/sda',
+            'Device Files': '/dev/sda, /dev/disk/by-id/scsi-SDELL_PERC_H700_0026a547, /dev/disk/by-path/pci-0000:02:00.0-scsi-0:2:0:0',
+            'Driver': 'megaraid_sas, sd',
+            'Model': 'DELL PERC H700',
+            'Serial ID': '0026a547',
+            'Vendor': 'DELL'}}
+
+    @pytest.mark.parametrize("size,expected", [
+        (1999844147200, '1862 GB'),
+        (400088457216, '372 GB'),
+        (20000000000000, '18 TB'),
+        (521142272, '497 MB')
+    ])
+    def test__capacity(self, hwd, size, expected):
+        assert hwd.HardwareDetections()._capacity(size) == expected
+
     @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._which')
     @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._return_device_bus_id')
     @mock.patch('srv.salt._modules.cephdisks.Popen')
@@ -409,6 +506,10 @@ class TestHardwareDetections_2():
         hwd = cephdisks.HardwareDetections(detection_method='lshw')
         assert callable(hwd.detection_method) is True
 
+    def test_detection_tool_overwrite_lsblk(self):
+        hwd = cephdisks.HardwareDetections(detection_method='lsblk')
+        assert hwd.detection_method == hwd._lsblk
+
 class TestCephDiskDevice():
 
     @mock.patch('srv.salt._modules.cephdisks._pathname_setting')
@@ -419,10 +520,12 @@ class TestCephDiskDevice():
         ms.return_value = '-name ata* -o -name scsi* -o -name nvme*'
         pu.return_value = -1
         cephdisks.__salt__ = {}
-        cephdisks.__salt__['helper.run'] = mock.Mock()
-        cephdisks.__salt__['helper.run'].return_value = (0, '/dev/disk/by-id/sda', "")
+        cephdisks.__salt__['devlinks.aliases'] = mock.Mock()
+        cephdisks.__salt__['devlinks.aliases'].return_value = ['/dev/disk/by-id/sda']
         ret = cephdisks.device_('/dev/sda')
         assert ret == '/dev/disk/by-id/sda'
+        cephdisks.__salt__['devlinks.aliases'].assert_called_with(
+            '/dev/sda', pathname='/dev/disk/by-id', patterns=['ata*', 'scsi*', 'nvme*'])
 
     @mock.patch('srv.salt._modules.cephdisks._pathname_setting')
     @mock.patch('srv.salt._modules.cephdisks._match_setting')
@@ -432,11 +535,45 @@ class TestCephDiskDevice():
         ms.return_value = '-name ata* -o -name scsi* -o -name nvme*'
         pu.return_value = -1
         cephdisks.__salt__ = {}
-        cephdisks.__salt__['helper.run'] = mock.Mock()
-        cephdisks.__salt__['helper.run'].return_value = (0, "", "")
+        cephdisks.__salt__['devlinks.aliases'] = mock.Mock()
+        cephdisks.__salt__['devlinks.aliases'].return_value = []
         ret = cephdisks.device_('/dev/sda')
         assert ret == "/dev/sda"
 
+    @mock.patch('srv.salt._modules.cephdisks._pathname_setting')
+    @mock.patch('srv.salt._modules.cephdisks._match_setting')
+    def test_device_custom_match_uses_find(self, ms, ps):
+        ps.return_value = '/dev/disk/by-id'
+        ms.return_value = '-name ata* -a -newer /tmp'
+        cephdisks.__salt__ = {}
+        cephdisks.__salt__['helper.run'] = mock.Mock()
+        cephdisks.__salt__['helper.run'].return_value = (0, '/dev/disk/by-id/ata-1', "")
+        ret = cephdisks.device_('/dev/sda')
+        assert ret == '/dev/disk/by-id/ata-1'
+
+    @pytest.mark.parametrize("match, expected", [
+        ('-name ata* -o -name scsi* -o -name nvme*', ['ata*', 'scsi*', 'nvme*']),
+        ('-name wwn*', ['wwn*']),
+        ('-name ata* -a -name scsi*', None),
+        ('-newer /tmp', None),
+    ])
+    def test_match_patterns(self, match, expected):
+        assert cephdisks._match_patterns(match) == expected
+
+    @mock.patch('srv.salt._modules.cephdisks._seek')
+    def test_detection_setting_pillar(self, seek):
+        seek.return_value = 'lsblk'
+        cephdisks.__pillar__ = {}
+        ret = cephdisks._detection_setting({})
+        assert ret == {'detection_method': 'lsblk'}
+
+    @mock.patch('srv.salt._modules.cephdisks._seek')
+    def test_detection_setting_arg(self, seek):
+        seek.return_value = 'lsblk'
+        cephdisks.__pillar__ = {}
+        ret = cephdisks._detection_setting({'detection_method': 'hwinfo'})
+        assert ret == {'detection_method': 'hwinfo'}
+
     def test_match_setting_arg(self):
         ret = cephdisks._match_setting('custom')
         assert ret == 'custom'
@@ -514,3 +651,121 @@ class TestCephDiskDevice():
     def test_version(self):
         ret = cephdisks.version()
         assert ret == cephdisks.VERSION
+
+
+class TestDeviceCache():
+
+    def _sysblock(self, tmpdir, size='100'):
+        base = tmpdir.mkdir('sda')
+        base.join('size').write(size)
+        base.join('removable').write('0')
+        base.join('dev').write('8:0')
+        part = base.mkdir('sda1')
+        part.join('start').write('2048')
+        part.join('size').write('50')
+        return str(base)
+
+    def test_fingerprint_changes_with_partitions(self, tmpdir):
+        base = self._sysblock(tmpdir)
+        cache = cephdisks.DeviceCache(str(tmpdir.join('cache.json')))
+        before = cache.fingerprint(base)
+        tmpdir.join('sda', 'sda1', 'size').write('60')
+        assert cache.fingerprint(base) != before
+
+    def test_save_and_load(self, tmpdir):
+        filename = str(tmpdir.join('cache.json'))
+        base = self._sysblock(tmpdir)
+        cache = cephdisks.DeviceCache(filename, {'a': 1})
+        fingerprint = cache.fingerprint(base)
+        cache.set('sda', fingerprint, {'device': 'sda'})
+        cache.set('sdb', fingerprint, None)
+        cache.save()
+
+        cache = cephdisks.DeviceCache(filename, {'a': 1})
+        assert cache.valid('sda', fingerprint)
+        assert cache.get('sda') == {'device': 'sda'}
+        assert cache.get('sdb') is None
+
+    def test_save_drops_unseen_devices(self, tmpdir):
+        filename = str(tmpdir.join('cache.json'))
+        cache = cephdisks.DeviceCache(filename)
+        cache.set('sda', [], {'device': 'sda'})
+        cache.save()
+        cache = cephdisks.DeviceCache(filename)
+        cache.save()
+        cache = cephdisks.DeviceCache(filename)
+        assert cache.devices == {}
+
+    def test_options_mismatch(self, tmpdir):
+        filename = str(tmpdir.join('cache.json'))
+        cache = cephdisks.DeviceCache(filename, {'detection_method': 'hwinfo'})
+        cache.set('sda', [], {'device': 'sda'})
+        cache.save()
+        cache = cephdisks.DeviceCache(filename, {'detection_method': 'lsblk'})
+        assert not cache.valid('sda', [])
+
+    def test_corrupt_cache(self, tmpdir):
+        filename = tmpdir.join('cache.json')
+        filename.write('{not json')
+        cache = cephdisks.DeviceCache(str(filename))
+        assert cache.devices == {}
+
+    @mock.patch('srv.salt._modules.cephdisks.glob')
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._find_detection_tool')
+    def test_assemble_device_list_uses_cache(self, tool, glob_mock, tmpdir):
+        glob_mock.return_value = ['/sys/block/sda/device', '/sys/block/sdb/device']
+        cache = mock.Mock()
+        cache.fingerprint.return_value = []
+        cache.valid.side_effect = lambda device, fingerprint: device == 'sda'
+        cache.get.return_value = {'device': 'sda'}
+        hwd = cephdisks.HardwareDetections()
+        hwd._assemble_device = mock.Mock(return_value={'device': 'sdb'})
+        hwd._probe = mock.Mock()
+
+        ret = hwd.assemble_device_list(cache)
+        assert ret == [{'device': 'sda'}, {'device': 'sdb'}]
+        hwd._assemble_device.assert_called_once_with('/sys/block/sdb')
+        cache.set.assert_called_once_with('sdb', [], {'device': 'sdb'})
+        cache.save.assert_called_once_with()
+
+    @mock.patch('srv.salt._modules.cephdisks.glob')
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._find_detection_tool')
+    def test_assemble_device_list_skips_probe(self, tool, glob_mock):
+        glob_mock.return_value = ['/sys/block/sda/device']
+        cache = mock.Mock()
+        cache.valid.return_value = True
+        cache.get.return_value = None
+        hwd = cephdisks.HardwareDetections()
+        hwd._detect_raidctrl = mock.Mock()
+
+        assert hwd.assemble_device_list(cache) == []
+        assert not hwd._detect_raidctrl.called
+
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections.assemble_device_list')
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._find_detection_tool')
+    def test_list_refresh(self, tool, assemble, tmpdir):
+        cephdisks.__pillar__ = {}
+        cephdisks.__opts__ = {'cachedir': str(tmpdir)}
+        cache = cephdisks.DeviceCache(str(tmpdir.join('cephdisks.json')))
+        cache.set('sda', [], {'device': 'sda'})
+        cache.save()
+
+        cephdisks.list_(refresh=True, __pub_jid='1')
+        cache = assemble.call_args[0][0]
+        assert cache.devices == {}
+        assert cache.options == {}
+
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections.assemble_device_list')
+    @mock.patch('srv.salt._modules.cephdisks.HardwareDetections._find_detection_tool')
+    def test_list_ignores_proposal_arguments(self, tool, assemble, tmpdir):
+        cephdisks.__pillar__ = {}
+        cephdisks.__opts__ = {'cachedir': str(tmpdir)}
+        cache = cephdisks.DeviceCache(str(tmpdir.join('cephdisks.json')),
+                                      {'hw_raid': True})
+        cache.set('sda', [], {'device': 'sda'})
+        cache.save()
+
+        cephdisks.list_(hw_raid=True, ratio=5, target='*', name='default')
+        cache = assemble.call_args[0][0]
+        assert cache.options == {'hw_raid': True}
+        assert cache.valid('sda', [])
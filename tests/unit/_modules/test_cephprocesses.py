@@ -34,6 +34,9 @@ class MockedPsUtil(object):
     def status(self):
         return 'running'
 
+    def create_time(self):
+        return 0.0
+
 
 class TestCephprocessesProcInfo():
 
@@ -452,7 +455,7 @@ class TestInstanceMethods():
     @mock.patch('srv.salt._modules.cephprocesses.MetaCheck.check_absents')
     @mock.patch('srv.salt._modules.cephprocesses.MetaCheck.check_inverts')
     @mock.patch('srv.salt._modules.cephprocesses.MetaCheck.check_osds')
-    @mock.patch('srv.salt._modules.cephprocesses.MetaCheck.add')
+    @mock.patch('srv.salt._modules.cephprocesses.MetaCheck.collect')
     @mock.patch('srv.salt._modules.cephprocesses.ProcInfo')
     def test_check_2(self, proc_mock, meta_mock, mock_check_osds, meta_check_invert, meta_check_absent, mock_report, psutil_mock, test_input, expected):
         """
@@ -460,16 +463,109 @@ class TestInstanceMethods():
         """
         role = [test_input]
         cephprocesses.__pillar__ = {'roles': role}
-        psutil_mock.return_value = ['proc1']
+        proc1 = MockedPsUtil('ceph-mon', 0, 0, '/usr/bin/ceph-mon')
+        psutil_mock.return_value = [proc1]
         cephprocesses.check()
-        proc_mock.assert_called_with('proc1')
-        # ANY instance of ProcInfo
+        proc_mock.assert_called_with(proc1)
+        # ANY ProcessTable
         meta_mock.assert_called_with(ANY, expected)
         meta_check_invert.assert_called_with(expected)
         meta_check_absent.assert_called_with(expected)
         mock_check_osds.assert_called_once is False
         mock_report.assert_called
 
+    @mock.patch('srv.salt._modules.cephprocesses.psutil.process_iter')
+    @mock.patch('srv.salt._modules.cephprocesses.ProcInfo')
+    def test_check_walks_processes_once(self, proc_mock, psutil_mock):
+        """
+        All roles are evaluated against a single pass over the process table
+        """
+        cephprocesses.__pillar__ = {'roles': ['mon', 'mgr', 'mds']}
+        psutil_mock.return_value = [MockedPsUtil('ceph-mon', 1, 0, '/usr/bin/ceph-mon'),
+                                    MockedPsUtil('ceph-mgr', 2, 0, '/usr/bin/ceph-mgr')]
+        cephprocesses.check()
+        assert psutil_mock.call_count == 1
+        assert proc_mock.call_count == 2
+
+    @mock.patch('srv.salt._modules.cephprocesses.psutil.process_iter')
+    def test_check_per_role(self, psutil_mock):
+        """
+        Only assigned roles are reported, each with its own result
+        """
+        cephprocesses.__pillar__ = {'roles': ['mon', 'mgr']}
+        psutil_mock.return_value = [MockedPsUtil('ceph-mon', 1, 0, '/usr/bin/ceph-mon')]
+        ret = cephprocesses.check(per_role=True, roles=['mon', 'mgr', 'storage'], quiet=True)
+        assert ret == {'mon': True, 'mgr': False}
+
+
+class TestProcessTable():
+
+    @mock.patch('srv.salt._modules.cephprocesses.psutil.process_iter')
+    def test_refresh_skips_unrelated(self, psutil_mock):
+        psutil_mock.return_value = [MockedPsUtil('ceph-mon', 1, 0, '/usr/bin/ceph-mon'),
+                                    MockedPsUtil('sshd', 2, 0, '/usr/sbin/sshd')]
+        table = cephprocesses.ProcessTable().refresh()
+        assert [procinfo.name for procinfo in table.processes] == ['ceph-mon']
+        assert list(table.by_name.keys()) == ['ceph-mon']
+
+    @mock.patch('srv.salt._modules.cephprocesses.psutil.process_iter')
+    def test_refresh_osds(self, psutil_mock):
+        psutil_mock.return_value = [MockedPsUtil('ceph-osd', 1, 0, '/usr/bin/ceph-osd', osd_id=3),
+                                    MockedPsUtil('ceph-osd', 2, 0, '/usr/bin/ceph-osd', osd_id=4)]
+        table = cephprocesses.ProcessTable().refresh()
+        assert sorted(table.osds.keys()) == ['3', '4']
+
+    @mock.patch('srv.salt._modules.cephprocesses.ProcInfo')
+    @mock.patch('srv.salt._modules.cephprocesses.psutil.process_iter')
+    def test_refresh_reuses_known(self, psutil_mock, proc_mock):
+        """
+        A second refresh only inspects new processes
+        """
+        mon = MockedPsUtil('ceph-mon', 1, 0, '/usr/bin/ceph-mon')
+        mgr = MockedPsUtil('ceph-mgr', 2, 0, '/usr/bin/ceph-mgr')
+        psutil_mock.return_value = [mon]
+        table = cephprocesses.ProcessTable().refresh()
+        psutil_mock.return_value = [mon, mgr]
+        table.refresh()
+        assert proc_mock.call_count == 2
+        assert len(table.processes) == 2
+
+    @mock.patch('srv.salt._modules.cephprocesses.ProcInfo')
+    @mock.patch('srv.salt._modules.cephprocesses.psutil.process_iter')
+    def test_refresh_drops_gone(self, psutil_mock, proc_mock):
+        mon = MockedPsUtil('ceph-mon', 1, 0, '/usr/bin/ceph-mon')
+        psutil_mock.return_value = [mon]
+        table = cephprocesses.ProcessTable().refresh()
+        psutil_mock.return_value = []
+        table.refresh()
+        assert table.processes == []
+
+    @mock.patch('srv.salt._modules.cephprocesses.psutil.process_iter')
+    def test_refresh_after_exec(self, psutil_mock):
+        """
+        A skipped process is examined again once it runs a ceph daemon
+        """
+        proc = MockedPsUtil('sh', 1, 0, '/bin/sh')
+        psutil_mock.return_value = [proc]
+        table = cephprocesses.ProcessTable().refresh()
+        assert table.processes == []
+        proc._name = 'ceph-mon'
+        proc._exe = '/usr/bin/ceph-mon'
+        table.refresh()
+        assert list(table.by_name.keys()) == ['ceph-mon']
+
+    @mock.patch('srv.salt._modules.cephprocesses.psutil.process_iter')
+    def test_collect(self, psutil_mock):
+        psutil_mock.return_value = [MockedPsUtil('ceph-mon', 1, 0, '/usr/bin/ceph-mon'),
+                                    MockedPsUtil('ceph-osd', 2, 0, '/usr/bin/ceph-osd', osd_id=3),
+                                    MockedPsUtil('ceph-osd', 3, 0, '/usr/bin/ceph-osd', osd_id=4)]
+        table = cephprocesses.ProcessTable().refresh()
+        mc = cephprocesses.MetaCheck()
+        mc.collect(table, 'storage')
+        assert [prc.pid for prc in mc.up] == [2, 3]
+        assert sorted(mc._up_osds) == ['3', '4']
+
+
 class TestSystemdUnit():
 
 
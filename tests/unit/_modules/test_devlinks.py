@@ -0,0 +1,84 @@
+import os
+import pytest
+import sys
+sys.path.insert(0, 'srv/salt/_modules')
+from srv.salt._modules import devlinks
+from mock import patch
+
+
+class TestResolver(object):
+    """
+    Unittests for the /dev/disk symlink index
+    """
+
+    @pytest.fixture()
+    def disk(self, tmpdir):
+        tmpdir.join('sda').write('')
+        tmpdir.join('sdb').write('')
+        by_id = tmpdir.mkdir('by-id')
+        by_id.join('ata-ST4000_Z1').mksymlinkto(tmpdir.join('sda'))
+        by_id.join('wwn-0x5000').mksymlinkto(tmpdir.join('sda'))
+        by_id.join('ata-ST4000_Z2').mksymlinkto(tmpdir.join('sdb'))
+        by_path = tmpdir.mkdir('by-path')
+        by_path.join('pci-0000:00:1f.2-ata-1').mksymlinkto('../sda')
+        return tmpdir
+
+    def resolver(self, disk):
+        return devlinks.Resolver([str(disk.join('by-id')), str(disk.join('by-path'))])
+
+    def test_aliases(self, disk):
+        resolver = self.resolver(disk)
+        assert resolver.aliases(str(disk.join('sda'))) == [
+            str(disk.join('by-id', 'ata-ST4000_Z1')),
+            str(disk.join('by-id', 'wwn-0x5000')),
+            str(disk.join('by-path', 'pci-0000:00:1f.2-ata-1'))]
+
+    def test_aliases_of_alias(self, disk):
+        resolver = self.resolver(disk)
+        result = resolver.aliases(str(disk.join('by-id', 'wwn-0x5000')),
+                                  directories=[str(disk.join('by-path'))])
+        assert result == [str(disk.join('by-path', 'pci-0000:00:1f.2-ata-1'))]
+
+    def test_aliases_patterns(self, disk):
+        resolver = self.resolver(disk)
+        result = resolver.aliases(str(disk.join('sda')), patterns=['ata*', 'nvme*'])
+        assert result == [str(disk.join('by-id', 'ata-ST4000_Z1'))]
+
+    def test_aliases_missing_device(self, disk):
+        assert self.resolver(disk).aliases(str(disk.join('sdz'))) == []
+
+    def test_missing_directory(self, disk):
+        resolver = devlinks.Resolver([str(disk.join('by-uuid'))])
+        assert resolver.aliases(str(disk.join('sda'))) == []
+
+    def test_resolve(self, disk):
+        resolver = self.resolver(disk)
+        link = str(disk.join('by-path', 'pci-0000:00:1f.2-ata-1'))
+        assert resolver.resolve(link) == str(disk.join('sda'))
+        assert resolver.resolve(str(disk.join('sdb'))) == str(disk.join('sdb'))
+
+    def test_scanned_once(self, disk):
+        resolver = self.resolver(disk)
+        with patch.object(devlinks.os, 'listdir', wraps=os.listdir) as listdir:
+            resolver.aliases(str(disk.join('sda')))
+            resolver.aliases(str(disk.join('sdb')))
+            assert listdir.call_count == 2
+
+    def test_rescan_on_mtime(self, disk):
+        resolver = self.resolver(disk)
+        assert len(resolver.aliases(str(disk.join('sdb')))) == 1
+        disk.join('by-id', 'wwn-0x6000').mksymlinkto(disk.join('sdb'))
+        os.utime(str(disk.join('by-id')), (1, 1))
+        assert len(resolver.aliases(str(disk.join('sdb')))) == 2
+
+    def test_invalidate(self, disk):
+        resolver = self.resolver(disk)
+        resolver.aliases(str(disk.join('sda')))
+        resolver.invalidate()
+        assert resolver.index == {}
+
+    def test_short(self, disk):
+        with patch.object(devlinks, '_RESOLVER', self.resolver(disk)):
+            assert devlinks.short(str(disk.join('by-id', 'wwn-0x5000'))) == ""
+            with patch.object(devlinks.os.path, 'dirname', return_value='/dev'):
+                assert devlinks.short(str(disk.join('by-id', 'wwn-0x5000'))) == str(disk.join('sda'))
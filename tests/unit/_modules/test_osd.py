@@ -2,6 +2,9 @@ from pyfakefs import fake_filesystem as fake_fs
 from pyfakefs import fake_filesystem_glob as fake_glob
 import pytest
 import sys
+import json
+import threading
+import time
 sys.path.insert(0, 'srv/salt/_modules')
 from srv.salt._modules import osd
 from tests.unit.helper.fixtures import helper_specs
@@ -2886,183 +2889,134 @@ class TestOSDRemove():
 
 class TestOSDDestroyed():
 
-    fs = fake_fs.FakeFilesystem()
-    f_os = fake_fs.FakeOsModule(fs)
-    f_open = fake_fs.FakeFileOpen(fs)
-
-    @patch('os.path.exists', new=f_os.path.exists)
-    @patch('__builtin__.open', new=f_open)
-    def test_update(self):
-        filename = "/etc/ceph/destroyedOSDs.yml"
-        TestOSDDestroyed.f_os.makedirs("/etc/ceph")
-
-        osdd = osd.OSDDestroyed()
+    @pytest.fixture
+    def osdd(self, tmpdir):
+        osd.__grains__ = {'id': 'data1.ceph'}
+        osdd = osd.OSDDestroyed(filename=str(tmpdir.join('destroyedOSDs.db')),
+                                legacy=str(tmpdir.join('destroyedOSDs.yml')))
         osdd._by_path = mock.Mock()
         osdd._by_path.return_value = '/dev/disk/by-path/virtio-pci-0000:00:04.0'
+        return osdd
 
+    def test_update(self, osdd):
         result = osdd.update('/dev/sda', 1)
-        contents = TestOSDDestroyed.f_open(filename).read()
-
-        TestOSDDestroyed.fs.RemoveFile(filename)
-        TestOSDDestroyed.f_os.rmdir("/etc/ceph")
-        TestOSDDestroyed.f_os.rmdir("/etc")
-        assert result == "" and contents == "/dev/disk/by-path/virtio-pci-0000:00:04.0: 1\n"
-
-    @patch('os.path.exists', new=f_os.path.exists)
-    @patch('__builtin__.open', new=f_open)
-    def test_update_with_no_by_path(self):
-        filename = "/etc/ceph/destroyedOSDs.yml"
-        TestOSDDestroyed.f_os.makedirs("/etc/ceph")
+        assert result == ""
+        assert osdd.dump() == {'/dev/disk/by-path/virtio-pci-0000:00:04.0': 1}
 
-        osdd = osd.OSDDestroyed()
-        osdd._by_path = mock.Mock()
+    def test_update_with_no_by_path(self, osdd):
         osdd._by_path.return_value = None
 
         result = osdd.update('/dev/sda', 1)
-        contents = TestOSDDestroyed.f_open(filename).read()
+        assert "Device /dev/sda is missing" in result
+        assert osdd.dump() == {'/dev/sda': 1}
 
-        TestOSDDestroyed.fs.RemoveFile(filename)
-        TestOSDDestroyed.f_os.rmdir("/etc/ceph")
-        TestOSDDestroyed.f_os.rmdir("/etc")
-        assert "Device /dev/sda is missing" in result and contents == "/dev/sda: 1\n"
-
-    @patch('os.path.exists', new=f_os.path.exists)
-    @patch('__builtin__.open', new=f_open)
-    def test_update_entry_exists(self):
-        filename = "/etc/ceph/destroyedOSDs.yml"
-        TestOSDDestroyed.fs.CreateFile(filename, contents="""/dev/sda1: '1'""")
+    def test_update_entry_exists(self, osdd):
+        osdd._by_path.return_value = None
+        osdd.update('/dev/sda', 1)
 
-        osdd = osd.OSDDestroyed()
+        osdd._by_path = mock.Mock()
         result = osdd.update('/dev/sda', 1)
-
-        TestOSDDestroyed.fs.RemoveFile(filename)
         assert result == ""
+        osdd._by_path.assert_not_called()
 
-    @patch('os.path.exists', new=f_os.path.exists)
-    @patch('__builtin__.open', new=f_open)
-    def test_update_force(self):
-        filename = "/etc/ceph/destroyedOSDs.yml"
-
-        osdd = osd.OSDDestroyed()
-        osdd._by_path = mock.Mock()
+    def test_update_force(self, osdd):
         osdd._by_path.return_value = None
 
         result = osdd.update('/dev/sda', 1, force=True)
-        contents = TestOSDDestroyed.f_open(filename).read()
+        assert result == ""
+        assert osdd.dump() == {'/dev/sda': 1}
 
-        TestOSDDestroyed.fs.RemoveFile(filename)
-        assert result == "" and contents == "/dev/sda: 1\n"
+    def test_update_many(self, osdd):
+        osdd._by_path.side_effect = lambda device: device.replace('/dev/', '/dev/disk/by-path/')
 
-    @patch('os.path.exists', new=f_os.path.exists)
-    @patch('__builtin__.open', new=f_open)
-    def test_get(self):
-        filename = "/etc/ceph/destroyedOSDs.yml"
-        TestOSDDestroyed.fs.CreateFile(filename, contents="""/dev/disk/by-path/virtio-pci-0000:00:04.0: '1'""")
-        osdd = osd.OSDDestroyed()
+        result = osdd.update_many([('/dev/sda', 1), ('/dev/sdb', 2)])
+        assert result == {'/dev/sda': "", '/dev/sdb': ""}
+        assert osdd.get_many(['/dev/sda', '/dev/sdb', '/dev/sdc']) == \
+            {'/dev/sda': 1, '/dev/sdb': 2, '/dev/sdc': ""}
 
-        osdd._by_path = mock.Mock()
-        osdd._by_path.return_value = '/dev/disk/by-path/virtio-pci-0000:00:04.0'
+    def test_get(self, osdd):
+        osdd.update('/dev/sda', 1)
+        assert osdd.get('/dev/disk/by-path/virtio-pci-0000:00:04.0') == 1
 
-        result = osdd.get('/dev/disk/by-path/virtio-pci-0000:00:04.0')
-        TestOSDDestroyed.fs.RemoveFile(filename)
-        assert result == '1'
-    
-    @patch('os.path.exists', new=f_os.path.exists)
-    @patch('__builtin__.open', new=f_open)
-    def test_get_no_match(self):
-        filename = "/etc/ceph/destroyedOSDs.yml"
-        TestOSDDestroyed.fs.CreateFile(filename, contents="""/dev/disk/by-path/virtio-pci-0000:00:04.0: '1'""")
-        osdd = osd.OSDDestroyed()
+    def test_get_original_device(self, osdd):
+        osdd.update('/dev/sda', 1, force=True)
+        assert osdd.get('/dev/sda') == 1
 
-        osdd._by_path = mock.Mock()
+    def test_get_no_match(self, osdd):
+        osdd.update('/dev/sda', 1)
         osdd._by_path.return_value = '/dev/disk/by-path/virtio-pci-0000:00:10.0'
+        assert osdd.get('/dev/disk/by-path/virtio-pci-0000:00:10.0') == ""
+
+    def test_get_missing_file(self, osdd, tmpdir):
+        assert osdd.get('/dev/sda') == ""
+        assert not tmpdir.join('destroyedOSDs.db').exists()
 
-        result = osdd.get('/dev/disk/by-path/virtio-pci-0000:00:10.0')
-        TestOSDDestroyed.fs.RemoveFile(filename)
-        assert result is ""
-    
     def test_by_path(self):
         osdd = osd.OSDDestroyed()
 
-        output = """
-            /dev/disk/by-path/pci-0000:00:1f.2-scsi-1:0:0:0
-            /dev/disk/by-path/pci-0000:00:1f.2-ata-2"""
+        output = ["/dev/disk/by-path/pci-0000:00:1f.2-scsi-1:0:0:0",
+                  "/dev/disk/by-path/pci-0000:00:1f.2-ata-2"]
 
-        osd.__salt__['helper.run'] = mock.Mock()
-        osd.__salt__['helper.run'].return_value = (0, output, "err")
+        osd.__salt__['devlinks.aliases'] = mock.Mock()
+        osd.__salt__['devlinks.aliases'].return_value = output
 
         result = osdd._by_path("/dev/sda")
         assert result == "/dev/disk/by-path/pci-0000:00:1f.2-scsi-1:0:0:0"
+        osd.__salt__['devlinks.aliases'].assert_called_with(
+            "/dev/sda", pathname="/dev/disk/by-path")
 
     def test_by_path_no_match(self):
         osdd = osd.OSDDestroyed()
 
-        output = ""
-
-        osd.__salt__['helper.run'] = mock.Mock()
-        osd.__salt__['helper.run'].return_value = (0, output, "err")
+        osd.__salt__['devlinks.aliases'] = mock.Mock()
+        osd.__salt__['devlinks.aliases'].return_value = []
 
         result = osdd._by_path("/dev/sda")
-        assert result is ""
-
-    @patch('os.path.exists', new=f_os.path.exists)
-    @patch('__builtin__.open', new=f_open)
-    def test_remove(self):
-        filename = "/etc/ceph/destroyedOSDs.yml"
-        TestOSDDestroyed.fs.CreateFile(filename, contents="""/dev/disk/by-path/virtio-pci-0000:00:04.0: '1'""")
-
-        osdd = osd.OSDDestroyed()
-        osdd._by_path = mock.Mock()
-        osdd._by_path.return_value = "/dev/disk/by-path/virtio-pci-0000:00:04.0"
+        assert result == ""
 
+    def test_remove(self, osdd):
+        osdd.update('/dev/sda', 1)
         osdd.remove('/dev/sda')
+        assert osdd.dump() == {}
 
-        contents = TestOSDDestroyed.f_open(filename).read()
-        TestOSDDestroyed.fs.RemoveFile(filename)
-        assert contents == "{}\n"
-
-    @patch('os.path.exists', new=f_os.path.exists)
-    @patch('__builtin__.open', new=f_open)
-    def test_remove_original_device(self):
-        filename = "/etc/ceph/destroyedOSDs.yml"
-        TestOSDDestroyed.fs.CreateFile(filename, contents="""/dev/sda: '1'""")
-
-        osdd = osd.OSDDestroyed()
-        osdd._by_path = mock.Mock()
-        osdd._by_path.return_value = "/dev/disk/by-path/virtio-pci-0000:00:04.0"
-
+    def test_remove_original_device(self, osdd):
+        osdd.update('/dev/sda', 1, force=True)
         osdd.remove('/dev/sda')
+        assert osdd.dump() == {}
 
-        contents = TestOSDDestroyed.f_open(filename).read()
-        TestOSDDestroyed.fs.RemoveFile(filename)
-        assert contents == "{}\n"
-
-    @patch('os.path.exists', new=f_os.path.exists)
-    def test_remove_missing_file(self):
-        osdd = osd.OSDDestroyed()
-        osdd._by_path = mock.Mock()
-        osdd._by_path.return_value = "/dev/disk/by-path/virtio-pci-0000:00:04.0"
-
+    def test_remove_missing_file(self, osdd):
         result = osdd.remove('/dev/sda')
         assert result is None
 
-    @patch('os.path.exists', new=f_os.path.exists)
-    @patch('__builtin__.open', new=f_open)
-    def test_dump(self):
-        filename = "/etc/ceph/destroyedOSDs.yml"
-        contents = "/dev/sda: '1'"
-        TestOSDDestroyed.fs.CreateFile(filename, contents=contents)
-
-        osdd = osd.OSDDestroyed()
-        results = osdd.dump()
-        TestOSDDestroyed.fs.RemoveFile(filename)
-        assert results == {'/dev/sda': '1'}
-
-    @patch('os.path.exists', new=f_os.path.exists)
-    def test_dump_missing_file(self):
-        osdd = osd.OSDDestroyed()
-        results = osdd.dump()
-        assert results is ""
+    def test_dump(self, osdd):
+        osdd._by_path.side_effect = lambda device: device.replace('/dev/', '/dev/disk/by-path/')
+        osdd.update('/dev/sdb', 2)
+        osdd.update('/dev/sda', 1)
+        osdd.update('/dev/sdc', 3)
+        osdd.update('/dev/sda', 4)
+        osdd.remove('/dev/disk/by-path/sdc')
+
+        assert osdd.dump() == {'/dev/disk/by-path/sda': 4,
+                               '/dev/disk/by-path/sdb': 2}
+
+    def test_dump_missing_file(self, osdd):
+        assert osdd.dump() == ""
+
+    def test_import_legacy(self, osdd, tmpdir):
+        tmpdir.join('destroyedOSDs.yml').write("/dev/sda: 1\n/dev/sdb: '2'\n")
+        assert osdd.dump() == {'/dev/sda': 1, '/dev/sdb': '2'}
+        assert not tmpdir.join('destroyedOSDs.yml').exists()
+        assert tmpdir.join('destroyedOSDs.yml.migrated').exists()
+
+    def test_concurrent_updates(self, osdd):
+        osdd._by_path.side_effect = lambda device: device.replace('/dev/', '/dev/disk/by-path/')
+        threads = [threading.Thread(target=osdd.update, args=('/dev/sd{}'.format(idx), idx))
+                   for idx in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(osdd.dump()) == 10
 
 class TestOSDGrains():
 
@@ -3758,6 +3712,326 @@ class TestCephPGS:
                 ret = ceph_pgs.quiescent()
                 assert 'The delay cannot be 0' in str(excinfo.value)
 
+    @patch('time.sleep')
+    @patch('srv.salt._modules.osd.CephPGs.pg_states')
+    def test_quiescent_backoff(self, pg_states, sleep):
+        """
+        Poll quickly first, then back off to the delay
+        """
+        pg_states.return_value = [{}, {}]
+        with patch.object(osd.CephPGs, "__init__", lambda self: None):
+            ceph_pgs = osd.CephPGs()
+            ceph_pgs.settings = {'timeout': 40, 'delay': 12}
+
+            with pytest.raises(RuntimeError):
+                ceph_pgs.quiescent()
+            delays = [call[0][0] for call in sleep.call_args_list]
+            assert delays == [1, 2, 4, 8, 12, 12, 12]
+
+    @patch('time.sleep')
+    @patch('srv.salt._modules.osd.CephPGs.pg_states')
+    def test_quiescent_fast(self, pg_states, sleep):
+        """
+        PGs that become clean quickly only cost the minimum delay
+        """
+        pg_states.side_effect = [[{'name': 'peering', 'num': 1},
+                                  {'name': 'active+clean', 'num': 10}],
+                                 [{'name': 'active+clean', 'num': 11}]]
+        with patch.object(osd.CephPGs, "__init__", lambda self: None):
+            ceph_pgs = osd.CephPGs()
+            ceph_pgs.settings = {'timeout': 120, 'delay': 12}
+            ceph_pgs.quiescent()
+            sleep.assert_called_once_with(1)
+
+    @patch('srv.salt._modules.osd.CephPGs.pg_states')
+    def test_quiescent_events(self, pg_states):
+        """
+        Subscribe to the cluster log and unregister afterwards
+        """
+        pg_states.side_effect = [[{'name': 'peering', 'num': 1}],
+                                 [{'name': 'active+clean', 'num': 1}]]
+        with patch.object(osd.CephPGs, "__init__", lambda self: None):
+            ceph_pgs = osd.CephPGs()
+            ceph_pgs.settings = {'timeout': 120, 'delay': 12, 'min_delay': 0.01, 'events': True}
+            ceph_pgs.cluster = MagicMock()
+            ceph_pgs.quiescent()
+            calls = ceph_pgs.cluster.monitor_log.call_args_list
+            assert calls[0][0][0] == 'info'
+            assert calls[-1][0] == ('info', None, None)
+
+    def test_cluster_reused(self):
+        cluster = MagicMock()
+        ceph_pgs = osd.CephPGs(cluster=cluster)
+        assert ceph_pgs.cluster is cluster
+
+
+class TestOSDRedeploy:
+
+    def test_batches_concurrency(self):
+        osdr = osd.OSDRedeploy(concurrency=2)
+        assert osdr.batches(['0', '1', '2']) == [['0', '1'], ['2']]
+
+    def test_batches_default(self):
+        osdr = osd.OSDRedeploy()
+        assert osdr.batches(['0', '1']) == [['0'], ['1']]
+
+    @patch('srv.salt._modules.osd.OSDRedeploy.pg_counts')
+    def test_batches_max_pgs(self, pg_counts):
+        pg_counts.return_value = {'0': 100, '1': 100, '2': 300, '3': 50}
+        osdr = osd.OSDRedeploy(concurrency=4, max_pgs=250)
+        assert osdr.batches(['0', '1', '2', '3']) == [['0', '1'], ['2'], ['3']]
+
+    @patch('srv.salt._modules.osd.remove_destroyed')
+    @patch('srv.salt._modules.osd.restore_weight')
+    @patch('srv.salt._modules.osd.OSDCommands')
+    @patch('srv.salt._modules.osd.OSDPartitions')
+    @patch('srv.salt._modules.osd.OSDConfig')
+    @patch('srv.salt._modules.osd.remove')
+    @patch('srv.salt._modules.osd.zero_weight')
+    @patch('srv.salt._modules.osd.CephPGs')
+    @patch('srv.salt._modules.osd.OSDRedeploy.candidates')
+    @patch('os.path.exists')
+    def test_run(self, exists, candidates, cephpgs, zero_weight, remove,
+                 config, partitions, commands, restore_weight, remove_destroyed):
+        exists.return_value = True
+        candidates.return_value = ['0', '1', '2']
+        remove.return_value = ""
+        osd.__grains__ = {'ceph': {'0': {'partitions': {'osd': '/dev/sda1'}},
+                                   '1': {'partitions': {'osd': '/dev/sdb1'}},
+                                   '2': {'partitions': {'osd': '/dev/sdc1'}}}}
+        osd.__salt__ = {'helper.run': MagicMock()}
+        osdr = osd.OSDRedeploy(concurrency=2)
+        osdr.disks = {'0': '/dev/sda', '1': '/dev/sdb', '2': '/dev/sdc'}
+        ret = osdr.run()
+        # one connection, one wait per batch
+        assert cephpgs.call_count == 1
+        assert cephpgs.return_value.quiescent.call_count == 2
+        # the second batch drains after the first is active
+        assert zero_weight.call_count == 3
+        assert ret['0']['batch'] == 0
+        assert ret['2']['batch'] == 1
+        assert ret['2']['drain'] >= ret['1']['activated']
+        for _id in ['0', '1', '2']:
+            assert 'activated' in ret[_id]
+
+    @patch('srv.salt._modules.osd.OSDPartitions')
+    @patch('srv.salt._modules.osd.OSDConfig')
+    @patch('srv.salt._modules.osd.remove')
+    @patch('srv.salt._modules.osd.CephPGs')
+    @patch('srv.salt._modules.osd.OSDRedeploy.candidates')
+    def test_run_remove_fails(self, candidates, cephpgs, remove, config, partitions):
+        candidates.return_value = ['0']
+        remove.return_value = "Failed to mark OSD 0 as destroyed"
+        osdr = osd.OSDRedeploy()
+        ret = osdr.run()
+        assert ret['0']['error'] == "Failed to mark OSD 0 as destroyed"
+        assert partitions.call_count == 0
+
+
+class TestOSDDeploy:
+
+    TYPES = {'osd': '4FBD7E29-9D25-41B8-AFD0-062C0CEFF05D',
+             'db': '30CD0809-C2B2-499C-8879-2D6B78529876'}
+
+    def test_pending_partitions(self):
+        osd.__salt__ = {'helper.run': MagicMock(return_value=(0, "", ""))}
+        config = MagicMock(types=self.TYPES)
+        pending = {}
+        osdp = osd.OSDPartitions(config, pending=pending)
+        osdp._part_probe = MagicMock()
+        with patch('srv.salt._modules.osd._find_paths', return_value=['/dev/sdg1']):
+            osdp.create('/dev/sdg', [('db', '1G')])
+            osdp.create('/dev/sdg', [('db', '1G')])
+        assert pending == {'/dev/sdg': [2, 3]}
+        osdp._part_probe.assert_not_called()
+        osd.__salt__['helper.run'].assert_called_with(
+            '/usr/sbin/sgdisk -n 3:0:+1G -t 3:30CD0809-C2B2-499C-8879-2D6B78529876 /dev/sdg')
+
+    def test_highest_partition_pending(self):
+        osd.__salt__ = {'helper.run': MagicMock(return_value=(0, "Partition GUID code: 30CD0809-C2B2-499C-8879-2D6B78529876", ""))}
+        osdc = osd.OSDCommands(MagicMock(types=self.TYPES), pending={'/dev/nvme0n1': [2]})
+        with patch('srv.salt._modules.osd._find_paths', return_value=['/dev/nvme0n1p1']):
+            assert osdc.highest_partition('/dev/nvme0n1', 'db') == 'p2'
+            assert osdc.is_partitioned('/dev/nvme0n1')
+
+    @pytest.fixture
+    def deploy(self):
+        osd.__salt__ = {'helper.run': MagicMock(return_value=(0, "", "")),
+                        'devlinks.invalidate': MagicMock()}
+        patches = [patch('srv.salt._modules.osd.configured', return_value=['/dev/sda', '/dev/sdb', '/dev/sdc']),
+                   patch('srv.salt._modules.osd.is_prepared', side_effect=lambda device: device == '/dev/sdc'),
+                   patch('srv.salt._modules.osd.DeviceSnapshot'),
+                   patch('srv.salt._modules.osd.OSDConfig'),
+                   patch('srv.salt._modules.osd.OSDPartitions'),
+                   patch('srv.salt._modules.osd.OSDCommands'),
+                   patch('srv.salt._modules.osd.OSDDestroyed'),
+                   patch('srv.salt._modules.osd.restore_weight')]
+        mocks = [item.start() for item in patches]
+        mocks[5].side_effect = lambda config, pending=None: MagicMock(
+            prepare=lambda osd_id: 'prepare {}'.format(osd_id), activate=lambda: 'activate', error=None)
+        mocks[6].return_value.get_many.return_value = {'/dev/sda': 3, '/dev/sdb': ""}
+        yield osd.OSDDeploy(concurrency=2), mocks
+        for item in patches:
+            item.stop()
+
+    def test_run(self, deploy):
+        osdd, mocks = deploy
+        results = osdd.run()
+        assert results == {'/dev/sda': {'partitioned': True, 'prepared': True,
+                                        'activated': True, 'osd_id': 3},
+                           '/dev/sdb': {'partitioned': True, 'prepared': True,
+                                        'activated': True}}
+        mocks[7].assert_called_once_with(3)
+        mocks[6].return_value.remove_many.assert_called_once_with(['/dev/sda', '/dev/sdb'])
+        osd.__salt__['helper.run'].assert_any_call('prepare 3')
+        osd.__salt__['helper.run'].assert_any_call('prepare ')
+
+    def test_run_settles_once(self, deploy):
+        osdd, mocks = deploy
+        osdp = MagicMock()
+
+        def partitions(config, pending=None):
+            if pending is not None:
+                pending.setdefault('/dev/sdg', []).append(len(pending.get('/dev/sdg', [])) + 1)
+            return osdp
+
+        mocks[4].side_effect = partitions
+        osdd.run()
+        assert osdd.pending == {'/dev/sdg': [1, 2]}
+        osd.__salt__['devlinks.invalidate'].assert_called_once_with()
+        osdp._part_probe.assert_called_once_with('/dev/sdg')
+        assert osdp.wipe.call_count == 2
+
+    def test_run_probe_failure(self, deploy):
+        osdd, mocks = deploy
+        osdp = MagicMock()
+
+        def probe(device):
+            if device != '/dev/sdb':
+                raise RuntimeError('partprobe {} failed'.format(device))
+
+        def partitions(config, pending=None):
+            if pending is not None:
+                pending.setdefault(config, []).append(1)
+            return osdp
+
+        osdp._part_probe.side_effect = probe
+        mocks[3].side_effect = lambda device, snapshot=None: device
+        mocks[4].side_effect = partitions
+        results = osdd.run()
+        assert results['/dev/sda'] == {'partitioned': True, 'prepared': False,
+                                       'activated': False, 'osd_id': 3,
+                                       'error': 'partprobe /dev/sda failed'}
+        assert results['/dev/sdb']['activated']
+        osdp.wipe.assert_called_once_with('/dev/sdb', 1)
+        mocks[6].return_value.remove_many.assert_called_once_with(['/dev/sdb'])
+
+    def test_run_errors(self, deploy):
+        osdd, mocks = deploy
+        mocks[4].return_value.partition.side_effect = [RuntimeError('sgdisk failed'), 0]
+        osd.__salt__['helper.run'].return_value = (1, "", "no space")
+        results = osdd.run()
+        assert results['/dev/sda'] == {'partitioned': False, 'prepared': False,
+                                       'activated': False, 'osd_id': 3,
+                                       'error': 'sgdisk failed'}
+        assert results['/dev/sdb']['error'] == 'prepare failed: no space'
+        mocks[6].return_value.remove_many.assert_called_once_with([])
+
+    def test_run_nothing(self, deploy):
+        osdd, mocks = deploy
+        with patch('srv.salt._modules.osd.configured', return_value=[]):
+            assert osdd.run() == {}
+
+
+class TestOSDBench:
+
+    @pytest.fixture()
+    def bench(self):
+        with patch.object(osd.OSDBench, "__init__", lambda self: None):
+            bench = osd.OSDBench()
+            bench.settings = {'timeout': 1}
+            bench.per_host = 1
+            bench.concurrency = 4
+            bench.cluster = MagicMock()
+            yield bench
+
+    def test_locations(self, bench):
+        tree = {'nodes': [{'type': 'root', 'name': 'default', 'id': -1, 'children': [-2, -3]},
+                          {'type': 'host', 'name': 'data1', 'id': -2, 'children': [0, 1]},
+                          {'type': 'host', 'name': 'data2', 'id': -3, 'children': [2]},
+                          {'type': 'osd', 'id': 0, 'device_class': 'hdd'},
+                          {'type': 'osd', 'id': 1, 'device_class': 'ssd'},
+                          {'type': 'osd', 'id': 2, 'device_class': 'hdd'},
+                          {'type': 'osd', 'id': 3}]}
+        bench.cluster.mon_command.return_value = (0, json.dumps(tree), '')
+        assert bench.locations() == {0: {'host': 'data1', 'class': 'hdd'},
+                                     1: {'host': 'data1', 'class': 'ssd'},
+                                     2: {'host': 'data2', 'class': 'hdd'},
+                                     3: {'host': None, 'class': None}}
+
+    def test_order(self):
+        hosts = {0: 'data1', 1: 'data1', 2: 'data1', 3: 'data2', 4: 'data3'}
+        assert osd.OSDBench.order([0, 1, 2, 3, 4], hosts) == [0, 3, 4, 1, 2]
+
+    def test_run(self, bench):
+        hosts = {0: 'data1', 1: 'data1', 2: 'data2', 3: 'data2'}
+        active = {'data1': 0, 'data2': 0, 'max': 0}
+        lock = threading.Lock()
+
+        def osd_command(_id, cmd, inbuf, timeout=0):
+            host = hosts[_id]
+            with lock:
+                active[host] += 1
+                active['max'] = max(active['max'], active[host])
+            time.sleep(0.01)
+            with lock:
+                active[host] -= 1
+            if _id == 3:
+                return (-5, '', 'error')
+            return (0, json.dumps({'bytes_per_sec': 100.0 * (_id + 1)}), '')
+
+        bench.cluster.osd_command.side_effect = osd_command
+        locations = {_id: {'host': host, 'class': 'hdd'} for _id, host in hosts.items()}
+        with patch.object(osd.OSDBench, "locations", return_value=locations):
+            ret = bench.run()
+        assert {_id: ret[_id]['bytes_per_sec'] for _id in ret} == \
+            {'0': 100.0, '1': 200.0, '2': 300.0, '3': None}
+        assert ret['2']['host'] == 'data2'
+        assert ret['2']['class'] == 'hdd'
+        assert active['max'] == 1
+        # the handle is shared through the broker
+        assert not bench.cluster.shutdown.called
+
+    def test_run_ids(self, bench):
+        bench.cluster.osd_command.return_value = (0, json.dumps({'bytes_per_sec': 5.0}), '')
+        with patch.object(osd.OSDBench, "locations", return_value={0: {'host': 'a'},
+                                                                   1: {'host': 'a'}}):
+            assert bench.run(ids=['1']) == {'1': {'bytes_per_sec': 5.0,
+                                                  'host': 'a', 'class': None}}
+
+
+class TestPollDelay:
+
+    def test_sleep_wakes_on_event(self):
+        cluster = MagicMock()
+        delay = osd.PollDelay(60, minimum=30, cluster=cluster)
+        delay.event.set()
+        delay.sleep()
+        assert delay.waited < 30
+        assert delay.current == 60
+
+    def test_no_monitor_log(self):
+        cluster = MagicMock()
+        cluster.monitor_log.side_effect = AttributeError
+        delay = osd.PollDelay(12, cluster=cluster)
+        assert delay.cluster is None
+
+    def test_reset(self):
+        delay = osd.PollDelay(12)
+        delay.waited = 10
+        delay.reset()
+        assert delay.waited == 0
+
 class Test_report():
 
     fs = fake_fs.FakeFilesystem()
@@ -3942,3 +4216,71 @@ class Test_report():
         assert unconfigured == []
         assert changed == ["/dev/sda"]
 
+
+class TestDeviceSnapshot():
+    """
+    A class for checking the snapshot used by osd.report
+    """
+
+    @pytest.fixture
+    def snapshot(self, tmpdir):
+        tmpdir.join('sdb').write('')
+        tmpdir.join('sdc1').write('')
+        tmpdir.mkdir('disk').mkdir('by-id')
+        tmpdir.join('disk', 'by-id', 'wwn-1').mksymlinkto(tmpdir.join('sdb'))
+        tmpdir.join('disk', 'by-id', 'wwn-2').mksymlinkto(tmpdir.join('sdc1'))
+        tmpdir.join('mounts').write("{0}/sdb1 /var/lib/ceph/osd/ceph-1 xfs rw 0 0\n"
+                                    "{0}/sdb /var/lib/ceph/osd/ceph-2 xfs rw 0 0\n"
+                                    .format(tmpdir))
+        tmpdir.mkdir('block').mkdir('sdc1').join('size').write('2048\n')
+        return osd.DeviceSnapshot(mounts=str(tmpdir.join('mounts')),
+                                  disk_dir=str(tmpdir.join('disk')),
+                                  sysfs=str(tmpdir.join('block')))
+
+    def test_links(self, snapshot, tmpdir):
+        assert snapshot.readlink(str(tmpdir.join('disk', 'by-id', 'wwn-1'))) == str(tmpdir.join('sdb'))
+        assert len(snapshot.links) == 2
+
+    def test_readlink_not_indexed(self, snapshot, tmpdir):
+        assert snapshot.readlink(str(tmpdir.join('sdb'))) == str(tmpdir.join('sdb'))
+
+    def test_mountpoint(self, snapshot, tmpdir):
+        assert snapshot.mountpoint(str(tmpdir.join('sdb'))) == '/var/lib/ceph/osd/ceph-1'
+        assert snapshot.mountpoint('/dev/sdz') is None
+
+    def test_size(self, snapshot, tmpdir):
+        assert snapshot.size(str(tmpdir.join('sdc1'))) == 1048576
+        assert snapshot.size('/dev/sdz') is None
+
+    def test_memo(self, snapshot):
+        func = MagicMock(return_value=1)
+        assert snapshot.memo('key', func) == 1
+        assert snapshot.memo('key', func) == 1
+        func.assert_called_once()
+
+    def test_check_device_without_forks(self, snapshot, tmpdir):
+        osd.__salt__ = {'helper.run': MagicMock()}
+        pathname = tmpdir.mkdir('ceph-3')
+        pathname.join('block.db').mksymlinkto(tmpdir.join('disk', 'by-id', 'wwn-2'))
+        config = MagicMock(snapshot=snapshot)
+        osdc = osd.OSDCommands(config)
+        assert osdc._check_device(str(pathname), 'block.db',
+                                  str(tmpdir.join('sdc')), '1M') is None
+        assert osdc._check_device(str(pathname), 'block.db',
+                                  str(tmpdir.join('sdc')), '2M') is True
+        osd.__salt__['helper.run'].assert_not_called()
+
+    @patch('srv.salt._modules.osd.readlink')
+    def test_config_uses_snapshot(self, readlink, snapshot, tmpdir):
+        osd.__grains__ = {'id': 'data1'}
+        osd.__pillar__ = {'ceph': {'storage': {'osds': {str(tmpdir.join('disk', 'by-id', 'wwn-1')): {}}}}}
+        mine = MagicMock(return_value={'data1': [{'Device File': str(tmpdir.join('sdb')),
+                                                  'Bytes': 20000000000,
+                                                  'Capacity': '20G'}]})
+        osd.__salt__ = {'mine.get': mine}
+        config = osd.OSDConfig(str(tmpdir.join('sdb')), snapshot=snapshot)
+        osd.OSDConfig(str(tmpdir.join('sdb')), snapshot=snapshot)
+        assert config.device == str(tmpdir.join('sdb'))
+        assert config.disk_format == 'bluestore'
+        assert mine.call_count == 1
+        readlink.assert_not_called()
@@ -0,0 +1,146 @@
+import pytest
+import sys
+sys.path.insert(0, 'srv/salt/_modules')
+from srv.salt._modules import rados_broker
+from mock import MagicMock, patch
+
+
+class TestBroker(object):
+    """
+    Unittests for the rados connection broker
+    """
+
+    @pytest.fixture()
+    def rados(self):
+        rados = MagicMock()
+        rados.Rados.side_effect = lambda **kwargs: MagicMock(state='connected')
+        with patch.object(rados_broker, 'rados', rados, create=True):
+            yield rados
+
+    def test_shared(self, rados):
+        broker = rados_broker.Broker()
+        first = broker.get('/etc/ceph/ceph.conf', 'client.admin', 'keyring')
+        second = broker.get('/etc/ceph/ceph.conf', 'client.admin', 'keyring')
+        assert first.cluster is second.cluster
+        assert broker.handles[('/etc/ceph/ceph.conf', 'client.admin', 'keyring')]['leases'] == 2
+        assert rados.Rados.call_count == 1
+        assert first.connect.call_count == 1
+        rados.Rados.assert_called_with(conffile='/etc/ceph/ceph.conf',
+                                       conf={'keyring': 'keyring'}, name='client.admin')
+
+    def test_keyed(self, rados):
+        broker = rados_broker.Broker()
+        first = broker.get('/etc/ceph/ceph.conf')
+        second = broker.get('/etc/ceph/ceph.conf', 'client.storage', 'keyring')
+        assert first.cluster is not second.cluster
+        rados.Rados.assert_any_call(conffile='/etc/ceph/ceph.conf')
+
+    def test_reconnect_unhealthy(self, rados):
+        broker = rados_broker.Broker()
+        first = broker.get()
+        first.cluster.state = 'shutdown'
+        second = broker.get()
+        assert first.cluster is not second.cluster
+        assert first.shutdown.called
+
+    def test_reconnect_fsid_fails(self, rados):
+        broker = rados_broker.Broker()
+        first = broker.get()
+        first.get_fsid.side_effect = Exception('not connected')
+        assert broker.get().cluster is not first.cluster
+
+    def test_connect_fails(self, rados):
+        rados.Rados.side_effect = None
+        rados.Rados.return_value.connect.side_effect = Exception('timed out')
+        broker = rados_broker.Broker()
+        with pytest.raises(RuntimeError):
+            broker.get()
+        assert broker.handles == {}
+
+    @patch('srv.salt._modules.rados_broker.time')
+    def test_reap_idle(self, mocktime, rados):
+        broker = rados_broker.Broker(idle=300)
+        mocktime.time.return_value = 100
+        first = broker.get()
+        first.release()
+        mocktime.time.return_value = 500
+        second = broker.get()
+        assert first.cluster is not second.cluster
+        assert first.shutdown.called
+
+    @patch('srv.salt._modules.rados_broker.time')
+    def test_reap_skips_leased(self, mocktime, rados):
+        broker = rados_broker.Broker(idle=300)
+        mocktime.time.return_value = 100
+        held = broker.get()
+        mocktime.time.return_value = 500
+        other = broker.get()
+        other.release()
+        assert held.cluster is other.cluster
+        assert not held.shutdown.called
+        held.release()
+        mocktime.time.return_value = 900
+        broker.reap()
+        assert held.shutdown.called
+
+    def test_release_on_garbage_collection(self, rados):
+        broker = rados_broker.Broker()
+        with broker.get():
+            lease = broker.get()
+            assert broker.handles[('/etc/ceph/ceph.conf', None, None)]['leases'] == 2
+            del lease
+        assert broker.handles[('/etc/ceph/ceph.conf', None, None)]['leases'] == 0
+
+    def test_lease_delegates(self, rados):
+        broker = rados_broker.Broker()
+        lease = broker.get()
+        lease.mon_command('cmd', b'')
+        lease.cluster.mon_command.assert_called_with('cmd', b'')
+
+    def test_invalidate(self, rados):
+        broker = rados_broker.Broker()
+        first = broker.get()
+        broker.invalidate(first)
+        assert broker.handles == {}
+        assert first.shutdown.called
+
+    def test_close(self, rados):
+        broker = rados_broker.Broker()
+        handle = broker.get()
+        broker.close()
+        assert handle.shutdown.called
+        assert broker.handles == {}
+
+
+class TestMonCommand(object):
+
+    @pytest.fixture()
+    def broker(self):
+        broker = rados_broker.Broker()
+        with patch.object(rados_broker, '_BROKER', broker):
+            yield broker
+
+    def test_mon_command(self, broker):
+        cluster = MagicMock(state='connected')
+        cluster.mon_command.return_value = (0, '{}', '')
+        with patch.object(broker, '_connect', return_value=cluster) as connect:
+            assert rados_broker.mon_command('cmd') == (0, '{}', '')
+            assert rados_broker.mon_command('cmd') == (0, '{}', '')
+        assert connect.call_count == 1
+        assert len(rados_broker.handles()) == 1
+
+    def test_mon_command_retry(self, broker):
+        failing = MagicMock(state='connected')
+        failing.mon_command.side_effect = Exception('connection reset')
+        working = MagicMock(state='connected')
+        working.mon_command.return_value = (0, '{}', '')
+        with patch.object(broker, '_connect', side_effect=[failing, working]):
+            assert rados_broker.mon_command('cmd') == (0, '{}', '')
+        assert failing.shutdown.called
+
+    def test_mon_command_fails(self, broker):
+        failing = MagicMock(state='connected')
+        failing.mon_command.side_effect = Exception('connection reset')
+        with patch.object(broker, '_connect', return_value=failing):
+            with pytest.raises(Exception):
+                rados_broker.mon_command('cmd')
@@ -12,7 +12,8 @@ class TestHealthStatusCheck(object):
     """ Unittests for HealthStatusCheck """
     @pytest.fixture()
     def wait(self):
-        wait.rados = MagicMock()
+        wait.__salt__ = {'rados_broker.connect': MagicMock(),
+                         'rados_broker.mon_command': MagicMock()}
         yield wait
 
     @mock.patch('srv.salt._modules.wait.time')
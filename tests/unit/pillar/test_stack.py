@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# vim: ts=8 et sw=4 sts=4
+
+import sys
+sys.path.insert(0, 'srv/modules/pillar')
+import os
+import pytest
+import stack
+
+
+class TestRender():
+
+    @pytest.fixture()
+    def basedir(self, tmpdir):
+        stack.__opts__ = {}
+        stack.__salt__ = {}
+        stack.__grains__ = {'os': 'SUSE'}
+        stack._environments.clear()
+        stack._rendered.clear()
+        tmpdir.join('stack.cfg').write("static.yml\nminion.yml\n")
+        tmpdir.join('static.yml').write("cluster: ceph\nroles:\n  - mon\n")
+        tmpdir.join('minion.yml').write("id: {{ minion_id }}\n")
+        yield tmpdir
+
+    def test_render(self, basedir):
+        stats = {'templates': 0, 'hits': 0}
+        ret = stack._process_stack_cfg(str(basedir.join('stack.cfg')), {},
+                                       'data1', {}, stats)
+        assert ret == {'cluster': 'ceph', 'roles': ['mon'], 'id': 'data1'}
+        assert stats == {'templates': 3, 'hits': 0}
+
+    def test_static_templates_cached(self, basedir):
+        cfg = str(basedir.join('stack.cfg'))
+        stack._process_stack_cfg(cfg, {}, 'data1', {})
+        stats = {'templates': 0, 'hits': 0}
+        ret = stack._process_stack_cfg(cfg, {}, 'data2', {}, stats)
+        assert ret == {'cluster': 'ceph', 'roles': ['mon'], 'id': 'data2'}
+        assert stats == {'templates': 3, 'hits': 2}
+
+    def test_cached_copy_not_shared(self, basedir):
+        cfg = str(basedir.join('stack.cfg'))
+        first = stack._process_stack_cfg(cfg, {}, 'data1', {})
+        first['roles'].append('osd')
+        second = stack._process_stack_cfg(cfg, {}, 'data2', {})
+        assert second['roles'] == ['mon']
+
+    def test_changed_file(self, basedir):
+        cfg = str(basedir.join('stack.cfg'))
+        stack._process_stack_cfg(cfg, {}, 'data1', {})
+        static = basedir.join('static.yml')
+        static.write("cluster: other\n")
+        mtime = os.path.getmtime(str(static)) + 10
+        os.utime(str(static), (mtime, mtime))
+        ret = stack._process_stack_cfg(cfg, {}, 'data1', {})
+        assert ret['cluster'] == 'other'
+
+    def test_dynamic_template(self, basedir):
+        basedir.join('static.yml').write("os: {{ __grains__['os'] }}\n")
+        cfg = str(basedir.join('stack.cfg'))
+        stack._process_stack_cfg(cfg, {}, 'data1', {})
+        stack.__grains__ = {'os': 'Debian'}
+        stats = {'templates': 0, 'hits': 0}
+        ret = stack._process_stack_cfg(cfg, {}, 'data2', {}, stats)
+        assert ret['os'] == 'Debian'
+        assert stats['hits'] == 1
+
+    def test_include_is_dynamic(self, basedir):
+        basedir.join('static.yml').write("{% include 'minion.yml' %}\n")
+        cfg = str(basedir.join('stack.cfg'))
+        stack._process_stack_cfg(cfg, {}, 'data1', {})
+        ret = stack._process_stack_cfg(cfg, {}, 'data2', {})
+        assert ret == {'id': 'data2'}
+
+    def test_missing_template(self, basedir):
+        basedir.join('stack.cfg').write("missing.yml\nstatic.yml\n")
+        ret = stack._process_stack_cfg(str(basedir.join('stack.cfg')), {},
+                                       'data1', {})
+        assert ret == {'cluster': 'ceph', 'roles': ['mon']}
+
+
+class TestMerge():
+
+    @pytest.fixture()
+    def users(self):
+        yield {'users': {'tom': {'uid': 500, 'roles': ['sysadmin']},
+                         'root': {'uid': 0}}}
+
+    def test_merge_last(self, users):
+        obj = {'users': {'tom': {'uid': 1000, 'roles': ['developer']},
+                         'mat': {'uid': 1001}}}
+        ret = stack._merge_dict(users, obj)
+        assert ret == {'users': {'tom': {'uid': 1000,
+                                         'roles': ['sysadmin', 'developer']},
+                                 'mat': {'uid': 1001},
+                                 'root': {'uid': 0}}}
+
+    def test_merge_first(self, users):
+        obj = {'users': {'__': 'merge-first',
+                         'tom': {'uid': 1000, 'roles': ['developer']},
+                         'mat': {'uid': 1001}}}
+        ret = stack._merge_dict(users, obj)
+        assert ret == {'users': {'tom': {'uid': 500,
+                                         'roles': ['developer', 'sysadmin']},
+                                 'mat': {'uid': 1001},
+                                 'root': {'uid': 0}}}
+
+    def test_merge_first_cleans_new_values(self):
+        obj = {'a': {'__': 'merge-first',
+                     'b': {'__': 'overwrite', 'c': 1}}}
+        ret = stack._merge_dict({'a': {'b': {'d': 2}}}, obj)
+        assert ret == {'a': {'b': {'c': 1, 'd': 2}}}
+
+    def test_remove_dict(self, users):
+        obj = {'users': {'__': 'remove', 'tom': None, 'mat': None}}
+        ret = stack._merge_dict(users, obj)
+        assert ret == {'users': {'root': {'uid': 0}}}
+
+    def test_overwrite_dict(self, users):
+        obj = {'users': {'__': 'overwrite', 'mat': {'uid': 1001}}}
+        ret = stack._merge_dict(users, obj)
+        assert ret == {'users': {'mat': {'uid': 1001}}}
+
+    def test_remove_list(self):
+        ret = stack._merge_list(['tom', 'root', 1, True],
+                                [{'__': 'remove'}, 'mat', 'tom', 1])
+        assert ret == ['root']
+
+    def test_remove_list_unhashable(self):
+        ret = stack._merge_list([{'a': 1}, ['b'], 'c', {'d': 2}],
+                                [{'__': 'remove'}, {'a': 1}, ['b']])
+        assert ret == ['c', {'d': 2}]
+
+    def test_unknown_strategy(self):
+        with pytest.raises(Exception):
+            stack._merge_list([], [{'__': 'unknown'}])
@@ -0,0 +1,180 @@
+import gzip
+import json
+import pytest
+from mock import patch, MagicMock
+from srv.modules.runners import benchmark
+from srv.modules.utils import outliers
+from srv.modules.utils import benchstore
+
+
+class TestRunningStats():
+
+    def test_mean_stddev(self):
+        stats = benchmark.RunningStats()
+        for value in [2, 4, 4, 4, 5, 5, 7, 9]:
+            stats.add(value)
+        assert stats.count == 8
+        assert stats.mean == 5.0
+        assert stats.stddev == pytest.approx(2.138, abs=0.001)
+
+    def test_single(self):
+        stats = benchmark.RunningStats()
+        stats.add(3)
+        assert stats.stddev == 0.0
+
+
+class TestBaseline():
+
+    @pytest.fixture()
+    def jobs(self, tmpdir):
+        jobs = MagicMock()
+        jobs.__enter__.return_value = jobs
+        benchmark.__utils__ = {'collector.collector': MagicMock(return_value=jobs),
+                               'outliers.analyze': outliers.analyze,
+                               'benchstore.store': benchstore.store,
+                               'benchstore.record': benchstore.record}
+        benchmark.__opts__ = {'cachedir': str(tmpdir)}
+        with patch.object(benchmark, 'local_client') as local_client:
+            local_client.cmd.return_value = {'admin': 'admin'}
+            yield jobs
+        del benchmark.__utils__
+        del benchmark.__opts__
+
+    @patch('srv.modules.runners.benchmark.__print_outliers')
+    def test_baseline(self, print_outliers, jobs):
+        ret = {'0': 100.0, '1': 300.0, '10': 200.0, '2': None}
+        ret = {_id: {'bytes_per_sec': bps, 'host': 'data{}'.format(int(_id) % 2),
+                     'class': 'hdd'} for _id, bps in ret.items()}
+        jobs.iter_returns.return_value = [('1', 'admin', ret)]
+        result = benchmark.baseline(per_host=2, concurrency=8)
+        assert result['median'] == 200.0
+        assert result['failed'] == ['2']
+        assert result['stddev'] == 100.0
+        assert sorted(result['groups']['host']) == ['data0', 'data1']
+        assert result['groups']['class']['hdd']['count'] == 3
+        assert jobs.publish.call_args[0][1:] == ('admin', 'osd.bench')
+        assert jobs.publish.call_args[1] == {'kwarg': {'per_host': 2, 'concurrency': 8}}
+        dev_percent, perf_abs, ids, margin = print_outliers.call_args[0]
+        assert ids == ['0', '1', '10']
+        assert perf_abs == [100.0, 300.0, 200.0]
+        assert dev_percent == [-50.0, 50.0, 0.0]
+        runs = benchmark.history()
+        assert len(runs) == 1
+        store = benchstore.store(benchmark.__opts__)
+        assert store.values(runs[0]['id'])['1'] == {'bytes_per_sec': 300.0}
+        store.close()
+
+    @patch('srv.modules.runners.benchmark.__print_outliers')
+    def test_compare(self, print_outliers, jobs):
+        for bps in [100.0, 50.0]:
+            ret = {'0': {'bytes_per_sec': bps, 'host': 'data', 'class': 'hdd'},
+                   '1': {'bytes_per_sec': 100.0, 'host': 'data', 'class': 'hdd'}}
+            jobs.iter_returns.return_value = [('1', 'admin', ret)]
+            benchmark.baseline()
+        ret = benchmark.compare()
+        assert list(ret['regressions']) == ['0']
+
+    def test_baseline_error(self, jobs):
+        jobs.iter_returns.return_value = [('1', 'admin', 'rados not found')]
+        with pytest.raises(Exception):
+            benchmark.baseline()
+
+
+class TestFio():
+
+    def test_results(self, tmpdir):
+        output = tmpdir.join('output.json')
+        output.write(json.dumps({'client_stats': [
+            {'jobname': 'rbd', 'hostname': '10.0.0.1',
+             'read': {'bw': 100, 'iops': 25, 'clat_ns': {'mean': 1000.0}},
+             'write': {'bw': 0, 'iops': 0, 'clat_ns': {'mean': 0.0}}},
+            {'jobname': 'All clients',
+             'read': {'bw': 100, 'iops': 25, 'clat_ns': {'mean': 1000.0}},
+             'write': {'bw': 0, 'iops': 0, 'clat_ns': {'mean': 0.0}}}]}))
+        fio = benchmark.Fio.__new__(benchmark.Fio)
+        results = fio._results(str(output))
+        assert sorted(results) == ['10.0.0.1', 'all']
+        assert results['all']['read_bw'] == 100
+        assert results['10.0.0.1']['read_lat_ns'] == 1000.0
+
+    def test_results_missing(self, tmpdir):
+        fio = benchmark.Fio.__new__(benchmark.Fio)
+        assert fio._results(str(tmpdir.join('output.json'))) == {}
+
+
+class TestLogHistogram():
+
+    def test_percentile(self):
+        histogram = benchmark.LogHistogram()
+        for value in range(1, 10001):
+            histogram.add(value)
+        assert histogram.percentile(50) == pytest.approx(5000, rel=0.01)
+        assert histogram.percentile(99) == pytest.approx(9900, rel=0.01)
+        assert len(histogram.buckets) < 1000
+
+    def test_zero_and_empty(self):
+        histogram = benchmark.LogHistogram()
+        assert histogram.percentile(50) is None
+        histogram.add(0)
+        assert histogram.percentile(50) == 0.0
+
+    def test_merge(self):
+        first, second = benchmark.LogHistogram(), benchmark.LogHistogram()
+        first.add(100, count=3)
+        second.add(1000)
+        first.merge(second)
+        assert first.count == 4
+        assert first.percentile(100) == pytest.approx(1000, rel=0.01)
+
+
+class TestFioLogs():
+
+    @pytest.fixture()
+    def logs(self, tmpdir):
+        tmpdir.join('output_bw.1.log.10.0.0.1').write(
+            "0, 100, 0, 4096\n500, 300, 0, 4096\n1000, 200, 1, 4096\n")
+        tmpdir.join('output_bw.1.log.10.0.0.2').write(
+            "0, 50, 0, 4096\n1500, 150, 0, 4096\n")
+        tmpdir.join('output_clat.1.log.10.0.0.1').write(
+            "".join("{}, {}, 0, 4096\n".format(idx, 1000 * (idx + 1)) for idx in range(100)))
+        with gzip.open(str(tmpdir.join('output_clat.1.log.10.0.0.2.gz')), 'wt') as handle:
+            handle.write("0, 100000, 0, 4096\n")
+        tmpdir.join('output_clat_hist.1.log.10.0.0.1').write("0, 0, 4096, 1, 2\n")
+        tmpdir.join('output.json').write("{}")
+        yield benchmark.FioLogs(str(tmpdir))
+
+    def test_files(self, logs):
+        files = [(kind, client) for _, kind, client in logs.files()]
+        assert files == [('bw', '10.0.0.1'), ('bw', '10.0.0.2'),
+                         ('clat', '10.0.0.1'), ('clat', '10.0.0.2')]
+
+    def test_ingest(self, logs):
+        logs.CHUNK = 16
+        summary = logs.ingest()
+        read = summary['10.0.0.1']['bw']['read']
+        assert read['count'] == 2
+        assert read['mean'] == 200.0
+        assert read['series'] == [[0, 200.0]]
+        assert summary['10.0.0.1']['bw']['write']['max'] == 200
+        assert summary['all']['bw']['read']['series'] == [[0, 250.0], [1000, 150.0]]
+        clat = summary['10.0.0.1']['clat']['read']['percentiles']
+        assert clat['p50'] == pytest.approx(50000, rel=0.02)
+        assert summary['all']['clat']['read']['count'] == 101
+        assert summary['all']['clat']['read']['percentiles']['p99.9'] == \
+            pytest.approx(100000, rel=0.01)
+
+    def test_compress(self, logs, tmpdir):
+        compressed = logs.compress()
+        assert len(compressed) == 4
+        assert not tmpdir.join('output_bw.1.log.10.0.0.1').exists()
+        assert tmpdir.join('output_clat_hist.1.log.10.0.0.1.gz').exists()
+        assert tmpdir.join('output.json').exists()
+        assert logs.ingest()['10.0.0.1']['bw']['read']['count'] == 2
+
+    def test_fio_ingest(self, logs, tmpdir):
+        fio = benchmark.Fio.__new__(benchmark.Fio)
+        fio.compress_logs = False
+        results = {}
+        fio._ingest(str(tmpdir), results)
+        assert 'read_clat_p99_ns' in results['10.0.0.1']
+        assert json.loads(tmpdir.join('summary.json').read())['all']
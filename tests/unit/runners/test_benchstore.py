@@ -0,0 +1,84 @@
+import pytest
+from srv.modules.utils import benchstore
+
+
+class TestBenchmarkStore():
+    """
+    A class for checking the benchmark result store
+    """
+
+    @pytest.fixture()
+    def store(self, tmpdir):
+        store = benchstore.store(filename=str(tmpdir.join('deepsea', 'benchmarks.db')))
+        yield store
+        store.close()
+
+    def test_default_path(self, tmpdir):
+        store = benchstore.store({'cachedir': str(tmpdir)})
+        assert store.filename == str(tmpdir.join('deepsea', 'benchmarks.db'))
+        store.close()
+
+    def test_record_helper(self, tmpdir):
+        run = benchstore.record({'cachedir': str(tmpdir)}, 'iperf', {'10.0.0.1': 900},
+                                clients=[u'10.0.0.1'], metric='mbits')
+        store = benchstore.store({'cachedir': str(tmpdir)})
+        assert store.values(run) == {'10.0.0.1': {'mbits': 900.0}}
+        assert store.runs('iperf', clients=u'10.0.0.1')[0]['id'] == run
+        store.close()
+
+    def test_record_helper_failure(self, tmpdir):
+        tmpdir.join('deepsea').write('')
+        assert benchstore.record({'cachedir': str(tmpdir)}, 'iperf', {'a': 1}) is None
+
+    def test_record(self, store):
+        run = store.record('osd_bench', {'0': 100.0, '1': None, '2': 'Failed'},
+                           metric='bytes_per_sec', timestamp=10)
+        assert store.values(run) == {'0': {'bytes_per_sec': 100.0}}
+        assert store.runs('osd_bench')[0]['timestamp'] == 10
+
+    def test_record_metrics(self, store):
+        run = store.record('rbd', {'all': {'read_bw': 10, 'read_lat_ns': 5}},
+                           job='4k', clients=['b', 'a'])
+        assert store.values(run) == {'all': {'read_bw': 10.0, 'read_lat_ns': 5.0}}
+        assert store.runs('rbd', job='4k', clients=['a', 'b'])[0]['clients'] == 'a,b'
+
+    def test_runs_order_limit(self, store):
+        for timestamp in [1, 3, 2]:
+            store.record('iperf', {'a': timestamp}, timestamp=timestamp)
+        runs = store.runs('iperf', limit=2)
+        assert [run['timestamp'] for run in runs] == [3, 2]
+        assert store.runs('iperf', cluster='other') == []
+
+    def test_compare(self, store):
+        for value in [100, 102, 98]:
+            store.record('osd_bench', {'0': value, '1': value})
+        store.record('osd_bench', {'0': 99, '1': 70})
+        ret = store.compare('osd_bench', runs=3)
+        assert len(ret['compared']) == 3
+        assert list(ret['regressions']) == ['1']
+        assert ret['regressions']['1']['value'] == {'value': 70.0, 'median': 100.0,
+                                                    'change': -30.0}
+
+    def test_compare_latency(self, store):
+        store.record('rbd', {'all': {'read_lat_ns': 100, 'read_bw': 100}}, job='4k')
+        store.record('rbd', {'all': {'read_lat_ns': 150, 'read_bw': 150}}, job='4k')
+        ret = store.compare('rbd', job='4k')
+        assert ret['regressions'] == {'all': {'read_lat_ns': {'value': 150.0,
+                                                              'median': 100.0,
+                                                              'change': 50.0}}}
+
+    def test_compare_same_clients_only(self, store):
+        store.record('iperf', {'a': 100}, clients=['a', 'b'])
+        store.record('iperf', {'a': 10}, clients=['a', 'c'])
+        assert store.compare('iperf')['compared'] == []
+
+    def test_compare_run(self, store):
+        first = store.record('iperf', {'a': 100})
+        second = store.record('iperf', {'a': 50})
+        store.record('iperf', {'a': 100})
+        ret = store.compare('iperf', run=second)
+        assert ret['compared'] == [first]
+        assert 'a' in ret['regressions']
+
+    def test_compare_empty(self, store):
+        assert store.compare('iperf') == {}
@@ -22,6 +22,42 @@ class TestCephProcesses():
         status = cephprocesses._status(search, roles, False)
         assert status['mon'] == result
 
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_status_batch(self, localclient):
+        local = localclient.return_value
+        local.cmd.return_value = {'mon1.ceph': {'mon': True, 'mgr': True},
+                                  'data1.ceph': {'storage': False}}
+
+        search = "I@cluster:ceph"
+        roles = ['mon', 'mgr', 'storage']
+
+        status = cephprocesses._status(search, roles, False, batch=True)
+        assert local.cmd.call_count == 1
+        assert status == {'mon': {'mon1.ceph': True},
+                          'mgr': {'mon1.ceph': True},
+                          'storage': {'data1.ceph': False}}
+
+    @patch('srv.modules.runners.cephprocesses._cached_role_map', autospec=True)
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_status_batch_failed_minion(self, localclient, rolemap):
+        local = localclient.return_value
+        local.cmd.return_value = {'mon1.ceph': {'mon': True},
+                                  'mon2.ceph': 'The minion function caused an exception'}
+        rolemap.return_value = {'mon': ['mon1.ceph', 'mon2.ceph']}
+
+        status = cephprocesses._status("I@cluster:ceph", ['mon', 'storage'], False, batch=True)
+        assert status == {'mon': {'mon1.ceph': True, 'mon2.ceph': False},
+                          'storage': {}}
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_status_timings(self, localclient):
+        local = localclient.return_value
+        local.cmd.return_value = {'mon1.ceph': True}
+
+        timings = {}
+        cephprocesses._status("I@cluster:ceph", ['mon', 'mgr'], False, timings=timings)
+        assert sorted(timings.keys()) == ['mgr', 'mon']
+
     @patch('srv.modules.runners.cephprocesses._status', autospec=True)
     @patch('srv.modules.runners.cephprocesses._cached_roles', autospec=True)
     def test_check(self, cachedroles, status):
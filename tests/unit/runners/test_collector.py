@@ -0,0 +1,68 @@
+import pytest
+from mock import patch, MagicMock
+from srv.modules.utils import collector
+
+
+def _ret(jid, minion, value):
+    return {'tag': 'salt/job/{}/ret/{}'.format(jid, minion),
+            'data': {'id': minion, 'return': value}}
+
+
+class TestCollector():
+    """
+    A class for checking the event based job collector
+    """
+
+    @pytest.fixture()
+    def event(self):
+        with patch('salt.utils.event.get_master_event') as get_master_event:
+            event = MagicMock()
+            get_master_event.return_value = event
+            yield event
+
+    def test_collect(self, event):
+        event.get_event.side_effect = [
+            {'tag': 'salt/job/1/new', 'data': {'minions': ['m1', 'm2']}},
+            _ret('1', 'm1', 'a'),
+            None,
+            {'tag': 'salt/job/2/new', 'data': {'minions': ['m1']}},
+            _ret('2', 'm1', 'c'),
+            _ret('1', 'm2', 'b')]
+        with collector.collector({'sock_dir': '/tmp'}) as jobs:
+            jobs.add('1')
+            jobs.add('2')
+            assert jobs.collect() == {'1': {'m1': 'a', 'm2': 'b'},
+                                      '2': {'m1': 'c'}}
+        assert event.destroy.called
+
+    def test_expected_minions(self, event):
+        event.get_event.side_effect = [_ret('1', 'm1', 'a')]
+        jobs = collector.collector({'sock_dir': '/tmp'})
+        jobs.add('1', ['m1'])
+        assert list(jobs.iter_returns()) == [('1', 'm1', 'a')]
+
+    def test_ignores_other_jobs(self, event):
+        event.get_event.side_effect = [_ret('9', 'm1', 'x'),
+                                       {'tag': 'salt/job/1/ret', 'data': {}},
+                                       _ret('1', 'm1', 'a')]
+        jobs = collector.collector({'sock_dir': '/tmp'})
+        jobs.add('1', ['m1'])
+        jobs.add(0)
+        assert jobs.collect() == {'1': {'m1': 'a'}}
+
+    @patch.object(collector, 'time')
+    def test_timeout(self, mocktime, event):
+        mocktime.time.side_effect = [100, 101, 200]
+        event.get_event.side_effect = [_ret('1', 'm1', 'a'), None]
+        jobs = collector.collector({'sock_dir': '/tmp'}, timeout=60)
+        jobs.add('1', ['m1', 'm2'])
+        assert jobs.collect() == {'1': {'m1': 'a'}}
+        assert jobs.missing() == {'1': ['m2']}
+
+    def test_publish(self, event):
+        local = MagicMock()
+        local.run_job.return_value = {'jid': '5', 'minions': ['m1']}
+        event.get_event.side_effect = [_ret('5', 'm1', True)]
+        jobs = collector.collector({'sock_dir': '/tmp'})
+        assert jobs.publish(local, 'm1', 'test.ping', tgt_type='list') == '5'
+        assert jobs.collect() == {'5': {'m1': True}}
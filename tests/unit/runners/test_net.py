@@ -0,0 +1,93 @@
+import pytest
+from itertools import combinations
+from mock import patch
+from srv.modules.runners import net
+
+
+class TestTournament():
+    """
+    A class for checking the iperf schedule
+    """
+
+    @pytest.mark.parametrize("count", [2, 5, 8])
+    def test_full_mesh(self, count):
+        addresses = ['10.0.0.{}'.format(idx) for idx in range(count)]
+        schedule = net._tournament(addresses)
+        pairs = [frozenset(pair) for rnd in schedule for pair in rnd]
+        assert len(pairs) == len(set(pairs))
+        assert set(pairs) == set(frozenset(pair) for pair in combinations(addresses, 2))
+
+    @pytest.mark.parametrize("count", [4, 7])
+    def test_disjoint_rounds(self, count):
+        addresses = ['10.0.0.{}'.format(idx) for idx in range(count)]
+        for rnd in net._tournament(addresses):
+            busy = [address for pair in rnd for address in pair]
+            assert len(busy) == len(set(busy))
+            assert len(rnd) == count // 2
+
+    def test_rounds(self):
+        addresses = ['10.0.0.{}'.format(idx) for idx in range(6)]
+        assert len(net._tournament(addresses, rounds=2)) == 2
+
+    def test_single(self):
+        assert net._tournament(['10.0.0.1']) == []
+
+
+class FakeCollector(object):
+    """
+    Return the iperf result for jids formatted as client-server
+    """
+    instances = []
+
+    def __init__(self, opts, timeout=60):
+        self.jobs = {}
+        FakeCollector.instances.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def add(self, jid, minions=None):
+        self.jobs[jid] = minions
+
+    def collect(self):
+        results = {}
+        for jid in self.jobs:
+            client, server = jid.split('-')
+            results[jid] = {client: {'server': server, 'succeeded': True,
+                                     'failed': False, 'errored': False,
+                                     'filter': '{} Mbits/sec'.format(len(client) * 100)}}
+        return results
+
+
+class TestCreateClient():
+    """
+    A class for checking the iperf clients
+    """
+
+    @pytest.fixture()
+    def local(self):
+        FakeCollector.instances = []
+        net.__utils__ = {'collector.collector': FakeCollector}
+        net.__opts__ = {}
+        with patch('salt.client.LocalClient', autospec=True) as localclient:
+            local = localclient.return_value
+            local.cmd_async.side_effect = lambda tgt, fun, arg, **kwargs: \
+                "{}-{}".format(tgt[2:], arg[0])
+            yield local
+        del net.__utils__
+        del net.__opts__
+
+    def test_create_client(self, local):
+        result = net._create_client(['a', 'bb', 'ccc'])
+        assert local.cmd_async.call_count == 6
+        ports = [call[0][2][2] for call in local.cmd_async.call_args_list]
+        assert set(ports) == set([5200, 5201, 5202])
+        assert result == {'a': 250, 'bb': 200, 'ccc': 150}
+
+    def test_create_client_concurrency(self, local):
+        net._create_client(['a', 'b', 'c', 'd'], concurrency=1)
+        assert len(FakeCollector.instances) == 6
+        assert all(len(jobs.jobs) == 2 for jobs in FakeCollector.instances)
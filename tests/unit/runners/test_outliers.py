@@ -0,0 +1,58 @@
+import pytest
+from srv.modules.utils import outliers
+
+
+class TestOutliers():
+    """
+    A class for checking the benchmark statistics
+    """
+
+    def test_percentile(self):
+        ordered = [1.0, 2.0, 3.0, 4.0, 5.0]
+        assert outliers.percentile(ordered, 50) == 3.0
+        assert outliers.percentile(ordered, 25) == 2.0
+        assert outliers.percentile(ordered, 5) == pytest.approx(1.2)
+        assert outliers.percentile([], 50) is None
+
+    def test_summarize(self):
+        summary = outliers.summarize([1, 2, 3, 4, 100])
+        assert summary['count'] == 5
+        assert summary['median'] == 3
+        assert summary['mad'] == 1
+        assert summary['mean'] == 22
+        assert summary['percentiles']['p95'] == pytest.approx(80.8)
+
+    def test_summarize_empty(self):
+        assert outliers.summarize([]) == {'count': 0}
+
+    def test_analyze(self):
+        values = {'0': 100, '1': 101, '2': 99, '3': 100, '4': 20, '5': 'Failed'}
+        result = outliers.analyze(values)
+        assert list(result['outliers']) == ['4']
+        assert result['outliers']['4']['score'] < 0
+        assert result['failed'] == ['5']
+
+    def test_analyze_identical(self):
+        result = outliers.analyze({'0': 5, '1': 5, '2': 5})
+        assert result['outliers'] == {}
+        assert result['mad'] == 0
+
+    def test_analyze_mad_zero(self):
+        result = outliers.analyze({'0': 5, '1': 5, '2': 5, '3': 5, '4': 5, '5': 50})
+        assert list(result['outliers']) == ['5']
+
+    def test_analyze_groups(self):
+        values = {'0': 100, '1': 102, '2': 98, '3': 101,
+                  '4': 500, '5': 510, '6': 490, '7': 100}
+        classes = {'0': 'hdd', '1': 'hdd', '2': 'hdd', '3': 'hdd',
+                   '4': 'ssd', '5': 'ssd', '6': 'ssd', '7': 'ssd'}
+        result = outliers.analyze(values, groups={'class': classes})
+        assert sorted(result['groups']['class']) == ['hdd', 'ssd']
+        assert result['groups']['class']['hdd']['outliers'] == {}
+        assert list(result['groups']['class']['ssd']['outliers']) == ['7']
+        assert result['groups']['class']['ssd']['percentiles']['p50'] == 495
+
+    def test_analyze_no_numbers(self):
+        result = outliers.analyze({'a': 'Failed to connect'})
+        assert result['count'] == 0
+        assert result['failed'] == ['a']
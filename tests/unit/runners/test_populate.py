@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# vim: ts=8 et sw=4 sts=4
+
+import ipaddress
+import pytest
+from mock import patch
+from srv.modules.runners import populate
+from srv.modules.utils import subnets
+
+
+class TestDiscoveryCache():
+
+    @pytest.fixture()
+    def filename(self, tmpdir):
+        populate.__opts__ = {}
+        yield str(tmpdir.join('deepsea', 'discovery.json'))
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_query_all(self, localclient, filename):
+        local = localclient.return_value
+        local.cmd.side_effect = [{'data1': 'a', 'data2': 'b'},
+                                 {'data1': 'eth0', 'data2': 'eth1'}]
+        cache = populate.DiscoveryCache('*', filename)
+        assert cache.changed == set(['data1', 'data2'])
+        ret = cache.query('network.interfaces', [])
+        assert ret == {'data1': 'eth0', 'data2': 'eth1'}
+        assert local.cmd.call_args[0] == (['data1', 'data2'], 'network.interfaces', [])
+        cache.save()
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_query_changed(self, localclient, filename):
+        local = localclient.return_value
+        local.cmd.side_effect = [{'data1': 'a', 'data2': 'b'},
+                                 {'data1': 'eth0', 'data2': 'eth1'},
+                                 {'data1': 'a', 'data2': 'c', 'data3': 'd'},
+                                 {'data2': 'eth2', 'data3': 'eth3'}]
+        cache = populate.DiscoveryCache('*', filename)
+        cache.query('network.interfaces', [])
+        cache.save()
+
+        cache = populate.DiscoveryCache('*', filename)
+        assert cache.changed == set(['data2', 'data3'])
+        ret = cache.query('network.interfaces', [])
+        assert ret == {'data1': 'eth0', 'data2': 'eth2', 'data3': 'eth3'}
+        assert sorted(local.cmd.call_args[0][0]) == ['data2', 'data3']
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_missing_module(self, localclient, filename):
+        local = localclient.return_value
+        missing = "'deepsea.fingerprint' is not available."
+        local.cmd.side_effect = [{'data1': missing},
+                                 {'data1': 'eth0'},
+                                 {'data1': missing}]
+        cache = populate.DiscoveryCache('*', filename)
+        cache.query('network.interfaces', [])
+        cache.save()
+
+        cache = populate.DiscoveryCache('*', filename)
+        assert cache.changed == set(['data1'])
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_unchanged_minions_not_queried(self, localclient, filename):
+        local = localclient.return_value
+        local.cmd.side_effect = [{'data1': 'a'}, {'data1': '10.0.0.1'},
+                                 {'data1': 'a'}]
+        cache = populate.DiscoveryCache('*', filename)
+        cache.query('cmd.run', ['hostname -i'])
+        cache.save()
+
+        cache = populate.DiscoveryCache('*', filename)
+        assert cache.query('cmd.run', ['hostname -i']) == {'data1': '10.0.0.1'}
+        assert local.cmd.call_count == 3
+
+
+class TestSaltWriter():
+
+    def test_unchanged_minion(self, tmpdir):
+        filename = tmpdir.join('data1.sls')
+        filename.write('roles: []\n')
+        writer = populate.SaltWriter(overwrite=True)
+        writer.unchanged = set(['data1'])
+        writer.write(str(filename), {'roles': ['mon']}, 'data1')
+        assert filename.read() == 'roles: []\n'
+        writer.write(str(filename), {'roles': ['mon']}, 'data2')
+        assert 'mon' in filename.read()
+
+
+class TestCephRoles():
+
+    @pytest.fixture()
+    def roles(self):
+        populate.__utils__ = {'subnets.network': subnets.network,
+                              'subnets.index': subnets.index}
+        roles = populate.CephRoles.__new__(populate.CephRoles)
+        roles.discovery = None
+        roles._cidrs = {}
+        yield roles
+        del populate.__utils__
+
+    def test_networks(self, roles):
+        interfaces = {'data1': {'eth0': {'inet': [{'address': '10.0.0.1', 'netmask': '255.255.255.0'}]},
+                                'lo': {'inet': [{'address': '127.0.0.1', 'netmask': '255.0.0.0'}]}},
+                      'data2': {'eth0': {'inet': [{'address': '10.0.0.2', 'netmask': '255.255.255.0'}]}}}
+        with patch.object(roles, '_query', return_value=interfaces):
+            networks = roles._networks([])
+        assert list(networks) == [ipaddress.ip_network(u'10.0.0.0/24')]
+        assert len(networks[ipaddress.ip_network(u'10.0.0.0/24')]) == 2
+
+    @patch('salt.loader.grains')
+    @patch('salt.config.minion_config')
+    def test_public_cluster(self, minion_config, grains, roles):
+        public = ipaddress.ip_network(u'10.0.0.0/24')
+        cluster = ipaddress.ip_network(u'172.16.0.0/24')
+        networks = {public: [('data1', 'eth0', '10.0.0.1'), ('data2', 'eth0', '10.0.0.2')],
+                    cluster: [('data1', 'eth1', '172.16.0.1'), ('data2', 'eth1', '172.16.0.2')]}
+        grains.return_value = {'ipv4': ['127.0.0.1', '10.0.0.10']}
+        results = [{'data1': '10.0.0.1 fe80::1%eth0', 'data2': '10.0.0.2'},
+                   {'data1': ['10.0.0.1', '172.16.0.1'], 'data2': ['10.0.0.2', '172.16.0.2']}]
+        with patch.object(roles, '_query', side_effect=results):
+            assert roles.public_cluster(networks) == ([public], [cluster])
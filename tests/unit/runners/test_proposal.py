@@ -428,3 +428,182 @@ class TestProposalRunner(object):
         # the modified proposal lets the test pass
         result = OrderedDict(sorted(RD.proposal.items()))
         result == minion["expected"]["proposal"]
+
+
+def _disk(dev, serial, vendor="INTEL", capacity="372 GB", rotational="0"):
+    return {
+        "Device File": "/dev/{}".format(dev),
+        "Device Files": "/dev/{0}, /dev/disk/by-id/ata-{1}_SSDSC2BA40_{2}, "
+        "/dev/disk/by-id/wwn-0x{2}, "
+        "/dev/disk/by-path/pci-0000:00:1f.2-ata-{3}".format(
+            dev, vendor, serial, dev[-1]
+        ),
+        "Vendor": vendor,
+        "Capacity": capacity,
+        "rotational": rotational,
+        "Driver": "ahci, sd",
+    }
+
+
+class TestGenerate(object):
+    @pytest.fixture
+    def disks(self):
+        yield {
+            "data1.ceph": [_disk("sda", "A1"), _disk("sdb", "A2")],
+            "data2.ceph": [_disk("sda", "B1"), _disk("sdb", "B2")],
+            "data3.ceph": [_disk("sda", "C1", capacity="1862 GB", rotational="1")],
+        }
+
+    def test_signature(self, disks):
+        assert proposal._signature(disks["data1.ceph"]) == proposal._signature(
+            disks["data2.ceph"]
+        )
+        assert proposal._signature(disks["data1.ceph"]) != proposal._signature(
+            disks["data3.ceph"]
+        )
+
+    def test_label(self):
+        assert proposal._label({"Vendor": "Intel Corp", "Capacity": "372 GB"}) == (
+            "Intel372GB"
+        )
+        assert proposal._label({"Model": "Disk", "Capacity": "10 GB"}) == "Disk10GB"
+
+    def test_map_proposal(self, disks):
+        mapping = proposal._device_map(disks["data1.ceph"], disks["data2.ceph"])
+        prop = {
+            "standalone": [{"/dev/disk/by-id/ata-INTEL_SSDSC2BA40_A1": ""}],
+            "ssd-spinner": [
+                {"/dev/disk/by-id/ata-INTEL_SSDSC2BA40_A1": "/dev/sdb"},
+                {"/dev/disk/by-path/pci-0000:00:1f.2-ata-b": "/dev/sda"},
+            ],
+        }
+        assert proposal._map_proposal(prop, mapping) == {
+            "standalone": [{"/dev/disk/by-id/ata-INTEL_SSDSC2BA40_B1": ""}],
+            "ssd-spinner": [
+                {"/dev/disk/by-id/ata-INTEL_SSDSC2BA40_B1": "/dev/sdb"},
+                {"/dev/disk/by-path/pci-0000:00:1f.2-ata-b": "/dev/sda"},
+            ],
+        }
+
+    def test_map_proposal_unknown_device(self, disks):
+        mapping = proposal._device_map(disks["data1.ceph"], disks["data2.ceph"])
+        assert proposal._map_proposal([{"/dev/disk/by-id/unknown": ""}], mapping) is None
+        assert proposal._map_proposal([{u"/dev/disk/by-id/unknown": u""}], mapping) is None
+
+    def test_generate(self, disks):
+        prop = {"standalone": [{"/dev/disk/by-id/ata-INTEL_SSDSC2BA40_A1": ""}]}
+        with patch("salt.client.LocalClient", autospec=True):
+            local_client = proposal.salt.client.LocalClient()
+            local_client.cmd.side_effect = [
+                disks,
+                {"data1.ceph": prop, "data3.ceph": {"standalone": []}},
+            ]
+            ret = proposal._generate(local_client, "*", {})
+
+        assert ret["data2.ceph"] == {
+            "standalone": [{"/dev/disk/by-id/ata-INTEL_SSDSC2BA40_B1": ""}]
+        }
+        assert ret["data3.ceph"] == {"standalone": []}
+        assert local_client.cmd.call_count == 2
+        targets = local_client.cmd.call_args_list[1][0][0]
+        assert sorted(targets) == ["data1.ceph", "data3.ceph"]
+
+    def test_generate_fallback(self, disks):
+        with patch("salt.client.LocalClient", autospec=True):
+            local_client = proposal.salt.client.LocalClient()
+            local_client.cmd.side_effect = [
+                disks,
+                {"data1.ceph": {"standalone": [{"/dev/disk/by-id/other": ""}]}},
+                {"data2.ceph": {"standalone": []}},
+            ]
+            ret = proposal._generate(local_client, "*", {})
+
+        assert ret["data2.ceph"] == {"standalone": []}
+        assert local_client.cmd.call_args_list[2][0][0] == ["data2.ceph"]
+
+
+class TestProposalWriter(object):
+    @pytest.fixture
+    def proposals(self):
+        yield [
+            {"data1.ceph": {"/dev/sda": {"format": "bluestore"}}},
+            {"data2.ceph": {"/dev/sdb": {"format": "bluestore"}}},
+        ]
+
+    def test_write(self, tmpdir, proposals):
+        profile_dir = str(tmpdir.join("profile-default"))
+        manifest = proposal.ProposalWriter(profile_dir).write(
+            proposals, {"target": "*"}
+        )
+
+        assert manifest["minions"] == ["data1.ceph", "data2.ceph"]
+        assert "cluster/data1.ceph.sls" in manifest["files"]
+        assert "stack/default/ceph/minions/data2.ceph.yml" in manifest["files"]
+        assert tmpdir.join(
+            "profile-default", "stack", "default", "ceph", "minions", "data1.ceph.yml"
+        ).check()
+        assert tmpdir.join("profile-default", ".filter").check()
+        assert tmpdir.join("profile-default", ".manifest").check()
+        assert tmpdir.join("profile-default").check(link=1)
+        assert len(tmpdir.listdir()) == 2
+
+    def test_write_replaces_version(self, tmpdir, proposals):
+        profile_dir = str(tmpdir.join("profile-default"))
+        proposal.ProposalWriter(profile_dir).write(proposals, {"target": "*"})
+        first = tmpdir.join("profile-default").readlink()
+        proposal.ProposalWriter(profile_dir).write(proposals, {"target": "*"})
+
+        assert tmpdir.join("profile-default").readlink() != first
+        assert not tmpdir.join(first).check()
+        assert len(tmpdir.listdir()) == 2
+
+    def test_write_replaces_directory(self, tmpdir, proposals):
+        tmpdir.mkdir("profile-default").join("old").write("")
+        profile_dir = str(tmpdir.join("profile-default"))
+        proposal.ProposalWriter(profile_dir).write(proposals, {"target": "*"})
+
+        assert tmpdir.join("profile-default").check(link=1)
+        assert tmpdir.join("profile-default", "old").check()
+        assert len(tmpdir.listdir()) == 2
+
+    def test_write_replaces_directory_without_exchange(self, tmpdir, proposals):
+        tmpdir.mkdir("profile-default").join("old").write("")
+        profile_dir = str(tmpdir.join("profile-default"))
+        with patch("srv.modules.runners.proposal._exchange", return_value=False):
+            proposal.ProposalWriter(profile_dir).write(proposals, {"target": "*"})
+
+        assert tmpdir.join("profile-default").check(link=1)
+        assert len(tmpdir.listdir()) == 2
+
+    def test_write_unchanged(self, tmpdir, proposals):
+        profile_dir = str(tmpdir.join("profile-default"))
+        proposal.ProposalWriter(profile_dir).write(proposals, {"target": "*"})
+        proposals.append({"data3.ceph": {"/dev/sdc": {"format": "bluestore"}}})
+        manifest = proposal.ProposalWriter(profile_dir).write(
+            proposals, {"target": "*"}
+        )
+
+        assert manifest["minions"] == ["data3.ceph"]
+
+    def test_write_keeps_existing_proposal(self, tmpdir, proposals):
+        profile_dir = str(tmpdir.join("profile-default"))
+        proposal.ProposalWriter(profile_dir).write(proposals, {"target": "*"})
+        proposals[0]["data1.ceph"] = {"/dev/sdz": {"format": "filestore"}}
+        proposal.ProposalWriter(profile_dir).write(proposals, {"target": "*"})
+
+        content = tmpdir.join(
+            "profile-default", "stack", "default", "ceph", "minions", "data1.ceph.yml"
+        ).read()
+        assert "/dev/sda" in content
+
+    def test_write_failure(self, tmpdir, proposals):
+        profile_dir = str(tmpdir.join("profile-default"))
+        proposal.ProposalWriter(profile_dir).write(proposals, {"target": "*"})
+        first = tmpdir.join("profile-default").readlink()
+        with patch("srv.modules.runners.proposal._record_filter") as record:
+            record.side_effect = IOError
+            with pytest.raises(IOError):
+                proposal.ProposalWriter(profile_dir).write(proposals, {"target": "*"})
+
+        assert tmpdir.join("profile-default").readlink() == first
+        assert len(tmpdir.listdir()) == 2
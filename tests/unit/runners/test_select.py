@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# vim: ts=8 et sw=4 sts=4
+
+import pytest
+from mock import patch
+from srv.modules.runners import select
+
+
+class TestFailureDomains():
+
+    @pytest.fixture(scope='class')
+    def tree(self):
+        yield {'nodes': [
+            {'id': -1, 'name': 'default', 'type': 'root', 'children': [-2, -3]},
+            {'id': -2, 'name': 'rack1', 'type': 'rack', 'children': [-4, -5]},
+            {'id': -3, 'name': 'rack2', 'type': 'rack', 'children': [-6]},
+            {'id': -4, 'name': 'data1', 'type': 'host', 'children': [0]},
+            {'id': -5, 'name': 'data2', 'type': 'host', 'children': [1]},
+            {'id': -6, 'name': 'data3', 'type': 'host', 'children': [2]},
+            {'id': 0, 'name': 'osd.0', 'type': 'osd'},
+            {'id': 1, 'name': 'osd.1', 'type': 'osd'},
+            {'id': 2, 'name': 'osd.2', 'type': 'osd'}]}
+
+    def test_crush_domains(self, tree):
+        ret = select._crush_domains(tree, 'rack')
+        assert ret == {'data1': 'rack1', 'data2': 'rack1', 'data3': 'rack2'}
+
+    def test_crush_domains_missing_type(self, tree):
+        ret = select._crush_domains(tree, 'row')
+        assert ret == {'data1': 'data1', 'data2': 'data2', 'data3': 'data3'}
+
+    def _run(self, tree, **kwargs):
+        minions = ['data1.ceph', 'data2.ceph', 'data3.ceph', 'data4.ceph']
+        grains = {m: {'host': m.split('.')[0]} for m in minions}
+        with patch.object(select, 'minions', return_value=minions), \
+                patch('salt.client.LocalClient', autospec=True) as localclient:
+            local = localclient.return_value
+            local.cmd.side_effect = [grains, {'master.ceph': tree}]
+            select.__salt__ = {'master.minion': lambda: 'master.ceph'}
+            return select.failure_domains(**kwargs)
+
+    def test_failure_domains(self, tree):
+        ret = self._run(tree, cluster='ceph', roles='storage')
+        assert ret == [['data1.ceph', 'data4.ceph', 'data3.ceph'],
+                       ['data2.ceph']]
+
+    def test_failure_domains_hosts(self, tree):
+        ret = self._run(tree, hosts=2, cluster='ceph', roles='storage')
+        assert ret == [['data1.ceph', 'data4.ceph'],
+                       ['data2.ceph', 'data3.ceph']]
@@ -0,0 +1,66 @@
+import ipaddress
+from itertools import islice
+import pytest
+from srv.modules.utils import subnets
+
+
+class TestSubnets():
+    """
+    A class for checking the integer subnet index
+    """
+
+    def test_address(self):
+        assert subnets.address('10.0.0.1') == (4, 0x0a000001)
+
+    def test_address_ipv6(self):
+        assert subnets.address('fd00::1') == (6, (0xfd00 << 112) + 1)
+
+    @pytest.mark.parametrize("addr", ['fe80::1%eth0', 'host', '', '10.0.0.256'])
+    def test_address_invalid(self, addr):
+        assert subnets.address(addr) is None
+
+    def test_network_cidr(self):
+        assert subnets.network('10.0.1.17/24') == (4, 0x0a000100, 24)
+
+    def test_network_netmask(self):
+        assert subnets.network('10.0.1.17', '255.255.0.0') == (4, 0x0a000000, 16)
+
+    def test_network_invalid(self):
+        assert subnets.network('10.0.1.17') is None
+        assert subnets.network('10.0.1.17/33') is None
+
+    def test_filter(self):
+        addresses = ['10.0.0.1', '10.0.1.1', '192.168.1.1', 'fd00::1', 'fe80::1%eth0']
+        result = subnets.filter_addresses(addresses, '10.0.0.0/24, fd00::/64')
+        assert result == ['10.0.0.1', 'fd00::1']
+
+    def test_filter_nested(self):
+        index = subnets.index(['10.0.0.0/8', '10.0.0.0/24'])
+        assert sorted(index.lookup('10.0.0.1')) == ['10.0.0.0/24', '10.0.0.0/8']
+        assert index.lookup('10.1.0.1') == ['10.0.0.0/8']
+
+    def test_values(self):
+        network = ipaddress.ip_network(u'172.16.0.0/16')
+        index = subnets.index()
+        index.add(str(network), network)
+        assert index.lookup('172.16.3.4') == [network]
+
+    def test_count(self):
+        index = subnets.index('10.0.0.0/24,10.0.1.0/24')
+        addresses = ['10.0.0.1', '10.0.0.2', '10.0.1.1', '127.0.0.1']
+        assert index.count(addresses) == {'10.0.0.0/24': 2, '10.0.1.0/24': 1}
+        assert index.most_common(addresses) == '10.0.0.0/24'
+
+    def test_most_common_empty(self):
+        assert subnets.index('10.0.0.0/24').most_common(['192.168.0.1']) is None
+
+    @pytest.mark.parametrize("cidr", ['10.20.30.0/23', '192.168.0.0/30', 'fd00:1::/48'])
+    def test_matches_ipaddress(self, cidr):
+        network = ipaddress.ip_network(u'{}'.format(cidr))
+        index = subnets.index(cidr)
+        for host in list(islice(network.hosts(), 5)) + [network.broadcast_address + 1]:
+            assert index.contains(str(host)) == (host in network)
+
+    def test_unicode(self):
+        assert subnets.filter_addresses([u'10.0.0.5', b'10.0.1.5'], u'10.0.0.0/24') == ['10.0.0.5']
+        assert subnets.index([u'fd00::/64']).contains(u'fd00::1')